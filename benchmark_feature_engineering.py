@@ -0,0 +1,67 @@
+"""
+Benchmark - add_engineered_features (kolumnvis) mot radvis df.apply
+===================================================================
+Kör: python benchmark_feature_engineering.py [antal_fall ...]
+
+Genererar syntetiska fall, kontrollerar att båda implementationerna ger
+samma features och skriver ut körtid per implementation.
+"""
+import sys
+import time
+import random
+import pandas as pd
+
+from config import LÄKEMEDELS_DATA
+from feature_engineering import add_engineered_features, add_engineered_features_rowwise
+
+
+def make_cases(n: int, seed: int = 42) -> pd.DataFrame:
+    """Syntetiska fall med blandade adjuvantval."""
+    rng = random.Random(seed)
+    choices = [drug['ui_choice'] for drug in LÄKEMEDELS_DATA.values() if drug.get('ui_choice')]
+    rows = []
+    for _ in range(n):
+        rows.append({
+            'procedure_id': f"proc_{rng.randint(0, 49)}",
+            'nsaid': rng.random() < 0.7,
+            'nsaid_choice': rng.choice(choices + ['Ej given']),
+            'catapressan': rng.random() < 0.2,
+            'catapressan_dose': rng.choice([0, 0, 75]),
+            'droperidol': rng.random() < 0.3,
+            'ketamine': rng.choice(['Nej', 'Ja']),
+            'ketamine_choice': rng.choice(choices + ['Ej given']),
+            'lidocaine': rng.choice(['Nej', 'Bolus', 'Infusion']),
+            'betapred': rng.choice(['Nej', '4 mg', '8 mg']),
+        })
+    return pd.DataFrame(rows)
+
+
+def make_procedures(seed: int = 42) -> pd.DataFrame:
+    rng = random.Random(seed)
+    return pd.DataFrame([{
+        'id': f"proc_{i}",
+        'somatic_score': rng.randint(0, 10),
+        'visceral_score': rng.randint(0, 10),
+        'neuropathic_score': rng.randint(0, 10),
+    } for i in range(45)])  # Några ingrepp saknas -> defaults
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main(sizes):
+    procedures_df = make_procedures()
+    print(f"{'fall':>8} {'radvis (s)':>12} {'kolumnvis (s)':>14} {'speedup':>9}")
+    for n in sizes:
+        cases_df = make_cases(n)
+        expected, rowwise_time = _timed(add_engineered_features_rowwise, cases_df, procedures_df)
+        result, vectorized_time = _timed(add_engineered_features, cases_df, procedures_df)
+        pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+        print(f"{n:>8} {rowwise_time:>12.3f} {vectorized_time:>14.4f} {rowwise_time / vectorized_time:>8.0f}x")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [1_000, 10_000])
@@ -1,6 +1,8 @@
 import math
 import logging
 from typing import Dict, Tuple
+import numpy as np
+import pandas as pd
 import database as db
 import auth
 from config import APP_CONFIG, LÄKEMEDELS_DATA, get_drug_by_ui_choice, calculate_3d_mismatch_penalty
@@ -11,6 +13,7 @@ from body_composition_utils import (
     get_bmi_bucket
 )
 from interpolation_engine import interpolate_age_factor, interpolate_weight_factor
+from learning_snapshot import get_cached_learning_snapshot
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -126,6 +129,29 @@ def calculate_lean_body_mass(weight_kg: float, height_cm: float, sex: str = 'Man
 
     return lbm
 
+def calculate_lean_body_mass_batch(weight_kg: np.ndarray, height_cm: np.ndarray, female: np.ndarray) -> np.ndarray:
+    """
+    Vektoriserad calculate_lean_body_mass (James formula) för många patienter.
+
+    Args:
+        weight_kg: Vikt i kg
+        height_cm: Längd i cm
+        female: True för 'Kvinna' (övriga använder mansformeln, som i calculate_lean_body_mass)
+
+    Returns:
+        Lean body mass i kg
+    """
+    weight = np.asarray(weight_kg, dtype=np.float64)
+    height_m = np.asarray(height_cm, dtype=np.float64) / 100.0
+    valid = (weight > 0) & (height_m > 0)
+
+    ratio_sq = (weight / np.where(valid, height_m, 1.0)) ** 2
+    lbm = np.where(female, 1.07 * weight - 148 * ratio_sq, 1.10 * weight - 128 * ratio_sq)
+    lbm = np.clip(lbm, weight * 0.40, weight * 0.95)
+
+    return np.where(valid, lbm, weight * 0.75)
+
+
 def calculate_age_factor(age: int) -> float:
     """
     Beräkna åldersfaktor för dos-justering.
@@ -146,7 +172,8 @@ def apply_learnable_adjuvant(
     base_ime_before_adjuvants: float,
     drug_data: dict,
     procedure_pain_3d: dict,
-    user_id: int = None
+    user_id: int = None,
+    snapshot=None
 ) -> float:
     """
     Beräkna adjuvant-reduktion med 3D pain matching och percentage-based potency.
@@ -156,6 +183,7 @@ def apply_learnable_adjuvant(
         drug_data: Dictionary från LÄKEMEDELS_DATA
         procedure_pain_3d: {'somatic': X, 'visceral': Y, 'neuropathic': Z}
         user_id: User ID för global inlärning
+        snapshot: LearningSnapshot (None = läs från databasen)
 
     Returns:
         IME reduction från denna adjuvant
@@ -180,7 +208,8 @@ def apply_learnable_adjuvant(
             # Need to match against database keys
             drug_key = next((k for k, v in LÄKEMEDELS_DATA.items() if v.get('name') == drug_name), None)
             if drug_key:
-                potency_percent = db.get_adjuvant_potency_percent(drug_key, base_potency_percent)
+                source = snapshot if snapshot is not None else db
+                potency_percent = source.get_adjuvant_potency_percent(drug_key, base_potency_percent)
             else:
                 potency_percent = base_potency_percent
         except Exception as e:
@@ -198,8 +227,9 @@ def apply_learnable_adjuvant(
 
     return effective_reduction
 
-def _get_initial_ime_and_pain_type(inputs, procedures_df):
+def _get_initial_ime_and_pain_type(inputs, procedures_df, snapshot=None):
     user_id = auth.get_current_user_id()
+    source = snapshot if snapshot is not None else db
     procedure = procedures_df[procedures_df['id'] == inputs['procedure_id']].iloc[0]
     default_base_ime = float(procedure['baseIME'])
 
@@ -211,7 +241,7 @@ def _get_initial_ime_and_pain_type(inputs, procedures_df):
     if user_id:
         # IMPLEMENTED IN V6: Global 3D pain learning
         try:
-            learned = db.get_procedure_learning_3d(
+            learned = source.get_procedure_learning_3d(
                 inputs['procedure_id'],
                 default_base_ime,
                 default_pain_somatic,
@@ -239,20 +269,24 @@ def _get_initial_ime_and_pain_type(inputs, procedures_df):
         'neuropathic': default_pain_neuropathic
     }, procedure
 
-def _apply_patient_factors(ime, inputs):
+def _apply_patient_factors(ime, inputs, snapshot=None):
     user_id = auth.get_current_user_id()
+    source = snapshot if snapshot is not None else db
 
     # Age factor with INTERPOLATION
     # Uses fine-grained buckets (every year) with intelligent interpolation from nearby ages
     default_age_factor = calculate_age_factor(inputs['age'])
     if user_id:
         try:
-            from interpolation_engine import interpolate_age_factor
-            result = interpolate_age_factor(inputs['age'], default_age_factor)
-            age_factor = result['age_factor']
-            # Log interpolation method for transparency
-            if result['method'] == 'interpolated':
-                logger.debug(f"Age {inputs['age']}: Interpolated from {result.get('nearby_count', 0)} nearby ages")
+            if snapshot is not None:
+                # O(1) uppslag i förberäknad, utjämnad ålderskurva
+                age_factor = snapshot.get_smoothed_age_factor(inputs['age'], default_age_factor)
+            else:
+                result = interpolate_age_factor(inputs['age'], default_age_factor)
+                age_factor = result['age_factor']
+                # Log interpolation method for transparency
+                if result['method'] == 'interpolated':
+                    logger.debug(f"Age {inputs['age']}: Interpolated from {result.get('nearby_count', 0)} nearby ages")
         except Exception as e:
             logger.warning(f"Age interpolation failed, using default: {e}")
             age_factor = default_age_factor
@@ -265,13 +299,13 @@ def _apply_patient_factors(ime, inputs):
     asa_class = inputs.get('asa', 'ASA 2')
     asa_num = asa_map.get(asa_class, 2)
     default_asa_factor = APP_CONFIG['DEFAULTS']['ASA_FACTORS'].get(asa_num, 1.0)
-    asa_factor = db.get_asa_factor(asa_class, default_asa_factor) if user_id else default_asa_factor
+    asa_factor = source.get_asa_factor(asa_class, default_asa_factor) if user_id else default_asa_factor
     ime *= asa_factor
 
     # Sex factor
     sex = inputs.get('sex', 'Man')
     default_sex_factor = 1.0
-    sex_factor = db.get_sex_factor(sex, default_sex_factor) if user_id else default_sex_factor
+    sex_factor = source.get_sex_factor(sex, default_sex_factor) if user_id else default_sex_factor
     ime *= sex_factor
 
     # 4D Body composition learning (NEW)
@@ -288,15 +322,17 @@ def _apply_patient_factors(ime, inputs):
             # Dimension 1: ACTUAL WEIGHT with INTERPOLATION (every kg)
             # 73.4kg patient (bucket=73) can interpolate from 70kg, 72kg, 75kg, etc
             try:
-                from interpolation_engine import interpolate_weight_factor
-                result = interpolate_weight_factor(weight, 1.0)
-                body_comp_factor = result['weight_factor']
-                if result['method'] == 'interpolated':
-                    logger.debug(f"Weight {weight:.1f}kg: Interpolated from {result.get('nearby_count', 0)} nearby weights")
+                if snapshot is not None:
+                    body_comp_factor = snapshot.get_smoothed_weight_factor(weight, 1.0)
+                else:
+                    result = interpolate_weight_factor(weight, 1.0)
+                    body_comp_factor = result['weight_factor']
+                    if result['method'] == 'interpolated':
+                        logger.debug(f"Weight {weight:.1f}kg: Interpolated from {result.get('nearby_count', 0)} nearby weights")
             except Exception as e:
                 logger.warning(f"Weight interpolation failed, using default: {e}")
                 weight_bucket = get_weight_bucket(weight)
-                body_comp_factor = db.get_body_composition_factor('weight', weight_bucket, 1.0) if hasattr(db, 'get_body_composition_factor') else 1.0
+                body_comp_factor = source.get_body_composition_factor('weight', weight_bucket, 1.0)
             ime *= body_comp_factor
 
             if ibw > 0:
@@ -304,7 +340,7 @@ def _apply_patient_factors(ime, inputs):
                 # 1.47x patient benefits from learning on 1.5x bucket
                 ibw_ratio = weight / ibw
                 ibw_ratio_bucket = get_ibw_ratio_bucket(ibw_ratio)
-                ibw_factor = db.get_body_composition_factor('ibw_ratio', ibw_ratio_bucket, 1.0)
+                ibw_factor = source.get_body_composition_factor('ibw_ratio', ibw_ratio_bucket, 1.0)
                 ime *= ibw_factor
 
                 # Dimension 3: ABW RATIO (for overweight patients, 0.1 increments)
@@ -312,36 +348,36 @@ def _apply_patient_factors(ime, inputs):
                 if weight > ibw * 1.2:
                     abw_ratio = abw / ibw
                     abw_ratio_bucket = get_abw_ratio_bucket(abw_ratio)
-                    abw_factor = db.get_body_composition_factor('abw_ratio', abw_ratio_bucket, 1.0)
+                    abw_factor = source.get_body_composition_factor('abw_ratio', abw_ratio_bucket, 1.0)
                     ime *= abw_factor
 
             # Dimension 4: BMI (7 categories)
             # BMI 33.2 patient benefits from learning on obese class I (32) bucket
             bmi_bucket = get_bmi_bucket(bmi)
-            bmi_factor = db.get_body_composition_factor('bmi', bmi_bucket, 1.0)
+            bmi_factor = source.get_body_composition_factor('bmi', bmi_bucket, 1.0)
             ime *= bmi_factor
 
     # Opioid tolerance
     if inputs['opioidHistory'] == 'Opioidtolerant':
         default_opioid_factor = APP_CONFIG['DEFAULTS']['OPIOID_TOLERANCE_FACTOR']
-        opioid_factor = db.get_opioid_tolerance_factor() if user_id else default_opioid_factor
+        opioid_factor = source.get_opioid_tolerance_factor() if user_id else default_opioid_factor
         ime *= opioid_factor
 
     # Pain threshold
     if inputs['lowPainThreshold']:
         default_pain_threshold_factor = APP_CONFIG['DEFAULTS']['PAIN_THRESHOLD_FACTOR']
-        pain_threshold_factor = db.get_pain_threshold_factor() if user_id else default_pain_threshold_factor
+        pain_threshold_factor = source.get_pain_threshold_factor() if user_id else default_pain_threshold_factor
         ime *= pain_threshold_factor
 
     # Renal impairment
     if inputs.get('renalImpairment', False):
         default_renal_factor = APP_CONFIG['DEFAULTS']['RENAL_IMPAIRMENT_FACTOR']
-        renal_factor = db.get_renal_factor() if user_id else default_renal_factor
+        renal_factor = source.get_renal_factor() if user_id else default_renal_factor
         ime *= renal_factor
 
     return ime
 
-def _apply_adjuvants(base_ime_before_adjuvants, inputs, pain_type_3d):
+def _apply_adjuvants(base_ime_before_adjuvants, inputs, pain_type_3d, snapshot=None):
     """
     Applicera alla adjuvanter med unified LÄKEMEDELS_DATA.
 
@@ -353,6 +389,7 @@ def _apply_adjuvants(base_ime_before_adjuvants, inputs, pain_type_3d):
         base_ime_before_adjuvants: Base IME efter patient factors, före adjuvants
         inputs: Patient inputs
         pain_type_3d: {'somatic': X, 'visceral': Y, 'neuropathic': Z}
+        snapshot: LearningSnapshot (None = läs från databasen)
 
     Returns:
         Final IME efter alla adjuvant-reductions
@@ -365,7 +402,7 @@ def _apply_adjuvants(base_ime_before_adjuvants, inputs, pain_type_3d):
     if nsaid_choice != 'Ej given':
         drug_data = get_drug_by_ui_choice('nsaid', nsaid_choice)
         if drug_data:
-            reduction = apply_learnable_adjuvant(base_ime_before_adjuvants, drug_data, pain_type_3d, user_id)
+            reduction = apply_learnable_adjuvant(base_ime_before_adjuvants, drug_data, pain_type_3d, user_id, snapshot)
             total_reduction += reduction
 
     # Catapressan (dosbaserad - skala percentage med dos)
@@ -378,14 +415,14 @@ def _apply_adjuvants(base_ime_before_adjuvants, inputs, pain_type_3d):
             dose_scaling = catapressan_dose / ref_dose
             scaled_drug_data = drug_data.copy()
             scaled_drug_data['potency_percent'] = drug_data['potency_percent'] * dose_scaling
-            reduction = apply_learnable_adjuvant(base_ime_before_adjuvants, scaled_drug_data, pain_type_3d, user_id)
+            reduction = apply_learnable_adjuvant(base_ime_before_adjuvants, scaled_drug_data, pain_type_3d, user_id, snapshot)
             total_reduction += reduction
 
     # Droperidol
     if inputs.get('droperidol', False):
         drug_data = LÄKEMEDELS_DATA.get('droperidol')
         if drug_data:
-            reduction = apply_learnable_adjuvant(base_ime_before_adjuvants, drug_data, pain_type_3d, user_id)
+            reduction = apply_learnable_adjuvant(base_ime_before_adjuvants, drug_data, pain_type_3d, user_id, snapshot)
             total_reduction += reduction
 
     # Ketamin
@@ -393,7 +430,7 @@ def _apply_adjuvants(base_ime_before_adjuvants, inputs, pain_type_3d):
     if ketamine_choice != 'Ej given':
         drug_data = get_drug_by_ui_choice('ketamine', ketamine_choice)
         if drug_data:
-            reduction = apply_learnable_adjuvant(base_ime_before_adjuvants, drug_data, pain_type_3d, user_id)
+            reduction = apply_learnable_adjuvant(base_ime_before_adjuvants, drug_data, pain_type_3d, user_id, snapshot)
             total_reduction += reduction
 
     # Lidokain
@@ -401,7 +438,7 @@ def _apply_adjuvants(base_ime_before_adjuvants, inputs, pain_type_3d):
     if lidocaine_choice != 'Nej':
         drug_data = get_drug_by_ui_choice('lidocaine', lidocaine_choice)
         if drug_data:
-            reduction = apply_learnable_adjuvant(base_ime_before_adjuvants, drug_data, pain_type_3d, user_id)
+            reduction = apply_learnable_adjuvant(base_ime_before_adjuvants, drug_data, pain_type_3d, user_id, snapshot)
             total_reduction += reduction
 
     # Betapred
@@ -409,21 +446,21 @@ def _apply_adjuvants(base_ime_before_adjuvants, inputs, pain_type_3d):
     if betapred_choice != 'Nej':
         drug_data = get_drug_by_ui_choice('betapred', betapred_choice)
         if drug_data:
-            reduction = apply_learnable_adjuvant(base_ime_before_adjuvants, drug_data, pain_type_3d, user_id)
+            reduction = apply_learnable_adjuvant(base_ime_before_adjuvants, drug_data, pain_type_3d, user_id, snapshot)
             total_reduction += reduction
 
     # Sevoflurane
     if inputs.get('sevoflurane', False):
         drug_data = LÄKEMEDELS_DATA.get('sevoflurane')
         if drug_data:
-            reduction = apply_learnable_adjuvant(base_ime_before_adjuvants, drug_data, pain_type_3d, user_id)
+            reduction = apply_learnable_adjuvant(base_ime_before_adjuvants, drug_data, pain_type_3d, user_id, snapshot)
             total_reduction += reduction
 
     # Infiltration
     if inputs.get('infiltration', False):
         drug_data = LÄKEMEDELS_DATA.get('infiltration')
         if drug_data:
-            reduction = apply_learnable_adjuvant(base_ime_before_adjuvants, drug_data, pain_type_3d, user_id)
+            reduction = apply_learnable_adjuvant(base_ime_before_adjuvants, drug_data, pain_type_3d, user_id, snapshot)
             total_reduction += reduction
 
     # Apply total reduction
@@ -431,12 +468,13 @@ def _apply_adjuvants(base_ime_before_adjuvants, inputs, pain_type_3d):
 
     return final_ime
 
-def _apply_synergy_and_safety_limits(ime, inputs, base_ime_before_adjuvants):
+def _apply_synergy_and_safety_limits(ime, inputs, base_ime_before_adjuvants, snapshot=None):
     user_id = auth.get_current_user_id()
     if user_id:
+        source = snapshot if snapshot is not None else db
         drug_combo = db.get_drug_combination_key(inputs)
         if drug_combo:
-            synergy_factor = db.get_synergy_factor(drug_combo)
+            synergy_factor = source.get_synergy_factor(drug_combo)
             ime *= synergy_factor
 
     min_ime_allowed = base_ime_before_adjuvants * APP_CONFIG['ADJUVANT_SAFETY_LIMIT_FACTOR']
@@ -444,9 +482,10 @@ def _apply_synergy_and_safety_limits(ime, inputs, base_ime_before_adjuvants):
 
     return ime
 
-def _apply_fentanyl_pharmacokinetics(ime, inputs):
+def _apply_fentanyl_pharmacokinetics(ime, inputs, snapshot=None):
     user_id = auth.get_current_user_id()
-    fentanyl_remaining_fraction = db.get_fentanyl_remaining_fraction() if user_id else APP_CONFIG['FENTANYL_HALFLIFE_FRACTION']
+    source = snapshot if snapshot is not None else db
+    fentanyl_remaining_fraction = source.get_fentanyl_remaining_fraction() if user_id else APP_CONFIG['FENTANYL_HALFLIFE_FRACTION']
     fentanyl_ime_remaining = (inputs['fentanylDose'] / 100.0) * APP_CONFIG['FENTANYL_IME_CONVERSION_FACTOR'] * fentanyl_remaining_fraction
     return max(0, ime - fentanyl_ime_remaining)
 
@@ -519,22 +558,31 @@ def _get_composite_key(inputs, procedure):
 
     return f"{procedure['id']}-ASA{asa_num}-{opioid_char}-{nsaid_char}-{catapressan_char}-{droperidol_char}-{ketamine_char}-{lidocaine_char}-{betapred_char}"
 
-def calculate_rule_based_dose(inputs, procedures_df, temporal_doses=None):
+def calculate_rule_based_dose(inputs, procedures_df, temporal_doses=None, snapshot=None):
     """
     Beräkna regelbaserad dos med optional temporal dosering.
 
+    Alla inlärda faktorer läses från en LearningSnapshot, så själva
+    beräkningen gör inga databasanrop. Om ingen snapshot skickas in
+    används den processdelade cachen för inloggade användare.
+
     Args:
         inputs: Patient inputs dictionary
         procedures_df: Procedures dataframe
         temporal_doses: List of temporal dose dictionaries (optional)
+        snapshot: LearningSnapshot (optional)
     """
+    user_id = auth.get_current_user_id()
+    if snapshot is None and user_id:
+        snapshot = get_cached_learning_snapshot()
+
     try:
-        ime, pain_type_3d, procedure = _get_initial_ime_and_pain_type(inputs, procedures_df)
-        ime = _apply_patient_factors(ime, inputs)
+        ime, pain_type_3d, procedure = _get_initial_ime_and_pain_type(inputs, procedures_df, snapshot)
+        ime = _apply_patient_factors(ime, inputs, snapshot)
         base_ime_before_adjuvants = ime
-        ime = _apply_adjuvants(ime, inputs, pain_type_3d)
-        ime = _apply_synergy_and_safety_limits(ime, inputs, base_ime_before_adjuvants)
-        ime = _apply_fentanyl_pharmacokinetics(ime, inputs)
+        ime = _apply_adjuvants(ime, inputs, pain_type_3d, snapshot)
+        ime = _apply_synergy_and_safety_limits(ime, inputs, base_ime_before_adjuvants, snapshot)
+        ime = _apply_fentanyl_pharmacokinetics(ime, inputs, snapshot)
 
         # Apply temporal dosing adjustments if provided
         if temporal_doses:
@@ -543,9 +591,8 @@ def calculate_rule_based_dose(inputs, procedures_df, temporal_doses=None):
         ime = _apply_weight_adjustment(ime, inputs)
 
         composite_key = _get_composite_key(inputs, procedure)
-        user_id = auth.get_current_user_id()
         if user_id:
-            calibration_factor = db.get_calibration_factor(user_id, composite_key)
+            calibration_factor = snapshot.get_calibration_factor(user_id, composite_key)
             ime *= calibration_factor
 
         final_dose = round(max(0, ime / 0.25)) * 0.25
@@ -569,6 +616,323 @@ def calculate_rule_based_dose(inputs, procedures_df, temporal_doses=None):
     except (KeyError, IndexError):
         return {}
 
+# ---------- Vektoriserad batch-beräkning ----------
+
+_ASA_NUM_MAP = {'ASA 1': 1, 'ASA 2': 2, 'ASA 3': 3, 'ASA 4': 4, 'ASA 5': 5}
+_NSAID_KEY_MAP = {
+    'Ibuprofen 400mg': 'NIb',
+    'Ketorolac 30mg': 'NKe',
+    'Parecoxib 40mg': 'NPa',
+}
+_KETAMINE_KEY_MAP = {
+    'Liten bolus (0.05-0.1 mg/kg)': 'KBl',
+    'Stor bolus (0.5-1 mg/kg)': 'KBs',
+    'Liten infusion (0.10-0.15 mg/kg/h)': 'KIl',
+    'Stor infusion (3 mg/kg/h)': 'KIs'
+}
+_MAX_PAIN_DISTANCE = math.sqrt(3 * 10**2)
+
+
+def _batch_column(cases_df, name, default):
+    """Hämta kolumn som Series, med default-värde för saknad kolumn/NaN (motsvarar inputs.get)."""
+    if name in cases_df.columns:
+        return cases_df[name].where(cases_df[name].notna(), default)
+    return pd.Series([default] * len(cases_df), index=cases_df.index, dtype=object)
+
+
+def _map_unique(values: np.ndarray, func) -> np.ndarray:
+    """Applicera en skalär funktion en gång per unikt värde och sprid tillbaka resultatet."""
+    uniques, inverse = np.unique(values, return_inverse=True)
+    mapped = np.array([func(v) for v in uniques.tolist()], dtype=float)
+    return mapped[inverse]
+
+
+def _learned_potency(drug_data: dict, base_potency_percent: float, snapshot) -> float:
+    """Samma potency-uppslag som apply_learnable_adjuvant, men mot en snapshot."""
+    drug_name = drug_data.get('name', '')
+    drug_key = next((k for k, v in LÄKEMEDELS_DATA.items() if v.get('name') == drug_name), None)
+    if drug_key:
+        return snapshot.get_adjuvant_potency_percent(drug_key, base_potency_percent)
+    return base_potency_percent
+
+
+def _batch_adjuvant_reduction(base_ime: np.ndarray, drug_data: dict, potency,
+                              pain_3d: np.ndarray) -> np.ndarray:
+    """
+    Vektoriserad motsvarighet till apply_learnable_adjuvant.
+
+    Args:
+        base_ime: Base IME före adjuvanter, per rad
+        drug_data: Läkemedelsdata från LÄKEMEDELS_DATA
+        potency: Potency per rad (array) eller skalär
+        pain_3d: (n, 3)-array med ingreppets smärtprofil
+
+    Returns:
+        Array med IME-reduktion per rad
+    """
+    drug_pain = np.array([
+        drug_data['somatic_score'],
+        drug_data['visceral_score'],
+        drug_data['neuropathic_score']
+    ], dtype=float)
+    distance = np.sqrt(((pain_3d - drug_pain) ** 2).sum(axis=1))
+    penalty = np.maximum(0.5, 1.0 - distance / _MAX_PAIN_DISTANCE)
+    return base_ime * potency * penalty
+
+
+def calculate_rule_based_dose_batch(cases_df: pd.DataFrame, procedures_df: pd.DataFrame,
+                                    snapshot=None) -> pd.DataFrame:
+    """
+    Beräkna regelbaserad dos för många patienter samtidigt med NumPy.
+
+    Ger samma resultat som calculate_rule_based_dose() för en inloggad
+    användare (dvs. med inlärning aktiv), men alla steg körs som
+    array-operationer. Skalära uppslag (interpolation, inlärda faktorer)
+    görs en gång per unikt värde, inte per rad. Temporal dosering ingår inte.
+
+    Args:
+        cases_df: En rad per patient med samma kolumner som inputs-dict
+            (procedure_id, age, sex, weight, height, asa, opioidHistory, ...).
+            Valfri kolumn 'user_id' används för kalibreringsfaktorn.
+        procedures_df: Procedures dataframe
+        snapshot: LearningSnapshot (None = processdelad cache)
+
+    Returns:
+        DataFrame med samma index som cases_df och kolumnerna
+        'finalDose', 'compositeKey', 'ibw', 'abw'. Rader med okänt
+        ingrepp får NaN som dos.
+    """
+    if snapshot is None:
+        snapshot = get_cached_learning_snapshot()
+
+    n = len(cases_df)
+    index = cases_df.index
+    if n == 0:
+        return pd.DataFrame({'finalDose': [], 'compositeKey': [], 'ibw': [], 'abw': []})
+
+    # --- Ingrepp: base IME och 3D-smärtprofil (inlärd per unikt ingrepp) ---
+    procedure_ids = cases_df['procedure_id']
+    procs = procedures_df.drop_duplicates('id').set_index('id')
+    proc_table = {}
+    for proc_id in pd.unique(procedure_ids):
+        if proc_id not in procs.index:
+            continue
+        procedure = procs.loc[proc_id]
+        learned = snapshot.get_procedure_learning_3d(
+            proc_id,
+            float(procedure['baseIME']),
+            float(procedure.get('painTypeScore', 5)),
+            float(procedure.get('painVisceral', 5)),
+            float(procedure.get('painNeuropathic', 2))
+        )
+        proc_table[proc_id] = (
+            learned['base_ime'],
+            learned['pain_somatic'],
+            learned['pain_visceral'],
+            learned['pain_neuropathic']
+        )
+    proc_values = np.array(
+        [proc_table.get(pid, (np.nan, np.nan, np.nan, np.nan)) for pid in procedure_ids.tolist()],
+        dtype=float
+    ).reshape(n, 4)
+    known_procedure = ~np.isnan(proc_values[:, 0])
+    ime = proc_values[:, 0].copy()
+    pain_3d = proc_values[:, 1:4]
+
+    # --- Ålder ---
+    age = cases_df['age'].to_numpy(dtype=float)
+    ime *= _map_unique(age, lambda a: snapshot.get_smoothed_age_factor(a, calculate_age_factor(a)))
+
+    # --- ASA och kön ---
+    asa = _batch_column(cases_df, 'asa', 'ASA 2').astype(str)
+    asa_defaults = APP_CONFIG['DEFAULTS']['ASA_FACTORS']
+    asa_lookup = {
+        asa_class: snapshot.get_asa_factor(asa_class, asa_defaults.get(_ASA_NUM_MAP.get(asa_class, 2), 1.0))
+        for asa_class in pd.unique(asa)
+    }
+    ime *= asa.map(asa_lookup).to_numpy(dtype=float)
+
+    sex = _batch_column(cases_df, 'sex', 'Man').astype(str)
+    sex_lookup = {s: snapshot.get_sex_factor(s, 1.0) for s in pd.unique(sex)}
+    ime *= sex.map(sex_lookup).to_numpy(dtype=float)
+
+    # --- Kroppssammansättning ---
+    weight_input = _batch_column(cases_df, 'weight', 0).to_numpy(dtype=float)
+    height_input = _batch_column(cases_df, 'height', 0).to_numpy(dtype=float)
+    is_female = (sex == 'Kvinna').to_numpy()
+    has_body = (weight_input > 0) & (height_input > 0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        height_m = height_input / CM_TO_METERS
+        bmi = np.where(has_body, weight_input / (height_m * height_m), 0.0)
+    ibw_body = np.maximum(
+        MIN_IDEAL_WEIGHT,
+        height_input - np.where(is_female, FEMALE_HEIGHT_ADJUSTMENT, MALE_HEIGHT_ADJUSTMENT)
+    )
+    overweight = weight_input > ibw_body * OVERWEIGHT_THRESHOLD_MULTIPLIER
+    abw_body = np.where(overweight, ibw_body + (weight_input - ibw_body) * WEIGHT_ADJUSTMENT_FACTOR, weight_input)
+
+    if has_body.any():
+        weight_bucket = np.round(weight_input[has_body])
+        ime[has_body] *= _map_unique(weight_bucket, lambda w: snapshot.get_smoothed_weight_factor(w, 1.0))
+
+        def metric_factors(metric_type, values):
+            # Pythons round() för exakt samma bucket-nyckel som skalära vägen
+            table = {v: f for (m, v), f in snapshot.body_composition.items() if m == metric_type}
+            if not table:
+                return np.ones(len(values))
+            return np.array([table.get(float(round(v, 1)), 1.0) for v in values.tolist()], dtype=float)
+
+        ibw_ratio = weight_input[has_body] / ibw_body[has_body]
+        ime[has_body] *= metric_factors('ibw_ratio', ibw_ratio)
+
+        abw_mask = has_body & overweight
+        if abw_mask.any():
+            ime[abw_mask] *= metric_factors('abw_ratio', abw_body[abw_mask] / ibw_body[abw_mask])
+
+        bmi_bucket = np.select(
+            [bmi < 18, bmi < 20, bmi < 25, bmi < 30, bmi < 35, bmi < 40],
+            [16, 19, 22, 27, 32, 37],
+            default=42
+        )
+        bmi_table = {v: f for (m, v), f in snapshot.body_composition.items() if m == 'bmi'}
+        if bmi_table:
+            bmi_factors = np.array([bmi_table.get(float(b), 1.0) for b in bmi_bucket.tolist()], dtype=float)
+            ime[has_body] *= bmi_factors[has_body]
+
+    # --- Opioidtolerans, smärttröskel, njurfunktion ---
+    opioid_history = _batch_column(cases_df, 'opioidHistory', 'Opioidnaiv')
+    ime *= np.where((opioid_history == 'Opioidtolerant').to_numpy(), snapshot.get_opioid_tolerance_factor(), 1.0)
+    low_threshold = _batch_column(cases_df, 'lowPainThreshold', False).astype(bool).to_numpy()
+    ime *= np.where(low_threshold, snapshot.get_pain_threshold_factor(), 1.0)
+    renal = _batch_column(cases_df, 'renalImpairment', False).astype(bool).to_numpy()
+    ime *= np.where(renal, snapshot.get_renal_factor(), 1.0)
+
+    base_ime_before_adjuvants = ime.copy()
+
+    # --- Adjuvanter (reduktion från base IME, summeras) ---
+    total_reduction = np.zeros(n)
+
+    def add_choice_adjuvant(column, default, none_value, drug_type):
+        choices = _batch_column(cases_df, column, default)
+        for choice in pd.unique(choices):
+            if choice == none_value:
+                continue
+            drug_data = get_drug_by_ui_choice(drug_type, choice)
+            if not drug_data:
+                continue
+            mask = (choices == choice).to_numpy()
+            potency = _learned_potency(drug_data, drug_data.get('potency_percent', 0.0), snapshot)
+            total_reduction[mask] += _batch_adjuvant_reduction(base_ime_before_adjuvants[mask], drug_data, potency, pain_3d[mask])
+
+    def add_flag_adjuvant(column, drug_key):
+        flags = _batch_column(cases_df, column, False).astype(bool).to_numpy()
+        drug_data = LÄKEMEDELS_DATA.get(drug_key)
+        if drug_data and flags.any():
+            potency = _learned_potency(drug_data, drug_data.get('potency_percent', 0.0), snapshot)
+            total_reduction[flags] += _batch_adjuvant_reduction(base_ime_before_adjuvants[flags], drug_data, potency, pain_3d[flags])
+
+    add_choice_adjuvant('nsaid_choice', 'Ej given', 'Ej given', 'nsaid')
+
+    catapressan_dose = _batch_column(cases_df, 'catapressan_dose', 0).to_numpy(dtype=float)
+    clonidine = LÄKEMEDELS_DATA.get('clonidine')
+    cata_mask = catapressan_dose > 0
+    if clonidine and cata_mask.any():
+        scaled_potency = clonidine['potency_percent'] * catapressan_dose[cata_mask] / clonidine.get('reference_dose_mcg', 75)
+        learned = _learned_potency(clonidine, None, snapshot)
+        potency = scaled_potency if learned is None else learned
+        total_reduction[cata_mask] += _batch_adjuvant_reduction(
+            base_ime_before_adjuvants[cata_mask], clonidine, potency, pain_3d[cata_mask]
+        )
+
+    add_flag_adjuvant('droperidol', 'droperidol')
+    add_choice_adjuvant('ketamine_choice', 'Ej given', 'Ej given', 'ketamine')
+    add_choice_adjuvant('lidocaine', 'Nej', 'Nej', 'lidocaine')
+    add_choice_adjuvant('betapred', 'Nej', 'Nej', 'betapred')
+    add_flag_adjuvant('sevoflurane', 'sevoflurane')
+    add_flag_adjuvant('infiltration', 'infiltration')
+
+    ime = np.maximum(0, base_ime_before_adjuvants - total_reduction)
+
+    # --- Synergi (samma nyckel som db.get_drug_combination_key) ---
+    nsaid_choice = _batch_column(cases_df, 'nsaid_choice', 'Ej given')
+    ketamine_choice = _batch_column(cases_df, 'ketamine_choice', 'Ej given')
+    lidocaine = _batch_column(cases_df, 'lidocaine', 'Nej')
+    betapred = _batch_column(cases_df, 'betapred', 'Nej')
+    droperidol = _batch_column(cases_df, 'droperidol', False).astype(bool).to_numpy()
+    drug_flags = [
+        ('NSAID', _batch_column(cases_df, 'nsaid', False).astype(bool).to_numpy() & (nsaid_choice != 'Ej given').to_numpy()),
+        ('Catapressan', cata_mask),
+        ('Droperidol', droperidol),
+        ('Ketamine', (ketamine_choice.astype(bool) & (ketamine_choice != 'Ej given')).to_numpy()),
+        ('Lidocaine', (lidocaine.astype(bool) & (lidocaine != 'Nej')).to_numpy()),
+        ('Betapred', (betapred.astype(bool) & (betapred != 'Nej')).to_numpy()),
+    ]
+    combo_code = np.zeros(n, dtype=np.int64)
+    for bit, (_, flags) in enumerate(drug_flags):
+        combo_code |= flags.astype(np.int64) << bit
+
+    def synergy_for_code(code):
+        drugs = [name for bit, (name, _) in enumerate(drug_flags) if code >> bit & 1]
+        if len(drugs) < 2:
+            return 1.0
+        return snapshot.get_synergy_factor('+'.join(sorted(drugs)))
+
+    ime *= _map_unique(combo_code, synergy_for_code)
+    ime = np.maximum(ime, base_ime_before_adjuvants * APP_CONFIG['ADJUVANT_SAFETY_LIMIT_FACTOR'])
+
+    # --- Fentanyl ---
+    fentanyl_dose = _batch_column(cases_df, 'fentanylDose', 0).to_numpy(dtype=float)
+    fentanyl_ime_remaining = (fentanyl_dose / 100.0) * APP_CONFIG['FENTANYL_IME_CONVERSION_FACTOR'] \
+        * snapshot.get_fentanyl_remaining_fraction()
+    ime = np.maximum(0, ime - fentanyl_ime_remaining)
+
+    # --- Viktjustering (ABW / referensvikt) ---
+    actual_weight = _batch_column(cases_df, 'weight', APP_CONFIG['REFERENCE_WEIGHT_KG']).to_numpy(dtype=float)
+    height_cm = _batch_column(cases_df, 'height', 175).to_numpy(dtype=float)
+    ibw = np.maximum(MIN_IDEAL_WEIGHT, height_cm - np.where(is_female, FEMALE_HEIGHT_ADJUSTMENT, MALE_HEIGHT_ADJUSTMENT))
+    abw = np.where(
+        actual_weight <= ibw * OVERWEIGHT_THRESHOLD_MULTIPLIER,
+        actual_weight,
+        ibw + (actual_weight - ibw) * WEIGHT_ADJUSTMENT_FACTOR
+    )
+    adjust = (height_cm > 0) & (actual_weight > 0)
+    ime = np.where(adjust, ime * (abw / APP_CONFIG['REFERENCE_WEIGHT_KG']), ime)
+
+    # --- Composite key och kalibrering ---
+    catapressan_char = np.where(cata_mask, 'C', 'x')
+    droperidol_char = np.where(droperidol, 'D', 'x')
+    lidocaine_char = np.where(lidocaine == 'Bolus', 'LB', np.where(lidocaine == 'Infusion', 'LI', 'x'))
+    betapred_char = np.where(betapred == '4 mg', 'B4', np.where(betapred == '8 mg', 'B8', 'x'))
+    composite_key = (
+        procedure_ids.astype(str)
+        + '-ASA' + asa.map(lambda a: str(_ASA_NUM_MAP.get(a, 2)))
+        + '-' + pd.Series(np.where((opioid_history == 'Opioidtolerant').to_numpy(), 'T', 'N'), index=index)
+        + '-' + nsaid_choice.map(lambda c: _NSAID_KEY_MAP.get(c, 'x'))
+        + '-' + pd.Series(catapressan_char, index=index)
+        + '-' + pd.Series(droperidol_char, index=index)
+        + '-' + ketamine_choice.map(lambda c: _KETAMINE_KEY_MAP.get(c, 'x'))
+        + '-' + pd.Series(lidocaine_char, index=index)
+        + '-' + pd.Series(betapred_char, index=index)
+    )
+
+    if 'user_id' in cases_df.columns and snapshot.calibration_factors:
+        calibration = np.array([
+            snapshot.get_calibration_factor(uid, key) if pd.notna(uid) else 1.0
+            for uid, key in zip(cases_df['user_id'].tolist(), composite_key.tolist())
+        ], dtype=float)
+        ime *= calibration
+
+    final_dose = np.round(np.maximum(0, ime / 0.25)) * 0.25
+    final_dose[~known_procedure] = np.nan
+
+    return pd.DataFrame({
+        'finalDose': final_dose,
+        'compositeKey': composite_key.where(known_procedure, None),
+        'ibw': np.where(height_cm > 0, ibw, np.nan),
+        'abw': np.where(adjust, abw, np.nan)
+    }, index=index)
+
 # Learning functions from old code (unchanged for now)
 def calculate_selectivity_adjustment(vas, procedure_pain_type, adjuvant_selectivity, rescue_given):
     mismatch = abs(procedure_pain_type - adjuvant_selectivity)
@@ -1,5 +1,4 @@
 import streamlit as st
-import pandas as pd
 import math
 import database as db
 import auth
@@ -184,11 +183,9 @@ def handle_save_and_learn(procedures_df, finalize=False):
 
     # Get procedure info for learning
     user_id = auth.get_current_user_id()
-    all_cases = db.get_all_cases()
-    cases_df_learn = pd.DataFrame(all_cases) if all_cases else pd.DataFrame()
     num_proc_cases = 0
-    if not cases_df_learn.empty and 'procedure_id' in cases_df_learn.columns and current_inputs.get('procedure_id'):
-        num_proc_cases = len(cases_df_learn[cases_df_learn['procedure_id'] == current_inputs['procedure_id']])
+    if current_inputs.get('procedure_id'):
+        num_proc_cases = db.get_procedure_case_stats(current_inputs['procedure_id'])['total']
 
     # Get the recommended dose from calculation (for comparison)
     recommended_dose = st.session_state.current_calculation.get('finalDose', 0)
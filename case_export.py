@@ -0,0 +1,115 @@
+"""
+Case Export - Excel-export av sparade fall
+==========================================
+Bygger xlsx-filen för "Exportera till Excel" i historikfliken.
+
+Filen genereras först när någon begär den och strömmas rad för rad med
+xlsxwriter i constant_memory-läge, så minnesåtgången beror inte på antalet
+fall. Färdig fil cachas per db.get_cases_data_version() och
+db.get_users_data_version() (skaparens namn): upprepade nedladdningar utan
+nya/ändrade fall eller användare kostar ingenting.
+"""
+
+import logging
+import threading
+from datetime import datetime
+from io import BytesIO
+from typing import Dict, Optional, Tuple
+
+import pandas as pd
+import xlsxwriter
+
+import database as db
+
+logger = logging.getLogger(__name__)
+
+EXPORT_COLUMNS = [
+    'timestamp', 'procedure_name', 'age', 'sex', 'weight', 'height', 'bmi', 'ibw', 'abw',
+    'asa', 'opioidHistory', 'lowPainThreshold', 'optime_minutes', 'fentanylDose',
+    'nsaid', 'catapressan', 'droperidol', 'ketamine', 'lidocaine', 'betapred',
+    'givenDose', 'vas', 'uvaDose', 'postop_minutes', 'postop_reason', 'respiratory_status', 'severe_fatigue',
+    'created_by_name', 'last_modified'
+]
+EXPORT_BATCH_SIZE = 1000
+
+_cache_lock = threading.Lock()
+_cached_key: Optional[Tuple] = None
+_cached_export: Optional[bytes] = None
+
+
+def _format_value(value):
+    """Konvertera ett fältvärde till något xlsxwriter kan skriva."""
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return value
+    return str(value)
+
+
+def build_cases_excel(procedures_df: pd.DataFrame) -> bytes:
+    """
+    Generera Excel-fil med alla fall (nyaste först).
+
+    Args:
+        procedures_df: Procedures dataframe (för ingreppsnamn)
+
+    Returns:
+        xlsx-filens innehåll
+    """
+    procedure_names: Dict[str, str] = dict(zip(procedures_df['id'], procedures_df['name']))
+
+    buffer = BytesIO()
+    # constant_memory: varje rad skrivs till disk direkt och hålls inte i minnet
+    workbook = xlsxwriter.Workbook(buffer, {'constant_memory': True})
+    worksheet = workbook.add_worksheet('Fall')
+    header_format = workbook.add_format({'bold': True, 'border': 1})
+
+    columns = None
+    row_index = 1
+    cursor = None
+    while True:
+        page = db.query_cases(after_cursor=cursor, limit=EXPORT_BATCH_SIZE)
+        for case in page['cases']:
+            case['procedure_name'] = procedure_names.get(case.get('procedure_id'), 'Okänt') if case.get('procedure_id') else 'Okänt'
+            case['created_by_name'] = case.get('created_by_name') or 'Okänd'
+            if columns is None:
+                columns = [col for col in EXPORT_COLUMNS if col in case]
+                worksheet.write_row(0, 0, columns, header_format)
+            worksheet.write_row(row_index, 0, [_format_value(case.get(col)) for col in columns])
+            row_index += 1
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+
+    workbook.close()
+    logger.info(f"Built Excel export with {row_index - 1} cases")
+    return buffer.getvalue()
+
+
+def get_cases_excel(procedures_df: pd.DataFrame, build: bool = True) -> Optional[bytes]:
+    """
+    Hämta cachad Excel-export, eller generera den om data har ändrats.
+
+    Args:
+        procedures_df: Procedures dataframe
+        build: False = returnera bara en redan cachad, aktuell fil (eller None)
+
+    Returns:
+        xlsx-filens innehåll, eller None om build=False och ingen aktuell fil finns
+    """
+    global _cached_key, _cached_export
+    key = (
+        db.DB_PATH,
+        db.get_cases_data_version(),
+        db.get_users_data_version(),
+        tuple(zip(procedures_df['id'], procedures_df['name']))
+    )
+    with _cache_lock:
+        if _cached_key == key:
+            return _cached_export
+        if not build:
+            return None
+        data = build_cases_excel(procedures_df)
+        _cached_key = key
+        _cached_export = data
+        return data
@@ -17,12 +17,21 @@ APP_CONFIG = {
     'ML_THRESHOLD_PER_PROCEDURE': 15,
     'ML_TARGET_VAS': 1.0,  # Admin-justerbar från UI
     'FENTANYL_HALFLIFE_FRACTION': 0.25,
-    'FENTANYL_MME_CONVERSION_FACTOR': 10,
+    'FENTANYL_IME_CONVERSION_FACTOR': 10,
+    'FENTANYL_PK_MODEL': 'biexponential',  # Temporal fentanyl: 'biexponential' eller 'three_compartment' (opt-in, okalibrerad)
     'MME_ROUNDING_STEP': 0.25,
     'REFERENCE_WEIGHT_KG': 75,
     'ADJUVANT_SAFETY_LIMIT_FACTOR': 0.3,  # Max 70% MME reduction
     'ML_SAFETY_MAX_DOSE': 20.0,  # Absolut maxdos från ML
     'ML_SAFETY_MIN_DOSE': 0.0,  # Absolut mindos från ML
+    'ML_DOSE_GRID_STEP': 0.5,  # Steg (mg) för ML-modellens dos→VAS-skanning
+    'ML_DOSE_REFINE_STEP': None,  # Förfining runt bästa dosen, t.ex. 0.25 (None = ingen, opt-in)
+
+    # Bakgrundsträning (retrain_scheduler.py)
+    'RETRAIN_SCHEDULER_ENABLED': True,
+    'RETRAIN_CHECK_INTERVAL_S': 300,  # Hur ofta nya slutförda fall kontrolleras
+    'RETRAIN_MIN_NEW_CASES': 10,  # Nya slutförda fall totalt som utlöser träning
+    'RETRAIN_MAX_AGE_HOURS': 24,  # Träna om en äldre modell så fort det finns nya fall
 
     # Default patient factors
     'DEFAULTS': {
@@ -2,9 +2,11 @@ import sqlite3
 import json
 import logging
 from datetime import datetime
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Iterator, Optional, Tuple
 from contextlib import contextmanager
+from functools import wraps
 import threading
+import time
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -12,26 +14,118 @@ logger = logging.getLogger(__name__)
 DB_PATH = "anestesi.db"
 _local = threading.local()
 
+# Anslutningsinställningar (en poolad anslutning per tråd)
+BUSY_TIMEOUT_MS = 10000
+CACHE_SIZE_KB = 16384          # 16 MB page cache per anslutning
+MMAP_SIZE_BYTES = 64 * 1024 * 1024
+HEALTH_CHECK_INTERVAL_S = 30.0
+
+# Versionsräknare för globala inlärningstabeller. Ökas av varje update_*
+# så att processdelade cachar (se learning_snapshot) vet när de är inaktuella.
+_learning_version = 0
+_learning_version_lock = threading.Lock()
+
+def _open_connection() -> sqlite3.Connection:
+    """Öppna och konfigurera en ny anslutning (WAL + prestanda-pragmas)."""
+    conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT_MS / 1000)
+    conn.row_factory = sqlite3.Row
+    # WAL: läsare blockeras inte av pågående skrivningar (och vice versa)
+    conn.execute('PRAGMA journal_mode=WAL')
+    # NORMAL är säkert i WAL-läge och undviker fsync vid varje commit
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA cache_size=-{CACHE_SIZE_KB}')
+    conn.execute(f'PRAGMA mmap_size={MMAP_SIZE_BYTES}')
+    conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+    return conn
+
+def _is_healthy(conn: sqlite3.Connection) -> bool:
+    """Kontrollera att en poolad anslutning fortfarande går att använda."""
+    try:
+        conn.execute('SELECT 1').fetchone()
+        return True
+    except sqlite3.Error:
+        return False
+
+def _checkout_connection() -> sqlite3.Connection:
+    """Hämta trådens anslutning, öppna om saknas, stängd eller byte av DB_PATH."""
+    conn = getattr(_local, 'conn', None)
+    now = time.monotonic()
+    if conn is not None and getattr(_local, 'path', None) == DB_PATH:
+        if now - _local.checked_at < HEALTH_CHECK_INTERVAL_S:
+            return conn
+        if _is_healthy(conn):
+            _local.checked_at = now
+            return conn
+        logger.warning("Pooled database connection failed health check, reconnecting")
+
+    close_thread_connection()
+    conn = _open_connection()
+    _local.conn = conn
+    _local.path = DB_PATH
+    _local.checked_at = now
+    return conn
+
+def close_thread_connection():
+    """Stäng den aktuella trådens poolade anslutning (om någon)."""
+    conn = getattr(_local, 'conn', None)
+    _local.conn = None
+    if conn is not None:
+        try:
+            conn.close()
+        except sqlite3.Error as e:
+            logger.debug(f"Error closing pooled connection: {e}")
+
 @contextmanager
 def get_connection():
     """
     Context manager för thread-safe databasanslutningar.
 
+    Varje tråd återanvänder en egen anslutning under hela sin livstid
+    (WAL-läge, se _open_connection). Okommitterade ändringar rullas
+    tillbaka när det yttersta with-blocket lämnas, precis som när
+    anslutningen tidigare stängdes.
+
     Använd alltid med 'with' statement:
     with get_connection() as conn:
         cursor = conn.cursor()
         ...
     """
-    conn = sqlite3.connect(DB_PATH, timeout=10.0)
-    conn.row_factory = sqlite3.Row
+    conn = _checkout_connection()
+    depth = getattr(_local, 'depth', 0)
+    _local.depth = depth + 1
     try:
         yield conn
     except Exception as e:
-        conn.rollback()
+        if depth == 0:
+            conn.rollback()
         logger.error(f"Database error: {e}", exc_info=True)
         raise
     finally:
-        conn.close()
+        _local.depth = depth
+        if depth == 0 and conn.in_transaction:
+            conn.rollback()
+
+def get_learning_version() -> int:
+    """Returnera nuvarande version av inlärningsdatan i denna process."""
+    return _learning_version
+
+def bump_learning_version() -> int:
+    """Öka versionsräknaren för inlärningsdata. Returnerar ny version."""
+    global _learning_version
+    with _learning_version_lock:
+        _learning_version += 1
+        return _learning_version
+
+def _bumps_learning_version(func):
+    """Dekorator för update_*-funktioner: ökar versionsräknaren efter lyckad skrivning."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            # Även vid fel kan delar av skrivningen ha committats
+            bump_learning_version()
+    return wrapper
 
 def _row_to_case_dict(row: sqlite3.Row) -> Dict:
     """Konvertera en databasrad till en case dictionary."""
@@ -185,6 +279,7 @@ def init_database():
                     time_relative_minutes INTEGER NOT NULL,
                     administration_route TEXT DEFAULT 'IV',
                     notes TEXT,
+                    drug_key TEXT,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     FOREIGN KEY (case_id) REFERENCES cases(id) ON DELETE CASCADE
                 )
@@ -388,6 +483,426 @@ def get_all_finalized_cases(user_id=None) -> List[Dict]:
         logger.error(f"Error in get_all_finalized_cases: {e}")
         raise
 
+def _build_case_filters(filters: Optional[Dict]) -> Tuple[str, List, bool]:
+    """
+    Översätt filter-dict till SQL WHERE-villkor för query_cases/count_cases.
+
+    Returns:
+        (where_sql, params, needs_user_join)
+    """
+    filters = filters or {}
+    clauses = []
+    params = []
+    needs_user_join = False
+
+    if filters.get('user_id'):
+        clauses.append('c.user_id = ?')
+        params.append(filters['user_id'])
+    if filters.get('username_contains'):
+        needs_user_join = True
+        clauses.append('instr(LOWER(u.username), LOWER(?)) > 0')
+        params.append(filters['username_contains'])
+    if filters.get('procedure_ids') is not None:
+        procedure_ids = list(filters['procedure_ids'])
+        if not procedure_ids:
+            clauses.append('0')
+        else:
+            clauses.append(f"c.procedure_id IN ({', '.join('?' * len(procedure_ids))})")
+            params.extend(procedure_ids)
+    if filters.get('status'):
+        clauses.append('c.status = ?')
+        params.append(filters['status'])
+    if filters.get('min_vas'):
+        clauses.append('c.vas >= ?')
+        params.append(filters['min_vas'])
+    if filters.get('incomplete'):
+        # Fall utan registrerat utfall (standard-VAS och inga postop-data)
+        clauses.append('c.vas = 3 AND c.uva_dose = 0 AND c.postop_minutes = 0')
+
+    where_sql = ' AND '.join(clauses) if clauses else '1'
+    return where_sql, params, needs_user_join
+
+def query_cases(filters: Optional[Dict] = None, order: str = 'newest',
+                after_cursor: Optional[Tuple[str, int]] = None, limit: int = 10) -> Dict:
+    """
+    Hämta en sida fall med filtrering i SQL och keyset-paginering.
+
+    Kostnaden beror på sidstorleken, inte på antalet fall i databasen:
+    sidan läses via index på (timestamp, id) och fortsätter efter cursorn
+    i stället för att använda OFFSET.
+
+    Args:
+        filters: Dict med valfria nycklar:
+            - 'user_id': Endast fall skapade av denna användare
+            - 'username_contains': Delsträng i skaparens användarnamn
+            - 'procedure_ids': Lista med tillåtna procedure_id
+            - 'status': 'IN_PROGRESS' eller 'FINALIZED'
+            - 'min_vas': Lägsta VAS
+            - 'incomplete': True = endast fall utan registrerat utfall
+        order: 'newest' (default) eller 'oldest'
+        after_cursor: 'next_cursor' från föregående sida, None för första sidan
+        limit: Max antal fall per sida
+
+    Returns:
+        Dict med 'cases' (lista av case-dicts, inklusive 'created_by_name'
+        och 'last_modified_by_name' via JOIN mot users) och 'next_cursor'
+        (None om det inte finns fler sidor)
+    """
+    if order not in ('newest', 'oldest'):
+        raise ValueError(f"Unknown order: {order}")
+
+    where_sql, params, _ = _build_case_filters(filters)
+    direction = 'DESC' if order == 'newest' else 'ASC'
+    comparator = '<' if order == 'newest' else '>'
+
+    if after_cursor is not None:
+        where_sql += f' AND (c.timestamp, c.id) {comparator} (?, ?)'
+        params.extend(after_cursor)
+
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            # Hämta en extra rad för att veta om det finns en nästa sida
+            cursor.execute(f'''
+                SELECT c.*,
+                       u.username AS created_by_name,
+                       m.username AS last_modified_by_name
+                FROM cases c
+                LEFT JOIN users u ON u.id = c.user_id
+                LEFT JOIN users m ON m.id = c.last_modified_by
+                WHERE {where_sql}
+                ORDER BY c.timestamp {direction}, c.id {direction}
+                LIMIT ?
+            ''', (*params, limit + 1))
+            rows = cursor.fetchall()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = (rows[-1]['timestamp'], rows[-1]['id']) if has_more and rows else None
+        return {
+            'cases': [_row_to_case_dict(row) for row in rows],
+            'next_cursor': next_cursor
+        }
+    except Exception as e:
+        logger.error(f"Error in query_cases: {e}")
+        raise
+
+def count_cases(filters: Optional[Dict] = None) -> int:
+    """Räkna fall som matchar samma filter som query_cases."""
+    where_sql, params, needs_user_join = _build_case_filters(filters)
+    join_sql = 'JOIN users u ON u.id = c.user_id' if needs_user_join else ''
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'SELECT COUNT(*) FROM cases c {join_sql} WHERE {where_sql}', params)
+            return cursor.fetchone()[0]
+    except Exception as e:
+        logger.error(f"Error in count_cases: {e}")
+        raise
+
+def get_procedure_case_stats(procedure_id: str) -> Dict[str, int]:
+    """
+    Hämta antal fall för ett ingrepp (en rad ur procedure_case_stats).
+
+    Tabellen hålls uppdaterad av triggers på cases, så ingen tabellskanning behövs.
+
+    Args:
+        procedure_id: Ingreppets ID
+
+    Returns:
+        Dict med 'total', 'finalized' och 'in_progress' (nollor om inga fall finns)
+    """
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'SELECT total, finalized, in_progress FROM procedure_case_stats WHERE procedure_id = ?',
+                (procedure_id,)
+            )
+            row = cursor.fetchone()
+            if row is None:
+                return {'total': 0, 'finalized': 0, 'in_progress': 0}
+            return {'total': row['total'], 'finalized': row['finalized'], 'in_progress': row['in_progress']}
+    except Exception as e:
+        logger.error(f"Error in get_procedure_case_stats: {e}")
+        raise
+
+
+def get_all_procedure_case_stats() -> Dict[str, Dict[str, int]]:
+    """
+    Hämta antal fall för alla ingrepp som har minst ett fall.
+
+    Returns:
+        Dict procedure_id -> {'total', 'finalized', 'in_progress'}
+    """
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT procedure_id, total, finalized, in_progress FROM procedure_case_stats WHERE total > 0')
+            return {
+                row['procedure_id']: {'total': row['total'], 'finalized': row['finalized'], 'in_progress': row['in_progress']}
+                for row in cursor.fetchall()
+            }
+    except Exception as e:
+        logger.error(f"Error in get_all_procedure_case_stats: {e}")
+        raise
+
+
+def get_total_case_count() -> int:
+    """
+    Totalt antal fall, summerat ur procedure_case_stats.
+
+    Billigare än count_cases() utan filter: en rad per ingrepp i stället
+    för en skanning av cases.
+    """
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT COALESCE(SUM(total), 0) FROM procedure_case_stats')
+            return cursor.fetchone()[0]
+    except Exception as e:
+        logger.error(f"Error in get_total_case_count: {e}")
+        raise
+
+
+def rebuild_procedure_case_stats():
+    """Räkna om procedure_case_stats från cases-tabellen (backfill/reparation)."""
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM procedure_case_stats')
+            cursor.execute('''
+                INSERT INTO procedure_case_stats (procedure_id, total, finalized, in_progress)
+                SELECT procedure_id,
+                       COUNT(*),
+                       SUM(status = 'FINALIZED'),
+                       SUM(status != 'FINALIZED')
+                FROM cases
+                WHERE procedure_id IS NOT NULL
+                GROUP BY procedure_id
+            ''')
+            conn.commit()
+    except Exception as e:
+        logger.error(f"Error rebuilding procedure case stats: {e}")
+        raise
+
+
+def get_finalized_watermark() -> Optional[int]:
+    """
+    Högsta change_seq bland slutförda fall (vattenmärke för inkrementell träning).
+
+    Se migrations.migrate_to_v13: en modell tränad upp till vattenmärket W har
+    sett alla fall med finalized_seq <= W.
+    """
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT MAX(change_seq) FROM cases WHERE status = 'FINALIZED'")
+            return cursor.fetchone()[0]
+    except Exception as e:
+        logger.error(f"Error in get_finalized_watermark: {e}")
+        raise
+
+
+def get_finalized_cases_since(watermark: Optional[int]) -> Tuple[List[Dict], int, Optional[int]]:
+    """
+    Hämta fall som slutförts för första gången efter ett vattenmärke.
+
+    Fall som redan fanns i modellen (finalized_seq <= watermark) men har
+    redigerats efteråt räknas separat: de ska inte boostas igen, utan kräver
+    full omträning. Allt läses i samma fråga, så nytt vattenmärke och antal
+    redigerade fall hör ihop.
+
+    Args:
+        watermark: change_seq-värde från get_finalized_watermark, None = alla
+
+    Returns:
+        (nya fall, antal redigerade redan tränade fall, nytt vattenmärke).
+        Vattenmärket är oförändrat om inget har ändrats.
+    """
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT * FROM cases
+                WHERE status = 'FINALIZED' AND change_seq > COALESCE(?, 0)
+                ORDER BY finalized_seq
+            ''', (watermark,))
+            rows = cursor.fetchall()
+    except Exception as e:
+        logger.error(f"Error in get_finalized_cases_since: {e}")
+        raise
+
+    since = watermark or 0
+    new_rows = [row for row in rows if row['finalized_seq'] > since]
+    new_watermark = max((row['change_seq'] for row in rows), default=watermark)
+    return [_row_to_case_dict(row) for row in new_rows], len(rows) - len(new_rows), new_watermark
+
+
+def count_finalized_cases_since(watermark: Optional[int]) -> Dict[str, int]:
+    """
+    Räkna fall per ingrepp som slutförts för första gången efter ett vattenmärke.
+
+    Args:
+        watermark: change_seq-värde från get_finalized_watermark, None = alla
+
+    Returns:
+        Dict procedure_id -> antal nya slutförda fall
+    """
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT procedure_id, COUNT(*) AS new_cases FROM cases
+                WHERE status = 'FINALIZED' AND finalized_seq > COALESCE(?, 0)
+                GROUP BY procedure_id
+            ''', (watermark,))
+            return {row['procedure_id']: row['new_cases'] for row in cursor.fetchall()}
+    except Exception as e:
+        logger.error(f"Error in count_finalized_cases_since: {e}")
+        raise
+
+
+def count_edited_finalized_cases_since(watermark: Optional[int]) -> int:
+    """
+    Räkna redan tränade fall (finalized_seq <= watermark) som ändrats efter vattenmärket.
+
+    Args:
+        watermark: change_seq-värde från get_finalized_watermark (None = inga tränade fall)
+
+    Returns:
+        Antal redigerade fall
+    """
+    if watermark is None:
+        return 0
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT COUNT(*) FROM cases
+                WHERE status = 'FINALIZED' AND change_seq > ? AND finalized_seq <= ?
+            ''', (watermark, watermark))
+            return cursor.fetchone()[0]
+    except Exception as e:
+        logger.error(f"Error in count_edited_finalized_cases_since: {e}")
+        raise
+
+
+# Råkolumner för MEML-träning: fall + ingreppets smärtprofil (inlärd 3D-profil, annars ingreppets
+# painTypeScore); samma källa som meml_model.procedure_pain_profile använder vid prediktion
+TRAINING_CASE_COLUMNS = (
+    'procedure_id', 'age', 'sex', 'weight', 'height', 'renal_impairment', 'opioid_history',
+    'nsaid', 'ketamine_choice', 'catapressan', 'droperidol', 'lidocaine', 'betapred', 'given_dose',
+    'pain_somatic', 'pain_visceral', 'pain_neuropathic'
+)
+
+
+def count_finalized_training_cases() -> Tuple[int, int]:
+    """
+    Antal slutförda fall med given dos, och högsta fall-id bland dem.
+
+    Returns:
+        (antal, max_id); max_id avgränsar en efterföljande iter_finalized_training_chunks
+    """
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT COUNT(*), MAX(id) FROM cases
+                WHERE status = 'FINALIZED' AND given_dose IS NOT NULL
+            ''')
+            count, max_id = cursor.fetchone()
+            return count, max_id or 0
+    except Exception as e:
+        logger.error(f"Error in count_finalized_training_cases: {e}")
+        raise
+
+
+def iter_finalized_training_chunks(max_id: int, chunk_size: int = 5000) -> Iterator[Dict[str, tuple]]:
+    """
+    Strömma slutförda fall kolumnvis i chunkar (keyset på id, ingen lista med alla fall).
+
+    Args:
+        max_id: Högsta fall-id att ta med (från count_finalized_training_cases)
+        chunk_size: Antal fall per chunk
+
+    Yields:
+        Dict kolumnnamn (TRAINING_CASE_COLUMNS) -> tuple med värden för chunken
+    """
+    # '+c.status' hindrar SQLite från att välja statusindexet (som kräver sortering av
+    # alla slutförda fall per chunk); id-intervallet läses då direkt via primärnyckeln
+    last_id = 0
+    while True:
+        try:
+            with get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.row_factory = None  # Tupler räcker; transponeras direkt nedan
+                cursor.execute('''
+                    SELECT c.id, c.procedure_id, c.age, c.sex, c.weight, c.height, c.renal_impairment,
+                           c.opioid_history, c.nsaid, c.ketamine_choice, c.catapressan, c.droperidol,
+                           c.lidocaine, c.betapred, c.given_dose,
+                           COALESCE(lp.pain_somatic, p.painTypeScore, cp.painTypeScore),
+                           lp.pain_visceral, lp.pain_neuropathic
+                    FROM cases c
+                    LEFT JOIN learning_procedures lp ON lp.procedure_id = c.procedure_id
+                    LEFT JOIN procedures p ON p.id = c.procedure_id
+                    LEFT JOIN custom_procedures cp ON cp.id = c.procedure_id
+                    WHERE +c.status = 'FINALIZED' AND c.given_dose IS NOT NULL
+                      AND c.id > ? AND c.id <= ?
+                    ORDER BY c.id
+                    LIMIT ?
+                ''', (last_id, max_id, chunk_size))
+                rows = cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Error in iter_finalized_training_chunks: {e}")
+            raise
+
+        if not rows:
+            return
+        columns = list(zip(*rows))
+        last_id = columns[0][-1]
+        yield dict(zip(TRAINING_CASE_COLUMNS, columns[1:]))
+        if len(rows) < chunk_size:
+            return
+
+
+def get_cases_data_version() -> str:
+    """
+    Versionstoken för innehållet i cases-tabellen.
+
+    Räknaren i table_versions ökas av triggers (migration v12) vid varje
+    insert, uppdatering och radering av fall, så uppslaget kostar en
+    primärnyckelsökning oavsett antal fall. Används som cache-nyckel för
+    genererade artefakter, t.ex. Excel-exporten.
+    """
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT version FROM table_versions WHERE name = 'cases'")
+            row = cursor.fetchone()
+            return str(row[0] if row else 0)
+    except Exception as e:
+        logger.error(f"Error in get_cases_data_version: {e}")
+        raise
+
+
+def get_users_data_version() -> str:
+    """
+    Versionstoken för användarnamnen (se get_cases_data_version).
+
+    Räknaren ökas av triggers (migration v14) när en användare skapas,
+    byter namn eller raderas.
+    """
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT version FROM table_versions WHERE name = 'users'")
+            row = cursor.fetchone()
+            return str(row[0] if row else 0)
+    except Exception as e:
+        logger.error(f"Error in get_users_data_version: {e}")
+        raise
+
 def get_all_custom_procedures() -> List[Dict]:
     """Hämta alla custom procedures"""
     try:
@@ -745,6 +1260,36 @@ def get_user_by_id(user_id: int) -> Optional[Dict]:
         logger.error(f"Error in get_user_by_id: {e}")
         raise
 
+def get_users_by_ids(user_ids) -> Dict[int, Dict]:
+    """
+    Hämta flera användare med en fråga.
+
+    Args:
+        user_ids: Iterable med användar-ID (dubbletter och None ignoreras)
+
+    Returns:
+        Dict {user_id: användar-dict} för de ID som finns
+    """
+    unique_ids = sorted({int(uid) for uid in user_ids if uid is not None})
+    if not unique_ids:
+        return {}
+
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            users = {}
+            # SQLite begränsar antalet parametrar per fråga
+            for start in range(0, len(unique_ids), 500):
+                chunk = unique_ids[start:start + 500]
+                cursor.execute(
+                    f"SELECT * FROM users WHERE id IN ({', '.join('?' * len(chunk))})", chunk
+                )
+                users.update({row['id']: dict(row) for row in cursor.fetchall()})
+            return users
+    except Exception as e:
+        logger.error(f"Error in get_users_by_ids: {e}")
+        raise
+
 def get_user_by_username(username: str) -> Optional[Dict]:
     """Hämta användare via användarnamn (case-insensitive)"""
     try:
@@ -817,6 +1362,7 @@ def get_calibration_factor(user_id: int, composite_key: str) -> float:
         logger.error(f"Error in get_calibration_factor: {e}")
         raise
 
+@_bumps_learning_version
 def update_calibration_factor(user_id: int, composite_key: str, adjustment: float):
     """Uppdatera kalibreringsfaktor"""
     if not user_id or not composite_key:
@@ -895,6 +1441,7 @@ def get_age_factor(age: int, default_factor: float) -> float:
         logger.error(f"Error in get_age_factor: {e}")
         raise
 
+@_bumps_learning_version
 def update_age_factor(age: int, default_factor: float, adjustment: float) -> float:
     """Uppdatera åldersfaktor (GLOBAL för alla användare sedan v4)"""
     if adjustment == 0:
@@ -943,6 +1490,7 @@ def get_asa_factor(asa_class: str, default_factor: float) -> float:
         logger.error(f"Error in get_asa_factor: {e}")
         raise
 
+@_bumps_learning_version
 def update_asa_factor(asa_class: str, default_factor: float, adjustment: float) -> float:
     """Uppdatera ASA-faktor (GLOBAL för alla användare sedan v4)"""
     if adjustment == 0:
@@ -987,6 +1535,7 @@ def get_opioid_tolerance_factor() -> float:
         logger.error(f"Error in get_opioid_tolerance_factor: {e}")
         raise
 
+@_bumps_learning_version
 def update_opioid_tolerance_factor(adjustment: float) -> float:
     """Uppdatera opioid tolerans faktor (GLOBAL för alla användare sedan v4)"""
     if adjustment == 0:
@@ -1031,6 +1580,7 @@ def get_pain_threshold_factor() -> float:
         logger.error(f"Error in get_pain_threshold_factor: {e}")
         raise
 
+@_bumps_learning_version
 def update_pain_threshold_factor(adjustment: float) -> float:
     """Uppdatera smärttröskel faktor (GLOBAL för alla användare sedan v4)"""
     if adjustment == 0:
@@ -1075,6 +1625,7 @@ def get_renal_factor() -> float:
         logger.error(f"Error in get_renal_factor: {e}")
         raise
 
+@_bumps_learning_version
 def update_renal_factor(default_factor: float, adjustment: float) -> float:
     """Uppdatera njurfaktor (GLOBAL för alla användare sedan v4)"""
     if adjustment == 0:
@@ -1137,6 +1688,7 @@ def get_sex_factor(sex: str, default_factor: float) -> float:
         logger.error(f"Error in get_sex_factor: {e}")
         return default_factor
 
+@_bumps_learning_version
 def update_sex_factor(sex: str, default_factor: float, adjustment: float) -> float:
     """Uppdatera könsfaktor (GLOBAL för alla användare sedan v4)"""
     if adjustment == 0:
@@ -1196,6 +1748,7 @@ def get_body_composition_factor(metric_type: str, metric_value: float, default_f
         logger.error(f"Error in get_body_composition_factor: {e}")
         raise
 
+@_bumps_learning_version
 def update_body_composition_factor(metric_type: str, metric_value: float,
                                    default_factor: float, adjustment: float) -> float:
     """
@@ -1294,6 +1847,7 @@ def get_procedure_learning(user_id: int, procedure_id: str, default_base_ime: fl
         logger.error(f"Error in get_procedure_learning: {e}")
         raise
 
+@_bumps_learning_version
 def update_procedure_learning(procedure_id: str, default_base_ime: float,
                               default_pain_type: float, base_ime_adjustment: float,
                               pain_type_adjustment: float) -> Dict:
@@ -1380,6 +1934,7 @@ def get_adjuvant_potency(adjuvant_name: str, procedure_pain_type: float, default
         logger.error(f"Error in get_adjuvant_potency: {e}")
         raise
 
+@_bumps_learning_version
 def update_adjuvant_learning(adjuvant_name: str, selectivity_adj: float, potency_adj: float):
     """
     Uppdatera adjuvant inlärning (GLOBAL för alla användare).
@@ -1469,6 +2024,7 @@ def get_synergy_factor(drug_combo: str) -> float:
         logger.error(f"Error in get_synergy_factor: {e}")
         raise
 
+@_bumps_learning_version
 def update_synergy_factor(drug_combo: str, adjustment: float) -> float:
     """Uppdatera synergifaktor (GLOBAL)"""
     if not drug_combo or adjustment == 0:
@@ -1519,6 +2075,7 @@ def get_fentanyl_remaining_fraction(user_id=None) -> float:
         logger.error(f"Error in get_fentanyl_remaining_fraction: {e}")
         raise
 
+@_bumps_learning_version
 def update_fentanyl_remaining_fraction(user_id: int, adjustment: float) -> float:
     """Uppdatera fentanyl remaining fraction"""
     if not user_id or adjustment == 0:
@@ -1645,10 +2202,15 @@ def save_temporal_doses(case_id: int, temporal_doses: List[Dict]):
     """
     Spara temporal doser för ett fall med batch insert för bättre prestanda.
 
+    Läkemedelsnyckeln (drug_key i LÄKEMEDELS_DATA) löses upp här en gång per dos,
+    om den inte redan satts när dosen lades till i UI.
+
     Args:
         case_id: ID för det fall som doserna hör till
         temporal_doses: Lista med dos-dictionaries
     """
+    from pharmacokinetics import resolve_drug_key
+
     if not temporal_doses:
         return
 
@@ -1666,7 +2228,8 @@ def save_temporal_doses(case_id: int, temporal_doses: List[Dict]):
                     dose_entry['unit'],
                     dose_entry['time_relative_minutes'],
                     dose_entry.get('administration_route', 'IV'),
-                    dose_entry.get('notes', '')
+                    dose_entry.get('notes', ''),
+                    dose_entry.get('drug_key') or resolve_drug_key(dose_entry['drug_type'], dose_entry['drug_name'])
                 )
                 for dose_entry in temporal_doses
             ]
@@ -1675,8 +2238,8 @@ def save_temporal_doses(case_id: int, temporal_doses: List[Dict]):
             cursor.executemany('''
                 INSERT INTO temporal_doses (
                     case_id, drug_type, drug_name, dose, unit,
-                    time_relative_minutes, administration_route, notes
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    time_relative_minutes, administration_route, notes, drug_key
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
             ''', batch_data)
 
             conn.commit()
@@ -1781,6 +2344,7 @@ def get_adjuvant_potency_percent(adjuvant_name: str, default_potency_percent: fl
         raise
 
 
+@_bumps_learning_version
 def update_adjuvant_potency_percent(adjuvant_name: str, default_potency_percent: float,
                                     adjustment: float) -> float:
     """
@@ -1889,6 +2453,7 @@ def get_procedure_learning_3d(procedure_id: str, default_base_ime: float,
         raise
 
 
+@_bumps_learning_version
 def update_procedure_learning_3d(procedure_id: str, default_base_ime: float,
                                   default_pain_somatic: float, default_pain_visceral: float,
                                   default_pain_neuropathic: float,
@@ -2028,6 +2593,41 @@ def get_age_bucket_learning(age_bucket: int) -> Optional[Dict]:
         return None
 
 
+def get_age_buckets_in_range(min_age: int, max_age: int) -> Dict[int, Dict]:
+    """
+    Hämta alla åldersbuckets i intervallet [min_age, max_age] med en fråga.
+
+    Använder primärnyckeln på age_bucket (indexerad BETWEEN), så en hel
+    interpolation kostar en databasrunda i stället för en per ålder.
+
+    Args:
+        min_age: Lägsta ålder (inklusive)
+        max_age: Högsta ålder (inklusive)
+
+    Returns:
+        Dict {age_bucket: {'age_factor', 'num_observations'}}, tom vid fel
+    """
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT age_bucket, age_factor, num_observations
+                FROM learning_age_buckets
+                WHERE age_bucket BETWEEN ? AND ?
+            ''', (min_age, max_age))
+            return {
+                row['age_bucket']: {
+                    'age_factor': row['age_factor'],
+                    'num_observations': row['num_observations']
+                }
+                for row in cursor.fetchall()
+            }
+    except Exception as e:
+        logger.debug(f"No data for age buckets {min_age}-{max_age}: {e}")
+        return {}
+
+
+@_bumps_learning_version
 def update_age_bucket_learning(age_bucket: int, default_factor: float, adjustment: float) -> float:
     """
     Uppdatera åldersfaktor för specifik bucket (varje år).
@@ -2063,6 +2663,7 @@ def update_age_bucket_learning(age_bucket: int, default_factor: float, adjustmen
                 INSERT OR REPLACE INTO learning_age_buckets (age_bucket, age_factor, num_observations)
                 VALUES (?, ?, ?)
             ''', (age_bucket, new_factor, new_num_obs))
+            _refresh_factor_curve_window(cursor, 'age', age_bucket)
             conn.commit()
             return new_factor
     except Exception as e:
@@ -2102,6 +2703,41 @@ def get_weight_bucket_learning(weight_bucket: int) -> Optional[Dict]:
         return None
 
 
+def get_weight_buckets_in_range(min_weight: int, max_weight: int) -> Dict[int, Dict]:
+    """
+    Hämta alla viktbuckets i intervallet [min_weight, max_weight] med en fråga.
+
+    Använder primärnyckeln på weight_bucket (indexerad BETWEEN), så en hel
+    interpolation kostar en databasrunda i stället för en per kilo.
+
+    Args:
+        min_weight: Lägsta vikt i kg (inklusive)
+        max_weight: Högsta vikt i kg (inklusive)
+
+    Returns:
+        Dict {weight_bucket: {'weight_factor', 'num_observations'}}, tom vid fel
+    """
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT weight_bucket, weight_factor, num_observations
+                FROM learning_weight_buckets
+                WHERE weight_bucket BETWEEN ? AND ?
+            ''', (min_weight, max_weight))
+            return {
+                row['weight_bucket']: {
+                    'weight_factor': row['weight_factor'],
+                    'num_observations': row['num_observations']
+                }
+                for row in cursor.fetchall()
+            }
+    except Exception as e:
+        logger.debug(f"No data for weight buckets {min_weight}-{max_weight}kg: {e}")
+        return {}
+
+
+@_bumps_learning_version
 def update_weight_bucket_learning(weight_bucket: int, default_factor: float, adjustment: float) -> float:
     """
     Uppdatera viktfaktor för specifik bucket (varje kg).
@@ -2137,8 +2773,91 @@ def update_weight_bucket_learning(weight_bucket: int, default_factor: float, adj
                 INSERT OR REPLACE INTO learning_weight_buckets (weight_bucket, weight_factor, num_observations)
                 VALUES (?, ?, ?)
             ''', (weight_bucket, new_factor, new_num_obs))
+            _refresh_factor_curve_window(cursor, 'weight', weight_bucket)
             conn.commit()
             return new_factor
     except Exception as e:
         logger.error(f"Error updating weight bucket {weight_bucket}kg: {e}")
         raise
+
+
+# ============ Materialiserade ålders-/viktkurvor ============
+
+# kind -> (bucket-tabell, bucket-kolumn, faktor-kolumn, kurvtabell, kurvnyckel)
+_FACTOR_CURVE_TABLES = {
+    'age': ('learning_age_buckets', 'age_bucket', 'age_factor', 'learning_age_curve', 'age'),
+    'weight': ('learning_weight_buckets', 'weight_bucket', 'weight_factor', 'learning_weight_curve', 'weight'),
+}
+
+
+def _refresh_factor_curve(cursor, kind: str, first: int, last: int):
+    """
+    Räkna om materialiserad kurva för [first, last] inom pågående transaktion.
+
+    Varje kurvpunkt beror bara på buckets inom MAX_*_DISTANCE, så endast
+    det intervallet (plus marginal) läses.
+
+    Args:
+        cursor: Cursor i en öppen transaktion
+        kind: 'age' eller 'weight'
+        first: Första kurvpunkt att räkna om
+        last: Sista kurvpunkt att räkna om
+    """
+    import numpy as np
+    import interpolation_engine as ie
+
+    bucket_table, bucket_col, factor_col, curve_table, curve_col = _FACTOR_CURVE_TABLES[kind]
+    if kind == 'age':
+        curve_min, curve_max, distance = ie.AGE_CURVE_MIN, ie.AGE_CURVE_MAX, ie.MAX_AGE_DISTANCE
+        compute = ie.compute_age_curve
+    else:
+        curve_min, curve_max, distance = ie.WEIGHT_CURVE_MIN, ie.WEIGHT_CURVE_MAX, ie.MAX_WEIGHT_DISTANCE
+        compute = ie.compute_weight_curve
+
+    first, last = max(first, curve_min), min(last, curve_max)
+    if first > last:
+        return
+
+    cursor.execute(f'''
+        SELECT {bucket_col}, {factor_col}, num_observations
+        FROM {bucket_table}
+        WHERE {bucket_col} BETWEEN ? AND ?
+    ''', (first - distance, last + distance))
+    buckets = {
+        row[0]: {factor_col: row[1], 'num_observations': row[2]}
+        for row in cursor.fetchall()
+    }
+
+    targets = np.arange(first, last + 1)
+    curve = compute(buckets, targets)
+    cursor.executemany(f'''
+        INSERT OR REPLACE INTO {curve_table} ({curve_col}, smoothed_factor)
+        VALUES (?, ?)
+    ''', [(int(t), None if np.isnan(v) else float(v)) for t, v in zip(targets, curve)])
+
+
+def _refresh_factor_curve_window(cursor, kind: str, bucket: int):
+    """Räkna om kurvfönstret (±5 år / ±10 kg) som påverkas av en ändrad bucket."""
+    import interpolation_engine as ie
+
+    distance = ie.MAX_AGE_DISTANCE if kind == 'age' else ie.MAX_WEIGHT_DISTANCE
+    try:
+        _refresh_factor_curve(cursor, kind, bucket - distance, bucket + distance)
+    except sqlite3.OperationalError as e:
+        # Kurvtabellen saknas innan migration v9 har körts
+        logger.debug(f"Skipping {kind} curve refresh: {e}")
+
+
+def rebuild_factor_curves():
+    """Räkna om hela ålders- och viktkurvan från bucket-tabellerna."""
+    import interpolation_engine as ie
+
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            _refresh_factor_curve(cursor, 'age', ie.AGE_CURVE_MIN, ie.AGE_CURVE_MAX)
+            _refresh_factor_curve(cursor, 'weight', ie.WEIGHT_CURVE_MIN, ie.WEIGHT_CURVE_MAX)
+            conn.commit()
+    except Exception as e:
+        logger.error(f"Error rebuilding factor curves: {e}")
+        raise
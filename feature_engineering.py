@@ -3,84 +3,370 @@ import pandas as pd
 import numpy as np
 from config import LÄKEMEDELS_DATA, get_drug_by_ui_choice
 import math
+from dataclasses import dataclass, field
+from typing import Dict, Mapping, Optional, Sequence, Tuple
 
-def add_engineered_features(cases_df: pd.DataFrame, procedures_df: pd.DataFrame) -> pd.DataFrame:
+# Kategoriska kolumner som one-hot-kodas (drop_first) för ML-modellen
+ENCODE_COLUMNS = ['specialty', 'opioidHistory', 'asa', 'nsaid_choice', 'ketamine_choice',
+                  'lidocaine', 'betapred', 'sex', 'surgery_type']
+
+# Defaultvärden för ingreppets smärtprofil när ingreppet saknas
+DEFAULT_PAIN_SCORES = (5, 5, 2)
+
+# Smärtprofilens kolumner och deras namn i procedures-tabellen (painTypeScore m.fl. i databasen)
+PAIN_SCORE_COLUMNS = {
+    'somatic_score': ('somatic_score', 'painTypeScore'),
+    'visceral_score': ('visceral_score', 'painVisceral'),
+    'neuropathic_score': ('neuropathic_score', 'painNeuropathic'),
+}
+
+
+def compute_adjuvant_profile(row: Mapping, somatic_score: float, visceral_score: float,
+                             neuropathic_score: float) -> Dict[str, float]:
     """
-    Takes a DataFrame with cases and adds all calculated features needed
-    for both the rule engine and the ML model. Uses LÄKEMEDELS_DATA as the single source of truth.
-    This is the centralized location for all feature engineering.
+    Beräkna adjuvantprofil och smärttyps-mismatch för ett fall.
+
+    Args:
+        row: Fallets inputs (dict eller pandas-rad)
+        somatic_score, visceral_score, neuropathic_score: Ingreppets smärtprofil
+
+    Returns:
+        Dict med avg_adjuvant_*, pain_mismatch_3d och legacy 1D-features
     """
-    # Merge with procedure data to get pain scores
-    proc_pain_scores = procedures_df[[
-        'id', 'somatic_score', 'visceral_score', 'neuropathic_score'
-    ]].rename(columns={'id': 'procedure_id'})
+    somatic_scores, visceral_scores, neuropathic_scores = [], [], []
+
+    # Helper to add drug scores
+    def add_scores(drug):
+        if drug:
+            somatic_scores.append(drug['somatic_score'])
+            visceral_scores.append(drug['visceral_score'])
+            neuropathic_scores.append(drug['neuropathic_score'])
+
+    # NSAID
+    nsaid_choice = row.get('nsaid_choice', 'Ej given')
+    if row.get('nsaid') and nsaid_choice != 'Ej given':
+        add_scores(get_drug_by_ui_choice('nsaid', nsaid_choice))
+
+    # Catapressan
+    if row.get('catapressan') or row.get('catapressan_dose', 0) > 0:
+        add_scores(LÄKEMEDELS_DATA.get('clonidine'))
+
+    # Droperidol
+    if row.get('droperidol'):
+        add_scores(LÄKEMEDELS_DATA.get('droperidol'))
+
+    # Ketamine
+    ketamine_choice = row.get('ketamine_choice', 'Ej given')
+    if row.get('ketamine') and row['ketamine'] != 'Nej' and ketamine_choice != 'Ej given':
+        add_scores(get_drug_by_ui_choice('ketamine', ketamine_choice))
+
+    # Lidocaine
+    lidocaine_choice = row.get('lidocaine', 'Nej')
+    if lidocaine_choice != 'Nej':
+        add_scores(get_drug_by_ui_choice('lidocaine', lidocaine_choice))
+
+    # Betapred
+    betapred_choice = row.get('betapred', 'Nej')
+    if betapred_choice != 'Nej':
+        add_scores(get_drug_by_ui_choice('betapred', betapred_choice))
+
+    # Calculate average adjuvant profile
+    avg_somatic = np.mean(somatic_scores) if somatic_scores else 5
+    avg_visceral = np.mean(visceral_scores) if visceral_scores else 5
+    avg_neuropathic = np.mean(neuropathic_scores) if neuropathic_scores else 2
+
+    # 3D Mismatch (Euclidean distance)
+    distance = math.sqrt(
+        (somatic_score - avg_somatic)**2 +
+        (visceral_score - avg_visceral)**2 +
+        (neuropathic_score - avg_neuropathic)**2
+    )
+
+    return {
+        'avg_adjuvant_somatic': avg_somatic,
+        'avg_adjuvant_visceral': avg_visceral,
+        'avg_adjuvant_neuropathic': avg_neuropathic,
+        'pain_mismatch_3d': distance,
+        # Legacy 1D features for backwards compatibility
+        'painTypeScore': somatic_score,
+        'avgAdjuvantSelectivity': avg_somatic,
+        'painTypeMismatch': abs(somatic_score - avg_somatic),
+    }
+
+
+def _merge_pain_scores(cases_df: pd.DataFrame, procedures_df: pd.DataFrame) -> pd.DataFrame:
+    """Merge with procedure data to get pain scores (defaults for unknown procedures)."""
+    proc_pain_scores = pd.DataFrame({'procedure_id': procedures_df['id']})
+    for col, aliases in PAIN_SCORE_COLUMNS.items():
+        source = next((alias for alias in aliases if alias in procedures_df.columns), None)
+        proc_pain_scores[col] = procedures_df[source] if source else np.nan
 
     df = pd.merge(cases_df, proc_pain_scores, on='procedure_id', how='left')
     df['somatic_score'] = df['somatic_score'].fillna(5)
     df['visceral_score'] = df['visceral_score'].fillna(5)
     df['neuropathic_score'] = df['neuropathic_score'].fillna(2) # Default neuropathic is lower
+    return df
 
-    def calculate_adjuvant_profile(row):
-        somatic_scores, visceral_scores, neuropathic_scores = [], [], []
-
-        # Helper to add drug scores
-        def add_scores(drug):
-            if drug:
-                somatic_scores.append(drug['somatic_score'])
-                visceral_scores.append(drug['visceral_score'])
-                neuropathic_scores.append(drug['neuropathic_score'])
-
-        # NSAID
-        nsaid_choice = row.get('nsaid_choice', 'Ej given')
-        if row.get('nsaid') and nsaid_choice != 'Ej given':
-            add_scores(get_drug_by_ui_choice('nsaid', nsaid_choice))
-
-        # Catapressan
-        if row.get('catapressan') or row.get('catapressan_dose', 0) > 0:
-            add_scores(LÄKEMEDELS_DATA.get('clonidine'))
-
-        # Droperidol
-        if row.get('droperidol'):
-            add_scores(LÄKEMEDELS_DATA.get('droperidol'))
-
-        # Ketamine
-        ketamine_choice = row.get('ketamine_choice', 'Ej given')
-        if row.get('ketamine') and row['ketamine'] != 'Nej' and ketamine_choice != 'Ej given':
-            add_scores(get_drug_by_ui_choice('ketamine', ketamine_choice))
-
-        # Lidocaine
-        lidocaine_choice = row.get('lidocaine', 'Nej')
-        if lidocaine_choice != 'Nej':
-            add_scores(get_drug_by_ui_choice('lidocaine', lidocaine_choice))
-
-        # Betapred
-        betapred_choice = row.get('betapred', 'Nej')
-        if betapred_choice != 'Nej':
-            add_scores(get_drug_by_ui_choice('betapred', betapred_choice))
-
-        # Calculate average adjuvant profile
-        row['avg_adjuvant_somatic'] = np.mean(somatic_scores) if somatic_scores else 5
-        row['avg_adjuvant_visceral'] = np.mean(visceral_scores) if visceral_scores else 5
-        row['avg_adjuvant_neuropathic'] = np.mean(neuropathic_scores) if neuropathic_scores else 2
-
-        # 3D Mismatch (Euclidean distance)
-        distance = math.sqrt(
-            (row['somatic_score'] - row['avg_adjuvant_somatic'])**2 +
-            (row['visceral_score'] - row['avg_adjuvant_visceral'])**2 +
-            (row['neuropathic_score'] - row['avg_adjuvant_neuropathic'])**2
-        )
-        row['pain_mismatch_3d'] = distance
 
-        # Legacy 1D features for backwards compatibility
-        row['painTypeScore'] = row['somatic_score']
-        row['avgAdjuvantSelectivity'] = row['avg_adjuvant_somatic']
-        row['painTypeMismatch'] = abs(row['painTypeScore'] - row['avgAdjuvantSelectivity'])
+def _column(df: pd.DataFrame, name: str, default) -> pd.Series:
+    if name in df.columns:
+        return df[name]
+    return pd.Series([default] * len(df), index=df.index, dtype=object)
 
-        return row
 
-    df = df.apply(calculate_adjuvant_profile, axis=1)
-    
+def _truthy(values: pd.Series) -> np.ndarray:
+    """Elementvis bool(x), som row.get(...) i radversionen (NaN räknas som sant)."""
+    if values.dtype == object or isinstance(values.dtype, pd.StringDtype) or values.dtype.kind in 'OUS':
+        return values.map(bool).to_numpy(dtype=bool)
+    return (values.to_numpy() != 0) | values.isna().to_numpy()
+
+
+def _not_equal(values: pd.Series, other: str) -> np.ndarray:
+    """Elementvis x != other där NaN/None räknas som olika (som i Python)."""
+    return (values != other).fillna(True).to_numpy(dtype=bool)
+
+
+def _ui_choice_profiles() -> Dict[str, Tuple[float, float, float]]:
+    """UI-val -> (somatic, visceral, neuropathic), första träff som get_drug_by_ui_choice."""
+    profiles = {}
+    for drug in LÄKEMEDELS_DATA.values():
+        choice = drug.get('ui_choice')
+        if choice is not None and choice not in profiles:
+            profiles[choice] = (drug['somatic_score'], drug['visceral_score'], drug['neuropathic_score'])
+    return profiles
+
+
+def add_engineered_features(cases_df: pd.DataFrame, procedures_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Takes a DataFrame with cases and adds all calculated features needed
+    for both the rule engine and the ML model. Uses LÄKEMEDELS_DATA as the single source of truth.
+    This is the centralized location for all feature engineering.
+
+    Columnar implementation: each adjuvant is resolved with one lookup-table
+    map per column and the profiles are summed as arrays. Gives the same
+    values as add_engineered_features_rowwise (see benchmark_feature_engineering.py).
+    """
+    df = _merge_pain_scores(cases_df, procedures_df)
+    n = len(df)
+    profiles = _ui_choice_profiles()
+
+    sums = np.zeros((n, 3))
+    counts = np.zeros(n)
+
+    def add_drug(active: np.ndarray, choice: pd.Series):
+        profile = np.array([profiles.get(value, (np.nan,) * 3) if isinstance(value, str) else (np.nan,) * 3
+                            for value in choice.unique()], dtype=float).reshape(-1, 3)
+        codes = pd.Index(choice.unique()).get_indexer(choice)
+        row_profiles = profile[codes]
+        use = active & ~np.isnan(row_profiles[:, 0])
+        sums[use] += row_profiles[use]
+        counts[use] += 1
+
+    def add_fixed(active: np.ndarray, drug: Optional[Dict]):
+        if drug:
+            sums[active] += (drug['somatic_score'], drug['visceral_score'], drug['neuropathic_score'])
+            counts[active] += 1
+
+    # NSAID
+    nsaid_choice = _column(df, 'nsaid_choice', 'Ej given')
+    add_drug(_truthy(_column(df, 'nsaid', None)) & _not_equal(nsaid_choice, 'Ej given'), nsaid_choice)
+
+    # Catapressan
+    catapressan_dose = pd.to_numeric(_column(df, 'catapressan_dose', 0), errors='coerce').to_numpy(dtype=float)
+    add_fixed(_truthy(_column(df, 'catapressan', None)) | (catapressan_dose > 0), LÄKEMEDELS_DATA.get('clonidine'))
+
+    # Droperidol
+    add_fixed(_truthy(_column(df, 'droperidol', None)), LÄKEMEDELS_DATA.get('droperidol'))
+
+    # Ketamine
+    ketamine = _column(df, 'ketamine', None)
+    ketamine_choice = _column(df, 'ketamine_choice', 'Ej given')
+    add_drug(_truthy(ketamine) & _not_equal(ketamine, 'Nej') & _not_equal(ketamine_choice, 'Ej given'), ketamine_choice)
+
+    # Lidocaine, Betapred
+    for name in ('lidocaine', 'betapred'):
+        choice = _column(df, name, 'Nej')
+        add_drug(_not_equal(choice, 'Nej'), choice)
+
+    # Average adjuvant profile, defaults (5, 5, 2) without adjuvants
+    has_adjuvant = counts > 0
+    averages = np.where(has_adjuvant[:, np.newaxis], sums / np.maximum(counts, 1)[:, np.newaxis], (5.0, 5.0, 2.0))
+
+    pain_scores = df[['somatic_score', 'visceral_score', 'neuropathic_score']].to_numpy(dtype=float)
+
+    df['avg_adjuvant_somatic'] = averages[:, 0]
+    df['avg_adjuvant_visceral'] = averages[:, 1]
+    df['avg_adjuvant_neuropathic'] = averages[:, 2]
+
+    # 3D Mismatch (Euclidean distance)
+    df['pain_mismatch_3d'] = np.sqrt(((pain_scores - averages) ** 2).sum(axis=1))
+
+    # Legacy 1D features for backwards compatibility
+    df['painTypeScore'] = df['somatic_score']
+    df['avgAdjuvantSelectivity'] = df['avg_adjuvant_somatic']
+    df['painTypeMismatch'] = np.abs(pain_scores[:, 0] - averages[:, 0])
+
     # Note: The temporal features logic from ml_model.py depends on a 'pharmacokinetics.py' file
     # which is not present. This logic should also be moved here once that file is available.
-    
+
     return df
+
+
+def add_engineered_features_rowwise(cases_df: pd.DataFrame, procedures_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Radvis referensimplementation av add_engineered_features (df.apply per rad).
+
+    Behålls för ekvivalenstester och benchmark.
+    """
+    df = _merge_pain_scores(cases_df, procedures_df)
+
+    def calculate_adjuvant_profile(row):
+        for name, value in compute_adjuvant_profile(
+                row, row['somatic_score'], row['visceral_score'], row['neuropathic_score']).items():
+            row[name] = value
+        return row
+
+    return df.apply(calculate_adjuvant_profile, axis=1)
+
+
+def _to_float(value) -> float:
+    if value is None:
+        return np.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+@dataclass(frozen=True)
+class FeatureEncoder:
+    """
+    Anpassad featurekodare som sparas tillsammans med ML-modellen.
+
+    Ersätter get_dummies + kolumnalignering vid inferens: ett inputs-dict
+    mappas direkt till en float32-vektor i träningens kolumnordning.
+    Kategoriska värden som inte fanns i träningen ger nollor (som drop_first-
+    kategorin); saknade numeriska inputs får träningens median.
+    """
+    features: Tuple[str, ...]
+    categories: Dict[str, Tuple[str, ...]] = field(default_factory=dict)
+    defaults: Dict[str, float] = field(default_factory=dict)
+
+    def __post_init__(self):
+        index = {name: i for i, name in enumerate(self.features)}
+        dummy_index = {}
+        for col, values in self.categories.items():
+            for value in values:
+                position = index.get(f"{col}_{value}")
+                if position is not None:
+                    dummy_index[(col, value)] = position
+        dummy_positions = set(dummy_index.values())
+        numeric = tuple((name, i) for name, i in index.items() if i not in dummy_positions)
+
+        template = np.zeros(len(self.features), dtype=np.float32)
+        for name, i in numeric:
+            template[i] = self.defaults.get(name, 0.0)
+
+        object.__setattr__(self, '_index', index)
+        object.__setattr__(self, '_dummy_index', dummy_index)
+        object.__setattr__(self, '_numeric', numeric)
+        object.__setattr__(self, '_template', template)
+
+    def __getstate__(self):
+        return {'features': self.features, 'categories': self.categories, 'defaults': self.defaults}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+        self.__post_init__()
+
+    def transform(self, inputs: Mapping, pain_scores: Optional[Sequence[float]] = None,
+                  out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Koda ett inputs-dict till en featurevektor.
+
+        Args:
+            inputs: Patientinputs (samma nycklar som get_current_inputs)
+            pain_scores: Ingreppets (somatic, visceral, neuropathic), default DEFAULT_PAIN_SCORES
+            out: Förallokerad float32-vektor att skriva i (valfri)
+
+        Returns:
+            float32-vektor i features-ordning
+        """
+        if out is None:
+            out = self._template.copy()
+        else:
+            out[:] = self._template
+
+        somatic, visceral, neuropathic = pain_scores if pain_scores is not None else DEFAULT_PAIN_SCORES
+        values = dict(inputs)
+        values['somatic_score'] = somatic
+        values['visceral_score'] = visceral
+        values['neuropathic_score'] = neuropathic
+        values.update(compute_adjuvant_profile(inputs, somatic, visceral, neuropathic))
+
+        for name, i in self._numeric:
+            if name in values:
+                out[i] = _to_float(values[name])
+
+        for col in self.categories:
+            position = self._dummy_index.get((col, str(values.get(col))))
+            if position is not None:
+                out[position] = 1.0
+
+        return out
+
+    def transform_frame(self, df: pd.DataFrame) -> np.ndarray:
+        """
+        Koda en hel DataFrame (efter add_engineered_features) kolumnvis.
+
+        Samma regler som transform: saknade kolumner får default, okända
+        kategorier ger nollor.
+
+        Args:
+            df: Fall med råa kategoriska kolumner och engineered features
+
+        Returns:
+            float32-matris (len(df), len(features))
+        """
+        out = np.tile(self._template, (len(df), 1))
+        for name, i in self._numeric:
+            if name in df.columns:
+                out[:, i] = pd.to_numeric(df[name], errors='coerce').to_numpy(dtype=float)
+        for (col, value), i in self._dummy_index.items():
+            if col in df.columns:
+                out[:, i] = (df[col].astype(str) == value).to_numpy()
+        return out
+
+    def unseen_categories(self, df: pd.DataFrame) -> Dict[str, set]:
+        """Kategoriska värden i df som inte fanns i träningsdatan (kräver ny vokabulär)."""
+        unseen = {}
+        for col, values in self.categories.items():
+            if col in df.columns:
+                new_values = set(df[col].dropna().astype(str).unique()) - set(values)
+                if new_values:
+                    unseen[col] = new_values
+        return unseen
+
+
+def fit_feature_encoder(cases_df: pd.DataFrame, features: Sequence[str]) -> FeatureEncoder:
+    """
+    Anpassa en FeatureEncoder på träningsdata.
+
+    Args:
+        cases_df: Träningsfall efter add_engineered_features (före get_dummies)
+        features: Modellens kolumnordning (efter get_dummies)
+
+    Returns:
+        FeatureEncoder
+    """
+    categories = {
+        col: tuple(sorted(cases_df[col].dropna().astype(str).unique()))
+        for col in ENCODE_COLUMNS if col in cases_df.columns
+    }
+    defaults = {}
+    for name in features:
+        if name in cases_df.columns:
+            median = pd.to_numeric(cases_df[name], errors='coerce').median()
+            defaults[name] = float(median) if pd.notna(median) else 0.0
+    return FeatureEncoder(features=tuple(features), categories=categories, defaults=defaults)
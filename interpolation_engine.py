@@ -14,6 +14,7 @@ Detta gör systemet robust även med gles data (sparse data).
 import logging
 import math
 from typing import Dict, List, Tuple, Optional
+import numpy as np
 import database as db
 
 logger = logging.getLogger(__name__)
@@ -23,6 +24,14 @@ MAX_AGE_DISTANCE = 5  # Max avstånd för åldersinterpolation (år)
 MAX_WEIGHT_DISTANCE = 10  # Max avstånd för viktinterpolation (kg)
 MIN_OBSERVATIONS_FOR_INTERPOLATION = 3  # Minsta antal observationer för att lita på en datapunkt
 
+# Materialiserade faktorkurvor (ett värde per år/kg)
+AGE_CURVE_MIN, AGE_CURVE_MAX = 0, 120
+WEIGHT_CURVE_MIN, WEIGHT_CURVE_MAX = 1, 300
+AGE_SIGMA = 2.0
+WEIGHT_SIGMA = 3.0
+AGE_FACTOR_RANGE = (0.2, 2.0)
+WEIGHT_FACTOR_RANGE = (0.5, 2.0)
+
 
 def get_age_bucket(age: int) -> int:
     """
@@ -88,18 +97,27 @@ def gaussian_weight(distance: float, sigma: float = 1.0) -> float:
     return math.exp(-(distance ** 2) / (2 * sigma ** 2))
 
 
-def get_nearby_age_factors(target_age: int, max_distance: int = MAX_AGE_DISTANCE) -> List[Tuple[int, float, int, float]]:
+def get_nearby_age_factors(target_age: int, max_distance: int = MAX_AGE_DISTANCE,
+                           snapshot=None, buckets: Optional[Dict] = None) -> List[Tuple[int, float, int, float]]:
     """
     Hämta ålderfaktorer från närliggande åldrar.
 
+    Alla buckets i [target_age - max_distance, target_age + max_distance]
+    hämtas med EN intervallfråga (db.get_age_buckets_in_range).
+
     Args:
         target_age: Målålder vi vill interpolera för
         max_distance: Max avstånd i år att söka
+        snapshot: LearningSnapshot att läsa från (None = databasen)
+        buckets: Redan hämtat resultat från get_age_buckets_in_range (optional)
 
     Returns:
         List of tuples: (age, age_factor, num_observations, distance_weight)
         Sorterad efter avstånd (närmast först)
     """
+    if buckets is None:
+        source = snapshot if snapshot is not None else db
+        buckets = source.get_age_buckets_in_range(max(0, target_age - max_distance), target_age + max_distance)
     nearby_factors = []
 
     # Sök inom +/- max_distance år
@@ -109,13 +127,12 @@ def get_nearby_age_factors(target_age: int, max_distance: int = MAX_AGE_DISTANCE
         if neighbor_age < 0:
             continue
 
-        # Hämta data från databas
         try:
-            data = db.get_age_bucket_learning(neighbor_age)
+            data = buckets.get(neighbor_age)
 
             if data and data.get('num_observations', 0) >= MIN_OBSERVATIONS_FOR_INTERPOLATION:
                 distance = abs(age_offset)
-                weight = gaussian_weight(distance, sigma=2.0)
+                weight = gaussian_weight(distance, sigma=AGE_SIGMA)
 
                 nearby_factors.append((
                     neighbor_age,
@@ -133,18 +150,27 @@ def get_nearby_age_factors(target_age: int, max_distance: int = MAX_AGE_DISTANCE
     return nearby_factors
 
 
-def get_nearby_weight_factors(target_weight: int, max_distance: int = MAX_WEIGHT_DISTANCE) -> List[Tuple[int, float, int, float]]:
+def get_nearby_weight_factors(target_weight: int, max_distance: int = MAX_WEIGHT_DISTANCE,
+                              snapshot=None, buckets: Optional[Dict] = None) -> List[Tuple[int, float, int, float]]:
     """
     Hämta viktfaktorer från närliggande vikter.
 
+    Alla buckets i [target_weight - max_distance, target_weight + max_distance]
+    hämtas med EN intervallfråga (db.get_weight_buckets_in_range).
+
     Args:
         target_weight: Målvikt vi vill interpolera för (i kg)
         max_distance: Max avstånd i kg att söka
+        snapshot: LearningSnapshot att läsa från (None = databasen)
+        buckets: Redan hämtat resultat från get_weight_buckets_in_range (optional)
 
     Returns:
         List of tuples: (weight, weight_factor, num_observations, distance_weight)
         Sorterad efter avstånd (närmast först)
     """
+    if buckets is None:
+        source = snapshot if snapshot is not None else db
+        buckets = source.get_weight_buckets_in_range(max(1, target_weight - max_distance), target_weight + max_distance)
     nearby_factors = []
 
     # Sök inom +/- max_distance kg
@@ -154,13 +180,12 @@ def get_nearby_weight_factors(target_weight: int, max_distance: int = MAX_WEIGHT
         if neighbor_weight < 1:
             continue
 
-        # Hämta data från databas
         try:
-            data = db.get_weight_bucket_learning(neighbor_weight)
+            data = buckets.get(neighbor_weight)
 
             if data and data.get('num_observations', 0) >= MIN_OBSERVATIONS_FOR_INTERPOLATION:
                 distance = abs(weight_offset)
-                weight = gaussian_weight(distance, sigma=3.0)
+                weight = gaussian_weight(distance, sigma=WEIGHT_SIGMA)
 
                 nearby_factors.append((
                     neighbor_weight,
@@ -178,7 +203,7 @@ def get_nearby_weight_factors(target_weight: int, max_distance: int = MAX_WEIGHT
     return nearby_factors
 
 
-def interpolate_age_factor(age: int, default_factor: float) -> Dict:
+def interpolate_age_factor(age: int, default_factor: float, snapshot=None) -> Dict:
     """
     Interpolera ålderfaktor från närliggande åldrar om direktdata saknas.
 
@@ -190,6 +215,7 @@ def interpolate_age_factor(age: int, default_factor: float) -> Dict:
     Args:
         age: Målålder
         default_factor: Default-värde från regelbaserad formel (fallback)
+        snapshot: LearningSnapshot att läsa från (None = databasen)
 
     Returns:
         Dict med:
@@ -202,11 +228,15 @@ def interpolate_age_factor(age: int, default_factor: float) -> Dict:
     if default_factor is None:
         default_factor = 1.0  # Use 1.0 as neutral default if None provided
 
+    source = snapshot if snapshot is not None else db
     bucket = get_age_bucket(age)
 
+    # En intervallfråga täcker både direktdata och alla grannar
+    buckets = source.get_age_buckets_in_range(max(0, bucket - MAX_AGE_DISTANCE), bucket + MAX_AGE_DISTANCE)
+
     # 1. Försök hämta direktdata
     try:
-        direct_data = db.get_age_bucket_learning(bucket)
+        direct_data = buckets.get(bucket)
         if direct_data and direct_data.get('num_observations', 0) >= MIN_OBSERVATIONS_FOR_INTERPOLATION:
             return {
                 'age_factor': direct_data['age_factor'],
@@ -218,7 +248,7 @@ def interpolate_age_factor(age: int, default_factor: float) -> Dict:
         logger.debug(f"No direct data for age {age}: {e}")
 
     # 2. Interpolera från närliggande åldrar
-    nearby = get_nearby_age_factors(age)
+    nearby = get_nearby_age_factors(age, snapshot=snapshot, buckets=buckets)
 
     if not nearby:
         # Ingen data alls, använd default
@@ -256,7 +286,7 @@ def interpolate_age_factor(age: int, default_factor: float) -> Dict:
     interpolated_factor = total_weighted_factor / total_weight
 
     # Sanity check: interpolerad faktor ska vara rimlig
-    if interpolated_factor < 0.2 or interpolated_factor > 2.0:
+    if interpolated_factor < AGE_FACTOR_RANGE[0] or interpolated_factor > AGE_FACTOR_RANGE[1]:
         logger.warning(f"Interpolated age factor {interpolated_factor:.3f} for age {age} is out of range, using default")
         return {
             'age_factor': default_factor,
@@ -274,7 +304,7 @@ def interpolate_age_factor(age: int, default_factor: float) -> Dict:
     }
 
 
-def interpolate_weight_factor(weight: float, default_factor: float) -> Dict:
+def interpolate_weight_factor(weight: float, default_factor: float, snapshot=None) -> Dict:
     """
     Interpolera viktfaktor från närliggande vikter om direktdata saknas.
 
@@ -283,6 +313,7 @@ def interpolate_weight_factor(weight: float, default_factor: float) -> Dict:
     Args:
         weight: Målvikt i kg
         default_factor: Default-värde (fallback)
+        snapshot: LearningSnapshot att läsa från (None = databasen)
 
     Returns:
         Dict med interpolerad faktor och metadata
@@ -291,11 +322,15 @@ def interpolate_weight_factor(weight: float, default_factor: float) -> Dict:
     if default_factor is None:
         default_factor = 1.0  # Use 1.0 as neutral default if None provided
 
+    source = snapshot if snapshot is not None else db
     bucket = get_weight_bucket(weight)
 
+    # En intervallfråga täcker både direktdata och alla grannar
+    buckets = source.get_weight_buckets_in_range(max(1, bucket - MAX_WEIGHT_DISTANCE), bucket + MAX_WEIGHT_DISTANCE)
+
     # 1. Försök hämta direktdata
     try:
-        direct_data = db.get_weight_bucket_learning(bucket)
+        direct_data = buckets.get(bucket)
         if direct_data and direct_data.get('num_observations', 0) >= MIN_OBSERVATIONS_FOR_INTERPOLATION:
             return {
                 'weight_factor': direct_data['weight_factor'],
@@ -307,7 +342,7 @@ def interpolate_weight_factor(weight: float, default_factor: float) -> Dict:
         logger.debug(f"No direct data for weight {bucket}kg: {e}")
 
     # 2. Interpolera från närliggande vikter
-    nearby = get_nearby_weight_factors(bucket)
+    nearby = get_nearby_weight_factors(bucket, snapshot=snapshot, buckets=buckets)
 
     if not nearby:
         return {
@@ -342,7 +377,7 @@ def interpolate_weight_factor(weight: float, default_factor: float) -> Dict:
     interpolated_factor = total_weighted_factor / total_weight
 
     # Sanity check
-    if interpolated_factor < 0.5 or interpolated_factor > 2.0:
+    if interpolated_factor < WEIGHT_FACTOR_RANGE[0] or interpolated_factor > WEIGHT_FACTOR_RANGE[1]:
         logger.warning(f"Interpolated weight factor {interpolated_factor:.3f} for {bucket}kg is out of range, using default")
         return {
             'weight_factor': default_factor,
@@ -360,6 +395,70 @@ def interpolate_weight_factor(weight: float, default_factor: float) -> Dict:
     }
 
 
+def smooth_factor_curve(buckets: Dict[int, Dict], factor_key: str, targets: np.ndarray,
+                        max_distance: int, sigma: float,
+                        factor_range: Tuple[float, float]) -> np.ndarray:
+    """
+    Beräkna utjämnad faktor för många målpunkter på en gång (vektoriserat).
+
+    Samma algoritm som interpolate_age_factor/interpolate_weight_factor:
+    direktdata om bucketen har tillräckligt många observationer, annars
+    Gaussiskt viktat medelvärde av grannar inom max_distance.
+
+    Args:
+        buckets: {bucket: {factor_key: X, 'num_observations': N}}
+        factor_key: 'age_factor' eller 'weight_factor'
+        targets: Heltalsbuckets att beräkna för
+        max_distance: Max avstånd till grannar
+        sigma: Gaussisk standardavvikelse
+        factor_range: Tillåtet intervall för interpolerat värde
+
+    Returns:
+        Array med faktor per målpunkt, NaN där default-formeln ska användas
+    """
+    targets = np.asarray(targets, dtype=float)
+    result = np.full(len(targets), np.nan)
+
+    trusted = [(b, d[factor_key], d['num_observations']) for b, d in buckets.items()
+               if (d.get('num_observations') or 0) >= MIN_OBSERVATIONS_FOR_INTERPOLATION]
+    if not trusted or len(targets) == 0:
+        return result
+
+    keys = np.array([t[0] for t in trusted], dtype=float)
+    factors = np.array([t[1] for t in trusted], dtype=float)
+    observations = np.array([t[2] for t in trusted], dtype=float)
+
+    distance = np.abs(targets[:, None] - keys[None, :])
+    in_window = distance <= max_distance
+    weights = np.exp(-(distance ** 2) / (2 * sigma ** 2)) * np.minimum(1.0, observations / 10.0)
+    weights = np.where(in_window, weights, 0.0)
+
+    total_weight = weights.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        interpolated = (weights * factors).sum(axis=1) / total_weight
+    valid = (total_weight > 0) & (interpolated >= factor_range[0]) & (interpolated <= factor_range[1])
+    result[valid] = interpolated[valid]
+
+    # Direktdata har företräde och sanity-checkas inte (som i skalära vägen)
+    direct = distance == 0
+    has_direct = direct.any(axis=1)
+    result[has_direct] = factors[direct.argmax(axis=1)[has_direct]]
+
+    return result
+
+
+def compute_age_curve(buckets: Dict[int, Dict], targets: np.ndarray) -> np.ndarray:
+    """Utjämnad åldersfaktor per ålder i targets (NaN = använd default)."""
+    return smooth_factor_curve(buckets, 'age_factor', targets,
+                               MAX_AGE_DISTANCE, AGE_SIGMA, AGE_FACTOR_RANGE)
+
+
+def compute_weight_curve(buckets: Dict[int, Dict], targets: np.ndarray) -> np.ndarray:
+    """Utjämnad viktfaktor per kg i targets (NaN = använd default)."""
+    return smooth_factor_curve(buckets, 'weight_factor', targets,
+                               MAX_WEIGHT_DISTANCE, WEIGHT_SIGMA, WEIGHT_FACTOR_RANGE)
+
+
 def detect_age_trends(min_age: int = 0, max_age: int = 100) -> Dict:
     """
     Analysera trender i åldersdata för att upptäcka mönster.
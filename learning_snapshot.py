@@ -0,0 +1,385 @@
+"""
+Learning Snapshot - Oföränderlig ögonblicksbild av all inlärning
+================================================================
+Läser samtliga learning_*-tabeller i EN lästransaktion och exponerar samma
+uppslagsfunktioner som database.py (get_asa_factor, get_age_bucket_learning,
+get_calibration_factor, ...), men helt i minnet.
+
+Regelmotorn tar en snapshot som argument och gör därmed noll databasanrop per
+dosberäkning. Alla faktorer i en beräkning ser dessutom samma, konsistenta
+version av inlärningsdatan.
+
+Processdelad cache: get_cached_learning_snapshot() håller en gemensam
+snapshot för alla sessioner/trådar i serverprocessen. Den invalideras när
+database.bump_learning_version() anropas (varje update_* i database.py) eller
+när SQLite:s `PRAGMA data_version` visar att en annan process skrivit.
+
+Exempel:
+    snapshot = get_cached_learning_snapshot()
+    result = calculate_rule_based_dose(inputs, procedures_df, snapshot=snapshot)
+"""
+
+import sqlite3
+import logging
+import threading
+from dataclasses import dataclass, field, fields
+from types import MappingProxyType
+from typing import Dict, Mapping, Optional, Tuple
+import numpy as np
+import database as db
+import interpolation_engine as ie
+
+logger = logging.getLogger(__name__)
+
+def _empty_mapping() -> Mapping:
+    return MappingProxyType({})
+
+# Samma fallback-värden som motsvarande getters i database.py
+DEFAULT_OPIOID_TOLERANCE_FACTOR = 1.5
+DEFAULT_PAIN_THRESHOLD_FACTOR = 1.2
+DEFAULT_RENAL_FACTOR = 0.75
+DEFAULT_FENTANYL_REMAINING_FRACTION = 0.25
+
+
+@dataclass(frozen=True)
+class LearningSnapshot:
+    """
+    Oföränderlig vy över alla globala inlärningstabeller.
+
+    Metoderna har samma signatur och samma fallback-beteende som
+    motsvarande funktioner i database.py, så en snapshot kan användas
+    överallt där modulen `database` används som uppslagskälla.
+    """
+    age_buckets: Mapping[int, Tuple[float, int]] = field(default_factory=_empty_mapping)
+    weight_buckets: Mapping[int, Tuple[float, int]] = field(default_factory=_empty_mapping)
+    asa_factors: Mapping[str, float] = field(default_factory=_empty_mapping)
+    sex_factors: Mapping[str, float] = field(default_factory=_empty_mapping)
+    body_composition: Mapping[Tuple[str, float], float] = field(default_factory=_empty_mapping)
+    procedures_3d: Mapping[str, Dict] = field(default_factory=_empty_mapping)
+    synergy_factors: Mapping[str, float] = field(default_factory=_empty_mapping)
+    adjuvant_potency_percent: Mapping[str, float] = field(default_factory=_empty_mapping)
+    calibration_factors: Mapping[Tuple[int, str], float] = field(default_factory=_empty_mapping)
+    opioid_tolerance_factor: Optional[float] = None
+    pain_threshold_factor: Optional[float] = None
+    renal_factor: Optional[float] = None
+    # learning_fentanyl är per användare (init_database) eller global id = 1 (efter migration v4)
+    fentanyl_remaining_fractions: Mapping[int, float] = field(default_factory=_empty_mapping)
+    fentanyl_remaining_fraction: Optional[float] = None
+    # Utjämnade faktorkurvor, index = ålder/kg - kurvans minimum (NaN = default)
+    age_curve: Optional[np.ndarray] = field(default=None, compare=False)
+    weight_curve: Optional[np.ndarray] = field(default=None, compare=False)
+
+    def __post_init__(self):
+        # Skrivskydda uppslagstabeller som skickats in som vanliga dict
+        for f in fields(self):
+            value = getattr(self, f.name)
+            if isinstance(value, dict):
+                object.__setattr__(self, f.name, MappingProxyType(value))
+
+        # Saknas materialiserad kurva räknas den fram från buckets
+        if self.age_curve is None:
+            ages = np.arange(ie.AGE_CURVE_MIN, ie.AGE_CURVE_MAX + 1)
+            object.__setattr__(self, 'age_curve', ie.compute_age_curve(
+                self.get_age_buckets_in_range(ie.AGE_CURVE_MIN, ie.AGE_CURVE_MAX), ages))
+        if self.weight_curve is None:
+            weights = np.arange(ie.WEIGHT_CURVE_MIN, ie.WEIGHT_CURVE_MAX + 1)
+            object.__setattr__(self, 'weight_curve', ie.compute_weight_curve(
+                self.get_weight_buckets_in_range(ie.WEIGHT_CURVE_MIN, ie.WEIGHT_CURVE_MAX), weights))
+        self.age_curve.setflags(write=False)
+        self.weight_curve.setflags(write=False)
+
+    # ---------- Ålder/vikt-buckets ----------
+
+    def get_age_bucket_learning(self, age_bucket: int) -> Optional[Dict]:
+        """Hämta inlärningsdata för specifik åldersbucket (se db.get_age_bucket_learning)."""
+        entry = self.age_buckets.get(age_bucket)
+        if entry is None:
+            return None
+        return {'age_factor': entry[0], 'num_observations': entry[1]}
+
+    def get_weight_bucket_learning(self, weight_bucket: int) -> Optional[Dict]:
+        """Hämta inlärningsdata för specifik viktbucket (se db.get_weight_bucket_learning)."""
+        entry = self.weight_buckets.get(weight_bucket)
+        if entry is None:
+            return None
+        return {'weight_factor': entry[0], 'num_observations': entry[1]}
+
+    def get_age_buckets_in_range(self, min_age: int, max_age: int) -> Dict[int, Dict]:
+        """Alla åldersbuckets i [min_age, max_age] (se db.get_age_buckets_in_range)."""
+        return {
+            age: {'age_factor': entry[0], 'num_observations': entry[1]}
+            for age, entry in self.age_buckets.items()
+            if min_age <= age <= max_age
+        }
+
+    def get_weight_buckets_in_range(self, min_weight: int, max_weight: int) -> Dict[int, Dict]:
+        """Alla viktbuckets i [min_weight, max_weight] (se db.get_weight_buckets_in_range)."""
+        return {
+            weight: {'weight_factor': entry[0], 'num_observations': entry[1]}
+            for weight, entry in self.weight_buckets.items()
+            if min_weight <= weight <= max_weight
+        }
+
+    def get_smoothed_age_factor(self, age: float, default_factor: float) -> float:
+        """
+        O(1)-uppslag av utjämnad åldersfaktor (samma värde som interpolate_age_factor).
+
+        Åldrar utanför kurvan faller tillbaka på vanlig interpolation.
+        """
+        index = int(age) - ie.AGE_CURVE_MIN
+        if 0 <= index < len(self.age_curve):
+            value = self.age_curve[index]
+            return default_factor if np.isnan(value) else float(value)
+        return ie.interpolate_age_factor(age, default_factor, snapshot=self)['age_factor']
+
+    def get_smoothed_weight_factor(self, weight: float, default_factor: float) -> float:
+        """O(1)-uppslag av utjämnad viktfaktor (samma värde som interpolate_weight_factor)."""
+        index = ie.get_weight_bucket(weight) - ie.WEIGHT_CURVE_MIN
+        if 0 <= index < len(self.weight_curve):
+            value = self.weight_curve[index]
+            return default_factor if np.isnan(value) else float(value)
+        return ie.interpolate_weight_factor(weight, default_factor, snapshot=self)['weight_factor']
+
+    # ---------- Patientfaktorer ----------
+
+    def get_asa_factor(self, asa_class: str, default_factor: float) -> float:
+        """Hämta ASA-faktor."""
+        return self.asa_factors.get(asa_class, default_factor)
+
+    def get_sex_factor(self, sex: str, default_factor: float) -> float:
+        """Hämta könsfaktor."""
+        return self.sex_factors.get(sex, default_factor)
+
+    def get_body_composition_factor(self, metric_type: str, metric_value: float, default_factor: float) -> float:
+        """Hämta kroppsviktsfaktor för 'weight' | 'ibw_ratio' | 'abw_ratio' | 'bmi'."""
+        return self.body_composition.get((metric_type, float(metric_value)), default_factor)
+
+    def get_opioid_tolerance_factor(self) -> float:
+        """Hämta opioid tolerans faktor."""
+        if self.opioid_tolerance_factor is None:
+            return DEFAULT_OPIOID_TOLERANCE_FACTOR
+        return self.opioid_tolerance_factor
+
+    def get_pain_threshold_factor(self) -> float:
+        """Hämta smärttröskel faktor."""
+        if self.pain_threshold_factor is None:
+            return DEFAULT_PAIN_THRESHOLD_FACTOR
+        return self.pain_threshold_factor
+
+    def get_renal_factor(self) -> float:
+        """Hämta njurfaktorn."""
+        if self.renal_factor is None:
+            return DEFAULT_RENAL_FACTOR
+        return self.renal_factor
+
+    # ---------- Ingrepp, adjuvanter, synergi ----------
+
+    def get_procedure_learning_3d(self, procedure_id: str, default_base_ime: float,
+                                  default_pain_somatic: float, default_pain_visceral: float,
+                                  default_pain_neuropathic: float) -> Dict:
+        """Hämta inlärd 3D pain data för ett ingrepp (se db.get_procedure_learning_3d)."""
+        learned = self.procedures_3d.get(procedure_id)
+        if learned:
+            return dict(learned)
+        return {
+            'base_ime': default_base_ime,
+            'pain_somatic': default_pain_somatic,
+            'pain_visceral': default_pain_visceral,
+            'pain_neuropathic': default_pain_neuropathic,
+            'num_cases': 0
+        }
+
+    def get_adjuvant_potency_percent(self, adjuvant_name: str, default_potency_percent: float) -> float:
+        """Hämta inlärd percentage-based potency för ett adjuvant."""
+        return self.adjuvant_potency_percent.get(adjuvant_name, default_potency_percent)
+
+    def get_synergy_factor(self, drug_combo: str) -> float:
+        """Hämta synergifaktor för läkemedelskombination."""
+        if not drug_combo:
+            return 1.0
+        return self.synergy_factors.get(drug_combo, 1.0)
+
+    def get_drug_combination_key(self, inputs: Dict) -> str:
+        """Generera en nyckel för läkemedelskombination (ren funktion, ingen DB)."""
+        return db.get_drug_combination_key(inputs)
+
+    # ---------- Fentanyl och kalibrering ----------
+
+    def get_fentanyl_remaining_fraction(self, user_id=None) -> float:
+        """Hämta fentanyl remaining fraction per användare (samma semantik som db-versionen)."""
+        if not user_id:
+            return DEFAULT_FENTANYL_REMAINING_FRACTION
+        if user_id in self.fentanyl_remaining_fractions:
+            return self.fentanyl_remaining_fractions[user_id]
+        if self.fentanyl_remaining_fraction is None:
+            return DEFAULT_FENTANYL_REMAINING_FRACTION
+        return self.fentanyl_remaining_fraction
+
+    def get_calibration_factor(self, user_id: int, composite_key: str) -> float:
+        """Hämta kalibreringsfaktor för en specifik konfiguration."""
+        if not user_id or not composite_key:
+            return 1.0
+        return self.calibration_factors.get((user_id, composite_key), 1.0)
+
+
+def _fetch_rows(cursor, query: str):
+    """Kör en SELECT och returnera rader, eller tom lista om tabellen saknas."""
+    try:
+        cursor.execute(query)
+        return cursor.fetchall()
+    except sqlite3.OperationalError as e:
+        logger.debug(f"Skipping learning table in snapshot: {e}")
+        return []
+
+
+def _fetch_scalar(cursor, query: str) -> Optional[float]:
+    """Hämta ett enskilt globalt värde (id = 1-tabellerna), eller None."""
+    rows = _fetch_rows(cursor, query)
+    return rows[0][0] if rows else None
+
+
+def _curve_array(rows, first: int, last: int) -> Optional[np.ndarray]:
+    """Bygg tät kurvarray av (nyckel, faktor)-rader, eller None om kurvan saknas."""
+    if not rows:
+        return None
+    curve = np.full(last - first + 1, np.nan)
+    for key, factor in rows:
+        if first <= key <= last and factor is not None:
+            curve[key - first] = factor
+    return curve
+
+
+def load_learning_snapshot() -> LearningSnapshot:
+    """
+    Läs alla learning_*-tabeller i en enda lästransaktion.
+
+    Saknade tabeller (t.ex. innan migrationer körts) ger tomma uppslag,
+    vilket motsvarar default-värden i regelmotorn.
+
+    Returns:
+        LearningSnapshot
+    """
+    try:
+        with db.get_connection() as conn:
+            cursor = conn.cursor()
+            # Explicit transaktion: alla SELECT ser samma databasversion
+            began = not conn.in_transaction
+            if began:
+                cursor.execute('BEGIN')
+            try:
+                age_rows = _fetch_rows(cursor, 'SELECT age_bucket, age_factor, num_observations FROM learning_age_buckets')
+                weight_rows = _fetch_rows(cursor, 'SELECT weight_bucket, weight_factor, num_observations FROM learning_weight_buckets')
+                asa_rows = _fetch_rows(cursor, 'SELECT asa_class, asa_factor FROM learning_asa_factors')
+                sex_rows = _fetch_rows(cursor, 'SELECT sex, sex_factor FROM learning_sex_factors')
+                body_rows = _fetch_rows(cursor, 'SELECT metric_type, metric_value, composition_factor FROM learning_body_composition')
+                proc_rows = _fetch_rows(cursor, '''
+                    SELECT procedure_id, base_ime, pain_somatic, pain_visceral, pain_neuropathic, num_cases
+                    FROM learning_procedures
+                ''')
+                synergy_rows = _fetch_rows(cursor, 'SELECT drug_combo, synergy_factor FROM learning_synergy')
+                adjuvant_rows = _fetch_rows(cursor, 'SELECT adjuvant_name, potency_percent FROM learning_adjuvants_percent')
+                calibration_rows = _fetch_rows(cursor, 'SELECT user_id, composite_key, calibration_factor FROM learning_calibration')
+                opioid_factor = _fetch_scalar(cursor, 'SELECT tolerance_factor FROM learning_opioid_tolerance WHERE id = 1')
+                threshold_factor = _fetch_scalar(cursor, 'SELECT threshold_factor FROM learning_pain_threshold WHERE id = 1')
+                renal_factor = _fetch_scalar(cursor, 'SELECT renal_factor FROM learning_renal_factor WHERE id = 1')
+                fentanyl_columns = {row[1] for row in _fetch_rows(cursor, 'PRAGMA table_info(learning_fentanyl)')}
+                fentanyl_rows, fentanyl_fraction = [], None
+                if 'user_id' in fentanyl_columns:
+                    fentanyl_rows = _fetch_rows(cursor, 'SELECT user_id, remaining_fraction FROM learning_fentanyl')
+                elif fentanyl_columns:
+                    fentanyl_fraction = _fetch_scalar(cursor, 'SELECT remaining_fraction FROM learning_fentanyl WHERE id = 1')
+                age_curve_rows = _fetch_rows(cursor, 'SELECT age, smoothed_factor FROM learning_age_curve')
+                weight_curve_rows = _fetch_rows(cursor, 'SELECT weight, smoothed_factor FROM learning_weight_curve')
+            finally:
+                if began:
+                    conn.rollback()
+    except Exception as e:
+        logger.error(f"Error in load_learning_snapshot: {e}")
+        raise
+
+    return LearningSnapshot(
+        age_buckets=MappingProxyType({row[0]: (row[1], row[2] or 0) for row in age_rows}),
+        weight_buckets=MappingProxyType({row[0]: (row[1], row[2] or 0) for row in weight_rows}),
+        asa_factors=MappingProxyType({row[0]: row[1] for row in asa_rows}),
+        sex_factors=MappingProxyType({row[0]: row[1] for row in sex_rows}),
+        body_composition=MappingProxyType({(row[0], float(row[1])): row[2] for row in body_rows}),
+        procedures_3d=MappingProxyType({
+            row[0]: MappingProxyType({
+                'base_ime': row[1],
+                'pain_somatic': row[2],
+                'pain_visceral': row[3],
+                'pain_neuropathic': row[4],
+                'num_cases': row[5]
+            })
+            for row in proc_rows
+        }),
+        synergy_factors=MappingProxyType({row[0]: row[1] for row in synergy_rows}),
+        adjuvant_potency_percent=MappingProxyType({row[0]: row[1] for row in adjuvant_rows}),
+        calibration_factors=MappingProxyType({(row[0], row[1]): row[2] for row in calibration_rows}),
+        opioid_tolerance_factor=opioid_factor,
+        pain_threshold_factor=threshold_factor,
+        renal_factor=renal_factor,
+        fentanyl_remaining_fractions=MappingProxyType({row[0]: row[1] for row in fentanyl_rows}),
+        fentanyl_remaining_fraction=fentanyl_fraction,
+        age_curve=_curve_array(age_curve_rows, ie.AGE_CURVE_MIN, ie.AGE_CURVE_MAX),
+        weight_curve=_curve_array(weight_curve_rows, ie.WEIGHT_CURVE_MIN, ie.WEIGHT_CURVE_MAX),
+    )
+
+
+# ---------- Processdelad cache ----------
+
+_cache_lock = threading.Lock()
+_cached_snapshot: Optional[LearningSnapshot] = None
+_cached_key: Optional[Tuple] = None
+_version_conn: Optional[sqlite3.Connection] = None
+_version_conn_path: Optional[str] = None
+
+
+def _get_data_version() -> int:
+    """
+    Läs `PRAGMA data_version` på en långlivad anslutning.
+
+    data_version ändras bara när en ANNAN anslutning har committat, därför
+    måste samma anslutning återanvändas mellan anropen. Anropas med
+    _cache_lock hållet.
+    """
+    global _version_conn, _version_conn_path
+    if _version_conn is None or _version_conn_path != db.DB_PATH:
+        if _version_conn is not None:
+            _version_conn.close()
+        _version_conn = sqlite3.connect(db.DB_PATH, timeout=10.0, check_same_thread=False)
+        _version_conn_path = db.DB_PATH
+    return _version_conn.execute('PRAGMA data_version').fetchone()[0]
+
+
+def get_cached_learning_snapshot() -> LearningSnapshot:
+    """
+    Hämta processdelad LearningSnapshot, laddas om endast vid ändringar.
+
+    Cachen är giltig så länge varken lokal versionsräknare
+    (database.get_learning_version) eller SQLite:s data_version har ändrats.
+
+    Returns:
+        LearningSnapshot
+    """
+    global _cached_snapshot, _cached_key
+    with _cache_lock:
+        # Läs versionen FÖRE laddning: en samtidig skrivning ger då en
+        # inaktuell nyckel och nästa anrop laddar om.
+        key = (db.DB_PATH, db.get_learning_version(), _get_data_version())
+        if _cached_snapshot is not None and _cached_key == key:
+            return _cached_snapshot
+
+        snapshot = load_learning_snapshot()
+        _cached_snapshot = snapshot
+        _cached_key = key
+        logger.debug(f"Learning snapshot reloaded (version key {key[1:]})")
+        return snapshot
+
+
+def invalidate_learning_cache():
+    """Töm processdelad cache (t.ex. efter massimport eller i tester)."""
+    global _cached_snapshot, _cached_key
+    with _cache_lock:
+        _cached_snapshot = None
+        _cached_key = None
@@ -14,13 +14,20 @@ Architecture:
 GPBoost = Gradient Boosting (fixed effects) + Gaussian Process (random effects)
 """
 
+import hashlib
 import logging
+import math
+import os
 import pickle
-from typing import Dict, List, Tuple, Optional
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, NamedTuple, Sequence, Tuple, Optional
 import pandas as pd
 import numpy as np
 from pathlib import Path
 
+import model_registry
+
 logger = logging.getLogger(__name__)
 
 # Try to import gpboost, provide helpful message if not available
@@ -35,63 +42,167 @@ except ImportError:
     GPBOOST_AVAILABLE = False
 
 
-# Model save path
+# Trained models are published as versions in model_registry
+REGISTRY_NAME = 'meml'
+MODEL_FILE = 'model.txt'
+FEATURE_NAMES_FILE = 'feature_names.pkl'
+
+# Fixed paths used before model_registry; only read when the registry is empty
 MODEL_DIR = Path("models")
 MODEL_DIR.mkdir(exist_ok=True)
 MODEL_PATH = MODEL_DIR / "meml_oxycodone_dose.txt"
 FEATURE_NAMES_PATH = MODEL_DIR / "meml_feature_names.pkl"
 
+# Candidate doses for the dose-response curve (mg)
+DOSE_GRID_MAX = 20.0
+DOSE_GRID_STEP = 0.25
+
+
+# Feature columns and their storage dtypes (binary flags as int8, the rest float32)
+FEATURE_DTYPES = {
+    'age': np.float32, 'weight': np.float32, 'height': np.float32, 'sex_binary': np.int8,  # Demographics
+    'lbm_kg': np.float32,  # Body composition
+    'gfr': np.float32, 'hepatic_impairment_binary': np.int8,  # Physiology
+    'opioid_tolerance_binary': np.int8,  # Tolerance
+    'pain_somatic': np.float32, 'pain_visceral': np.float32, 'pain_neuropathic': np.float32,  # Procedure pain
+    'nsaid': np.int8, 'ketamine': np.int8, 'catapressan': np.int8, 'droperidol': np.int8,  # Adjuvants
+    'lidocaine': np.int8, 'betapred': np.int8,
+}
+PK_FEATURE_DTYPES = {'pk_clearance': np.float32, 'pk_vd': np.float32, 'pk_half_life': np.float32}
+
+# Defaults for missing patient data, shared by training extraction and engineer_features
+PATIENT_DEFAULTS = {'age': 50, 'weight': 75, 'height': 175, 'gfr': 90}
+RENAL_IMPAIRMENT_GFR = 30  # The "GFR <35" checkbox is the only stored renal information
+DEFAULT_PAIN_PROFILE = (5, 5, 2)  # somatic, visceral, neuropathic
+TRAINING_CHUNK_SIZE = 5000
+
+
+def _numeric_column(values, default) -> np.ndarray:
+    """Tuple of DB values -> float64 array with NULL replaced by default."""
+    column = np.array(values, dtype=np.float64)
+    column[np.isnan(column)] = default
+    return column
+
+
+def _flag_column(values, false_value=None) -> np.ndarray:
+    """Tuple of DB values -> 0/1. With false_value: 1 if set and different from it."""
+    if false_value is None:
+        return (_numeric_column(values, 0) != 0).astype(np.int8)
+    column = np.array(values, dtype=object)
+    return (~pd.isna(column) & (column != false_value)).astype(np.int8)
+
+
+def _engineer_chunk(chunk: Dict[str, tuple], include_pk_features: bool) -> Dict[str, np.ndarray]:
+    """Vectorized engineer_features for one column-oriented chunk from the database."""
+    from calculation_engine import calculate_lean_body_mass_batch
+    import pk_model
+
+    sex = np.array(chunk['sex'], dtype=object)
+    sex[pd.isna(sex)] = 'Man'
+    age = _numeric_column(chunk['age'], PATIENT_DEFAULTS['age'])
+    weight = _numeric_column(chunk['weight'], PATIENT_DEFAULTS['weight'])
+    height = _numeric_column(chunk['height'], PATIENT_DEFAULTS['height'])
+    gfr = np.where(_flag_column(chunk['renal_impairment']) == 1, RENAL_IMPAIRMENT_GFR, PATIENT_DEFAULTS['gfr'])
+    lbm = calculate_lean_body_mass_batch(weight, height, female=(sex == 'Kvinna'))
+
+    features = {
+        'age': age,
+        'weight': weight,
+        'height': height,
+        'sex_binary': (sex == 'Man').astype(np.int8),
+        'lbm_kg': lbm,
+        'gfr': gfr,
+        'hepatic_impairment_binary': np.zeros(len(age), dtype=np.int8),  # Not recorded on cases
+        'opioid_tolerance_binary': (np.array(chunk['opioid_history'], dtype=object) == 'Opioidtolerant').astype(np.int8),
+        'pain_somatic': _numeric_column(chunk['pain_somatic'], DEFAULT_PAIN_PROFILE[0]),
+        'pain_visceral': _numeric_column(chunk['pain_visceral'], DEFAULT_PAIN_PROFILE[1]),
+        'pain_neuropathic': _numeric_column(chunk['pain_neuropathic'], DEFAULT_PAIN_PROFILE[2]),
+        'nsaid': _flag_column(chunk['nsaid']),
+        'ketamine': _flag_column(chunk['ketamine_choice'], 'Ej given'),
+        'catapressan': _flag_column(chunk['catapressan']),
+        'droperidol': _flag_column(chunk['droperidol']),
+        'lidocaine': _flag_column(chunk['lidocaine'], 'Nej'),
+        'betapred': _flag_column(chunk['betapred'], 'Nej'),
+    }
+
+    if include_pk_features:
+        pk = pk_model.calculate_pk_batch(age, lbm, gfr=gfr)
+        features['pk_clearance'] = pk['clearance_L_per_h']
+        features['pk_vd'] = pk['vd_L']
+        features['pk_half_life'] = pk['half_life_h']
+
+    return features
 
-def prepare_training_data(include_pk_features: bool = True) -> Tuple[pd.DataFrame, pd.Series, pd.Series]:
+
+def prepare_training_data(include_pk_features: bool = True,
+                          chunk_size: int = TRAINING_CHUNK_SIZE) -> Tuple[pd.DataFrame, pd.Series, pd.Series]:
     """
     Extract and engineer features from database for ML training.
 
+    FINALIZED cases are streamed from the database in chunks (keyset on case id)
+    joined to the procedure pain profiles. Each chunk is engineered vectorized
+    and written straight into preallocated arrays with compact dtypes, so no
+    per-case dicts are built and memory stays proportional to the final arrays.
+
     Args:
         include_pk_features: Whether to include PK-derived features
+        chunk_size: Cases per database round trip
 
     Returns:
         Tuple of (X, y, group):
         - X: Feature matrix (n_samples, n_features)
         - y: Target variable (actual dose in mg)
-        - group: Cluster IDs (procedure_id)
+        - group: Cluster IDs (procedure_id, categorical)
 
     Features engineered:
     1. Patient: age, weight, height, sex, LBM
     2. PK (optional): clearance, Vd, half-life
     3. Physiology: GFR, hepatic status, opioid tolerance
-    4. Procedure: pain scores (3D), duration
+    4. Procedure: pain scores (3D)
     5. Adjuvants: binary flags for each type
     """
     import database as db
-    from calculation_engine import calculate_lean_body_mass
 
-    if include_pk_features:
-        import pk_model
+    dtypes = dict(FEATURE_DTYPES, **(PK_FEATURE_DTYPES if include_pk_features else {}))
 
-    # Get all cases with complete outcome data
     logger.info("Fetching training data from database...")
+    num_cases, max_id = db.count_finalized_training_cases()
+
+    columns = {name: np.empty(num_cases, dtype=dtype) for name, dtype in dtypes.items()}
+    y = np.empty(num_cases, dtype=np.float32)
+    group_codes = np.empty(num_cases, dtype=np.int32)
+    procedure_codes: Dict[str, int] = {}
+
+    filled = 0
+    for chunk in db.iter_finalized_training_chunks(max_id, chunk_size):
+        n = len(chunk['procedure_id'])
+        if filled + n > num_cases:
+            n = num_cases - filled  # Cases finalized after counting; keep the preallocated size
+            chunk = {name: values[:n] for name, values in chunk.items()}
+        end = filled + n
+
+        for name, values in _engineer_chunk(chunk, include_pk_features).items():
+            columns[name][filled:end] = values
+        y[filled:end] = chunk['given_dose']
+
+        uniques, inverse = np.unique(np.array(chunk['procedure_id'], dtype=str), return_inverse=True)
+        codes = np.array([procedure_codes.setdefault(u, len(procedure_codes)) for u in uniques], dtype=np.int32)
+        group_codes[filled:end] = codes[inverse]
+        filled = end
+
+    if filled < num_cases:
+        # Cases deleted or reopened while streaming
+        columns = {name: values[:filled] for name, values in columns.items()}
+        y, group_codes = y[:filled], group_codes[:filled]
+
+    if filled == 0:
+        logger.warning("No training data available yet - database needs finalized cases with given dose")
+    else:
+        logger.info(f"Extracted {filled} finalized cases from {len(procedure_codes)} procedures")
 
-    # This is a placeholder - in production, implement db.get_all_cases_with_outcomes()
-    # For now, return empty data with correct structure
-    logger.warning("No training data available yet - database needs cases with outcomes")
-
-    # Create empty dataframe with correct column structure
-    feature_columns = [
-        'age', 'weight', 'height', 'sex_binary',  # Demographics
-        'lbm_kg',  # Body composition
-        'gfr', 'hepatic_impairment_binary',  # Physiology
-        'opioid_tolerance_binary',  # Tolerance
-        'pain_somatic', 'pain_visceral', 'pain_neuropathic',  # Procedure pain
-        'nsaid', 'ketamine', 'catapressan', 'droperidol',  # Adjuvants
-        'lidocaine', 'betapred'
-    ]
-
-    if include_pk_features:
-        feature_columns.extend(['pk_clearance', 'pk_vd', 'pk_half_life'])
-
-    X = pd.DataFrame(columns=feature_columns)
-    y = pd.Series(dtype=float, name='actual_dose_mg')
-    group = pd.Series(dtype=str, name='procedure_id')
+    X = pd.DataFrame(columns, copy=False)
+    y = pd.Series(y, name='actual_dose_mg')
+    group = pd.Series(pd.Categorical.from_codes(group_codes, categories=list(procedure_codes)), name='procedure_id')
 
     return X, y, group
 
@@ -100,16 +211,20 @@ def train_meml_model(
     X: pd.DataFrame,
     y: pd.Series,
     group: pd.Series,
-    params: Optional[Dict] = None
+    params: Optional[Dict] = None,
+    watermark: Optional[int] = None
 ) -> Optional[object]:
     """
     Train Mixed-Effects Machine Learning model using GPBoost.
 
+    The trained model is published as a new version in model_registry.
+
     Args:
         X: Feature matrix
         y: Target variable (dose in mg)
         group: Cluster IDs (procedure_id)
         params: Optional hyperparameters dict
+        watermark: Finalized-case watermark of the training data (for the manifest)
 
     Returns:
         Trained GPBoost model (or None if GPBoost not available)
@@ -183,16 +298,167 @@ def train_meml_model(
 
     logger.info(f"Validation metrics: RMSE={rmse:.2f}mg, MAE={mae:.2f}mg, R²={r2:.3f}")
 
-    # Save model
-    bst.save_model(str(MODEL_PATH))
+    # Publish model and feature names together as one registry version
+    def write_feature_names(path):
+        with open(path, 'wb') as f:
+            pickle.dump(list(X.columns), f)
+
+    version = model_registry.publish_model(REGISTRY_NAME, {
+        MODEL_FILE: lambda path: bst.save_model(path),
+        FEATURE_NAMES_FILE: write_feature_names,
+    }, {
+        'watermark': watermark,
+        'trained_at': datetime.now().isoformat(),
+        'metrics': {'rmse': float(rmse), 'mae': float(mae), 'r2': float(r2),
+                    'num_samples': len(X)},
+        'features': list(X.columns),
+        'params': params,
+    })
+
+    logger.info(f"Model saved as {REGISTRY_NAME} version {version}")
 
-    # Save feature names for future use
-    with open(FEATURE_NAMES_PATH, 'wb') as f:
-        pickle.dump(list(X.columns), f)
+    return bst
 
-    logger.info(f"Model saved to {MODEL_PATH}")
 
-    return bst
+class LoadedMemlModel(NamedTuple):
+    """A loaded MEML booster and its feature schema, shared by all sessions in the process."""
+    booster: Any
+    feature_names: List[str]
+    version: str  # Registry version, or sha256 prefix for legacy fixed model files
+
+
+_model_lock = threading.Lock()
+_loaded_model: Optional[LoadedMemlModel] = None
+_loaded_stat: Optional[Tuple[str, int, int]] = None  # (path, mtime_ns, size)
+
+
+def _file_hash(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def _resolve_model_files(model_path: Optional[str] = None) -> Tuple[Path, Path, Optional[str]]:
+    """(model file, feature names file, registry version or None) to load."""
+    if model_path is None:
+        version = model_registry.get_current_version(REGISTRY_NAME)
+        path = model_registry.artifact_path(REGISTRY_NAME, MODEL_FILE, version) if version else None
+        if path is not None:
+            return Path(path), Path(model_registry.artifact_path(REGISTRY_NAME, FEATURE_NAMES_FILE, version)), version
+        return MODEL_PATH, FEATURE_NAMES_PATH, None
+
+    # Feature names live next to the model file
+    sibling = Path(model_path).parent / FEATURE_NAMES_FILE
+    return Path(model_path), (sibling if sibling.exists() else FEATURE_NAMES_PATH), None
+
+
+def get_meml_model(model_path: Optional[str] = None) -> LoadedMemlModel:
+    """
+    Get the process-wide MEML booster and feature schema.
+
+    The booster is only rebuilt when the model file changes (new registry
+    version, rollback or a rewritten legacy file), so repeated predictions
+    skip parsing the model text and unpickling the feature names.
+
+    Args:
+        model_path: Explicit model file (default: current registry version)
+
+    Returns:
+        LoadedMemlModel with booster, feature_names and version
+
+    Raises:
+        FileNotFoundError: If no trained model exists
+    """
+    global _loaded_model, _loaded_stat
+
+    path, feature_names_path, registry_version = _resolve_model_files(model_path)
+    stat = os.stat(path)
+    stat_key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    current = _loaded_model
+    if current is not None and _loaded_stat == stat_key:
+        return current
+
+    with _model_lock:
+        if _loaded_model is not None and _loaded_stat == stat_key:
+            return _loaded_model
+
+        version = registry_version or _file_hash(path)
+        if _loaded_model is None or _loaded_model.version != version:
+            with open(feature_names_path, 'rb') as f:
+                feature_names = list(pickle.load(f))
+            _loaded_model = LoadedMemlModel(
+                booster=gpb.Booster(model_file=str(path)),
+                feature_names=feature_names,
+                version=version
+            )
+            logger.info(f"Loaded MEML model {path} (version {version})")
+        _loaded_stat = stat_key
+        return _loaded_model
+
+
+_erf = np.frompyfunc(math.erf, 1, 1)
+
+
+def _normal_cdf(z: np.ndarray) -> np.ndarray:
+    """Standardnormalfördelningens CDF elementvis (utan scipy)."""
+    return 0.5 * (1.0 + _erf(np.asarray(z, dtype=float) / math.sqrt(2.0)).astype(float))
+
+
+def predict_dose_response_meml(
+    loaded: LoadedMemlModel,
+    patient_inputs: Dict,
+    procedure_data: Dict,
+    procedure_ids: Sequence[str],
+    doses: Optional[np.ndarray] = None
+) -> Dict[str, np.ndarray]:
+    """
+    Dose-response curves for one patient across procedure groups, in one inference call.
+
+    The model predicts the required dose with a Gaussian predictive
+    distribution (fixed effects + procedure random effect + residual). One
+    batched predict over all procedure groups gives mean and variance per
+    group; P(success) at a candidate dose d is P(required dose <= d), i.e.
+    the normal CDF evaluated on the whole dose grid.
+
+    Args:
+        loaded: Model from get_meml_model
+        patient_inputs: Patient characteristics
+        procedure_data: Procedure information
+        procedure_ids: Procedure groups to predict for (unseen groups get
+                       the population mean and the random-effect prior variance)
+        doses: Candidate doses in mg (default 0..DOSE_GRID_MAX in DOSE_GRID_STEP)
+
+    Returns:
+        Dictionary with:
+        - 'doses': (n_doses,)
+        - 'procedure_ids': (n_groups,)
+        - 'mean': predicted required dose per group (n_groups,)
+        - 'var': predictive variance per group (n_groups,)
+        - 'p_success': P(success) per group and dose (n_groups, n_doses)
+    """
+    if doses is None:
+        doses = np.arange(0.0, DOSE_GRID_MAX + DOSE_GRID_STEP / 2, DOSE_GRID_STEP)
+    doses = np.asarray(doses, dtype=float)
+    procedure_ids = np.asarray(procedure_ids, dtype=object)
+
+    # Same patient features on every row; only the group differs
+    pain_profile = procedure_pain_profile(patient_inputs.get('procedure_id'), procedure_data)
+    row = engineer_features(patient_inputs, procedure_data, pain_profile)
+    features = pd.DataFrame(
+        np.repeat(np.array([[row[name] for name in loaded.feature_names]], dtype=float), len(procedure_ids), axis=0),
+        columns=loaded.feature_names
+    )
+
+    pred = loaded.booster.predict(features, group_data_pred=procedure_ids, predict_var=True)
+    mean = np.asarray(pred['response_mean'], dtype=float)
+    var = np.asarray(pred['response_var'], dtype=float)
+
+    sd = np.sqrt(np.maximum(var, 1e-12))
+    p_success = _normal_cdf((doses[np.newaxis, :] - mean[:, np.newaxis]) / sd[:, np.newaxis])
+
+    return {'doses': doses, 'procedure_ids': procedure_ids, 'mean': mean, 'var': var, 'p_success': p_success}
 
 
 def predict_optimal_dose_meml(
@@ -204,55 +470,39 @@ def predict_optimal_dose_meml(
     Use trained MEML model to predict optimal dose.
 
     Strategy:
-    1. Test multiple candidate doses (3mg to 15mg)
-    2. For each dose, predict probability of success
-    3. Choose dose with highest P(success)
+    1. Predict the required dose distribution for the patient's procedure
+       group (cached booster, one batched inference call)
+    2. Recommend the predicted mean dose
+    3. Evaluate P(success) = P(required dose <= d) over the candidate dose grid
 
     Args:
         patient_inputs: Patient characteristics
         procedure_data: Procedure information
-        model_path: Path to saved model (default: MODEL_PATH)
+        model_path: Path to saved model (default: current registry version)
 
     Returns:
         Tuple of (optimal_dose, confidence, dose_response_curve)
         - optimal_dose: Recommended dose in mg
-        - confidence: Predicted probability of success
+        - confidence: Higher for lower predictive variance
         - dose_response_curve: List of (dose, P(success)) pairs
     """
     if not GPBOOST_AVAILABLE:
         logger.error("GPBoost not installed")
         return 7.5, 0.5, []  # Fallback to default
 
-    if model_path is None:
-        model_path = MODEL_PATH
-
-    if not Path(model_path).exists():
-        logger.error(f"No trained model found at {model_path}")
+    try:
+        loaded = get_meml_model(model_path)
+    except FileNotFoundError as e:
+        logger.error(f"No trained model found: {e}")
         return 7.5, 0.5, []
 
-    # Load model
-    bst = gpb.Booster(model_file=str(model_path))
-
-    # Load feature names
-    with open(FEATURE_NAMES_PATH, 'rb') as f:
-        feature_names = pickle.load(f)
-
-    # Engineer features for this patient
-    features_dict = engineer_features(patient_inputs, procedure_data)
-
-    # Ensure correct feature order
-    features = pd.DataFrame([features_dict])[feature_names]
-
-    # Predict for this specific feature set
     procedure_id = patient_inputs.get('procedure_id', 'UNKNOWN')
+    response = predict_dose_response_meml(loaded, patient_inputs, procedure_data, [procedure_id])
 
-    pred = bst.predict(features, group_data_pred=[procedure_id], predict_var=True)
-
-    optimal_dose = pred['response_mean'][0]
-    confidence = 1.0 / (1.0 + pred['response_var'][0])  # Higher variance → lower confidence
+    optimal_dose = float(response['mean'][0])
+    confidence = 1.0 / (1.0 + float(response['var'][0]))  # Higher variance → lower confidence
 
-    # Generate dose-response curve (for visualization)
-    dose_response = [(optimal_dose, confidence)]
+    dose_response = list(zip(response['doses'].tolist(), response['p_success'][0].tolist()))
 
     logger.info(
         f"MEML prediction: {optimal_dose:.1f}mg "
@@ -262,13 +512,47 @@ def predict_optimal_dose_meml(
     return optimal_dose, confidence, dose_response
 
 
-def engineer_features(patient_inputs: Dict, procedure_data: Dict) -> Dict:
+def procedure_pain_profile(procedure_id: Optional[str], procedure_data: Dict,
+                           snapshot=None) -> Tuple[float, float, float]:
+    """
+    Pain profile (somatic, visceral, neuropathic) for a procedure.
+
+    Same source as iter_finalized_training_chunks: the learned 3D profile
+    from learning_procedures, falling back to the procedure's painTypeScore
+    (somatic) and DEFAULT_PAIN_PROFILE for missing values.
+
+    Args:
+        procedure_id: Procedure ID (None = no learned profile)
+        procedure_data: Procedure information
+        snapshot: LearningSnapshot (default: the process-cached snapshot)
+
+    Returns:
+        (pain_somatic, pain_visceral, pain_neuropathic)
+    """
+    static_somatic = procedure_data.get('painTypeScore')
+    learned = {}
+    if procedure_id:
+        if snapshot is None:
+            from learning_snapshot import get_cached_learning_snapshot
+            snapshot = get_cached_learning_snapshot()
+        learned = snapshot.procedures_3d.get(procedure_id) or {}
+
+    somatic = learned.get('pain_somatic')
+    values = (static_somatic if somatic is None else somatic,
+              learned.get('pain_visceral'), learned.get('pain_neuropathic'))
+    return tuple(float(default if value is None else value) for value, default in zip(values, DEFAULT_PAIN_PROFILE))
+
+
+def engineer_features(patient_inputs: Dict, procedure_data: Dict,
+                      pain_profile: Optional[Tuple[float, float, float]] = None) -> Dict:
     """
     Convert raw patient/procedure data into ML features.
 
     Args:
         patient_inputs: Patient characteristics
         procedure_data: Procedure information
+        pain_profile: (somatic, visceral, neuropathic) from procedure_pain_profile
+                      (default: painTypeScore without a learned profile)
 
     Returns:
         Dictionary of engineered features
@@ -277,9 +561,9 @@ def engineer_features(patient_inputs: Dict, procedure_data: Dict) -> Dict:
     import pk_model
 
     # Basic demographics
-    age = patient_inputs.get('age', 50)
-    weight = patient_inputs.get('weight', 75)
-    height = patient_inputs.get('height', 175)
+    age = patient_inputs.get('age', PATIENT_DEFAULTS['age'])
+    weight = patient_inputs.get('weight', PATIENT_DEFAULTS['weight'])
+    height = patient_inputs.get('height', PATIENT_DEFAULTS['height'])
     sex = patient_inputs.get('sex', 'Man')
     sex_binary = 1 if sex == 'Man' else 0
 
@@ -287,15 +571,17 @@ def engineer_features(patient_inputs: Dict, procedure_data: Dict) -> Dict:
     lbm = calculate_lean_body_mass(weight, height, sex)
 
     # Physiology
-    gfr = patient_inputs.get('gfr', 90)
+    default_gfr = RENAL_IMPAIRMENT_GFR if patient_inputs.get('renalImpairment', False) else PATIENT_DEFAULTS['gfr']
+    gfr = patient_inputs.get('gfr', default_gfr)
     hepatic = patient_inputs.get('hepatic_impairment', 'None')
     hepatic_binary = 1 if hepatic.lower() in ['moderate', 'severe'] else 0
-    opioid_tolerance = 1 if patient_inputs.get('opioid_tolerance', False) else 0
+    opioid_tolerance = 1 if (patient_inputs.get('opioid_tolerance', False)
+                             or patient_inputs.get('opioidHistory') == 'Opioidtolerant') else 0
 
     # Procedure pain (3D)
-    pain_somatic = procedure_data.get('painTypeScore', 5)
-    pain_visceral = procedure_data.get('painVisceral', 5)
-    pain_neuropathic = procedure_data.get('painNeuropathic', 2)
+    if pain_profile is None:
+        pain_profile = procedure_pain_profile(None, procedure_data)
+    pain_somatic, pain_visceral, pain_neuropathic = pain_profile
 
     # Adjuvants
     nsaid = 1 if patient_inputs.get('nsaid', False) else 0
@@ -351,7 +637,7 @@ if __name__ == "__main__":
     print("\nTesting data preparation...")
     X, y, group = prepare_training_data(include_pk_features=True)
     print(f"  Features: {list(X.columns)}")
-    print(f"  Samples: {len(X)} (empty - needs real case data)")
+    print(f"  Samples: {len(X)} finalized cases")
 
     if len(X) > 0:
         print("\nTesting model training...")
@@ -359,7 +645,7 @@ if __name__ == "__main__":
 
         if model:
             print("  Model trained successfully!")
-            print(f"  Model saved to: {MODEL_PATH}")
+            print(f"  Model saved as version: {model_registry.get_current_version(REGISTRY_NAME)}")
         else:
             print("  Training failed (insufficient data)")
     else:
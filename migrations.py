@@ -11,7 +11,7 @@ from database import get_connection
 logger = logging.getLogger(__name__)
 
 # Current schema version
-CURRENT_SCHEMA_VERSION = 8
+CURRENT_SCHEMA_VERSION = 14
 
 
 def get_db_version() -> int:
@@ -53,6 +53,10 @@ def add_performance_indexes():
         ("idx_cases_procedure_id", "cases", "procedure_id"),
         ("idx_cases_timestamp", "cases", "timestamp DESC"),
         ("idx_cases_user_procedure", "cases", "user_id, procedure_id"),
+        ("idx_cases_timestamp_id", "cases", "timestamp DESC, id DESC"),
+        ("idx_cases_status_timestamp", "cases", "status, timestamp DESC, id DESC"),
+        ("idx_cases_procedure_timestamp", "cases", "procedure_id, timestamp DESC, id DESC"),
+        ("idx_cases_user_timestamp", "cases", "user_id, timestamp DESC, id DESC"),
 
         # Temporal doses indexes
         ("idx_temporal_doses_case_id", "temporal_doses", "case_id"),
@@ -882,6 +886,322 @@ def migrate_to_v8():
         raise
 
 
+def migrate_to_v9():
+    """
+    Migration to version 9: Materialized age & weight factor curves
+
+    Changes:
+    - Creates learning_age_curve (one row per age 0-120)
+    - Creates learning_weight_curve (one row per kg 1-300)
+    - Backfills both curves from the current bucket tables
+
+    smoothed_factor is NULL where the rule-based default should be used.
+    """
+    from database import rebuild_factor_curves
+
+    logger.info("Running migration to version 9: Materialized factor curves")
+
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS learning_age_curve (
+                    age INTEGER PRIMARY KEY,
+                    smoothed_factor REAL
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS learning_weight_curve (
+                    weight INTEGER PRIMARY KEY,
+                    smoothed_factor REAL
+                )
+            ''')
+            conn.commit()
+            logger.info("Created learning_age_curve and learning_weight_curve tables")
+
+        rebuild_factor_curves()
+        logger.info("Migration to version 9 completed")
+
+    except Exception as e:
+        logger.error(f"Error in migration to v9: {e}")
+        raise
+
+
+def migrate_to_v10():
+    """
+    Migration to version 10: Per-procedure case counts
+
+    Changes:
+    - Creates procedure_case_stats (total/finalized/in_progress per procedure_id)
+    - Adds triggers on cases (insert, delete, procedure/status update) that keep
+      the counts in the same transaction as the case write
+    - Backfills the counts from existing cases
+    """
+    from database import rebuild_procedure_case_stats
+
+    logger.info("Running migration to version 10: Procedure case stats")
+
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS procedure_case_stats (
+                    procedure_id TEXT PRIMARY KEY,
+                    total INTEGER NOT NULL DEFAULT 0,
+                    finalized INTEGER NOT NULL DEFAULT 0,
+                    in_progress INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS trg_cases_stats_insert
+                AFTER INSERT ON cases
+                WHEN NEW.procedure_id IS NOT NULL
+                BEGIN
+                    INSERT OR IGNORE INTO procedure_case_stats (procedure_id) VALUES (NEW.procedure_id);
+                    UPDATE procedure_case_stats
+                    SET total = total + 1,
+                        finalized = finalized + (NEW.status = 'FINALIZED'),
+                        in_progress = in_progress + (NEW.status != 'FINALIZED')
+                    WHERE procedure_id = NEW.procedure_id;
+                END
+            ''')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS trg_cases_stats_delete
+                AFTER DELETE ON cases
+                WHEN OLD.procedure_id IS NOT NULL
+                BEGIN
+                    UPDATE procedure_case_stats
+                    SET total = total - 1,
+                        finalized = finalized - (OLD.status = 'FINALIZED'),
+                        in_progress = in_progress - (OLD.status != 'FINALIZED')
+                    WHERE procedure_id = OLD.procedure_id;
+                END
+            ''')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS trg_cases_stats_update
+                AFTER UPDATE OF procedure_id, status ON cases
+                BEGIN
+                    UPDATE procedure_case_stats
+                    SET total = total - 1,
+                        finalized = finalized - (OLD.status = 'FINALIZED'),
+                        in_progress = in_progress - (OLD.status != 'FINALIZED')
+                    WHERE procedure_id = OLD.procedure_id;
+                    INSERT OR IGNORE INTO procedure_case_stats (procedure_id)
+                    SELECT NEW.procedure_id WHERE NEW.procedure_id IS NOT NULL;
+                    UPDATE procedure_case_stats
+                    SET total = total + 1,
+                        finalized = finalized + (NEW.status = 'FINALIZED'),
+                        in_progress = in_progress + (NEW.status != 'FINALIZED')
+                    WHERE procedure_id = NEW.procedure_id;
+                END
+            ''')
+            conn.commit()
+            logger.info("Created procedure_case_stats table and triggers")
+
+        rebuild_procedure_case_stats()
+        logger.info("Migration to version 10 completed")
+
+    except Exception as e:
+        logger.error(f"Error in migration to v10: {e}")
+        raise
+
+
+def migrate_to_v11():
+    """
+    Migration to version 11: Resolved drug keys on temporal doses
+
+    Changes:
+    - Adds temporal_doses.drug_key (key in LÄKEMEDELS_DATA, resolved at insert)
+    - Backfills existing rows in bulk: each distinct (drug_type, drug_name)
+      pair is resolved once and written with a single executemany
+    """
+    from pharmacokinetics import resolve_drug_key
+
+    logger.info("Running migration to version 11: Temporal dose drug keys")
+
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute("PRAGMA table_info(temporal_doses)")
+            columns = [row[1] for row in cursor.fetchall()]
+            if 'drug_key' not in columns:
+                cursor.execute("ALTER TABLE temporal_doses ADD COLUMN drug_key TEXT")
+                logger.info("Added drug_key column to temporal_doses")
+
+            cursor.execute('''
+                SELECT DISTINCT drug_type, drug_name FROM temporal_doses
+                WHERE drug_key IS NULL
+            ''')
+            updates = [
+                (resolve_drug_key(drug_type, drug_name), drug_type, drug_name)
+                for drug_type, drug_name in cursor.fetchall()
+            ]
+            cursor.executemany('''
+                UPDATE temporal_doses SET drug_key = ?
+                WHERE drug_type = ? AND drug_name = ? AND drug_key IS NULL
+            ''', [update for update in updates if update[0] is not None])
+
+            conn.commit()
+            logger.info(f"Backfilled drug_key for {len(updates)} distinct temporal dose drugs")
+            logger.info("Migration to version 11 completed")
+
+    except Exception as e:
+        logger.error(f"Error in migration to v11: {e}")
+        raise
+
+
+def migrate_to_v12():
+    """
+    Migration to version 12: Cases version counter
+
+    Changes:
+    - Creates table_versions (name -> counter)
+    - Adds triggers on cases (insert, update, delete) that bump the 'cases'
+      counter in the same transaction as the case write, so the export cache
+      key is a primary-key lookup instead of a scan over cases
+    """
+    logger.info("Running migration to version 12: Cases version counter")
+
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS table_versions (
+                    name TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            cursor.execute("INSERT OR IGNORE INTO table_versions (name) VALUES ('cases')")
+
+            for event in ('INSERT', 'UPDATE', 'DELETE'):
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS trg_cases_version_{event.lower()}
+                    AFTER {event} ON cases
+                    BEGIN
+                        UPDATE table_versions SET version = version + 1 WHERE name = 'cases';
+                    END
+                ''')
+
+            conn.commit()
+            logger.info("Created table_versions table and cases triggers")
+            logger.info("Migration to version 12 completed")
+
+    except Exception as e:
+        logger.error(f"Error in migration to v12: {e}")
+        raise
+
+
+def migrate_to_v13():
+    """
+    Migration to version 13: Sequence-based training watermark
+
+    Changes:
+    - Adds cases.finalized_seq (assigned once, when a case is first finalized)
+      and cases.change_seq (reassigned on every write to a finalized case),
+      both drawn from one increasing sequence
+    - Triggers keep them up to date in the same transaction as the case write
+    - Backfills existing finalized cases in (last_modified, id) order
+
+    A model trained up to watermark W has seen every case with
+    finalized_seq <= W. Cases with finalized_seq > W are new; cases with
+    finalized_seq <= W and change_seq > W were edited after training.
+    """
+    logger.info("Running migration to version 13: Sequence-based training watermark")
+
+    next_seq = "(SELECT COALESCE(MAX(change_seq), 0) + 1 FROM cases)"
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute("PRAGMA table_info(cases)")
+            columns = [row[1] for row in cursor.fetchall()]
+            for column in ('finalized_seq', 'change_seq'):
+                if column not in columns:
+                    cursor.execute(f"ALTER TABLE cases ADD COLUMN {column} INTEGER")
+                    logger.info(f"Added {column} column to cases")
+
+            cursor.execute("SELECT COALESCE(MAX(change_seq), 0) FROM cases")
+            last_seq = cursor.fetchone()[0]
+            cursor.execute('''
+                SELECT id FROM cases
+                WHERE status = 'FINALIZED' AND change_seq IS NULL
+                ORDER BY last_modified, id
+            ''')
+            backfill = [(last_seq + i, last_seq + i, row[0]) for i, row in enumerate(cursor.fetchall(), start=1)]
+            cursor.executemany('UPDATE cases SET finalized_seq = ?, change_seq = ? WHERE id = ?', backfill)
+
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_cases_finalized_seq ON cases(finalized_seq)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_cases_change_seq ON cases(change_seq)')
+
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_cases_seq_insert
+                AFTER INSERT ON cases
+                WHEN NEW.status = 'FINALIZED'
+                BEGIN
+                    UPDATE cases SET finalized_seq = {next_seq}, change_seq = {next_seq}
+                    WHERE id = NEW.id;
+                END
+            ''')
+            # Villkoret på change_seq hindrar att triggerns egen UPDATE räknas som en ändring
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_cases_seq_update
+                AFTER UPDATE ON cases
+                WHEN NEW.status = 'FINALIZED' AND NEW.change_seq IS OLD.change_seq
+                BEGIN
+                    UPDATE cases SET finalized_seq = COALESCE(OLD.finalized_seq, {next_seq}), change_seq = {next_seq}
+                    WHERE id = NEW.id;
+                END
+            ''')
+
+            conn.commit()
+            logger.info(f"Backfilled training sequence for {len(backfill)} finalized cases")
+            logger.info("Migration to version 13 completed")
+
+    except Exception as e:
+        logger.error(f"Error in migration to v13: {e}")
+        raise
+
+def migrate_to_v14():
+    """
+    Migration to version 14: Users version counter
+
+    Changes:
+    - Adds a 'users' row to table_versions
+    - Adds triggers on users (insert, username update, delete) that bump it,
+      so caches of artefacts showing usernames (e.g. created_by_name in the
+      Excel export) are invalidated by renames and deletions. Other user
+      updates (passwords, logins) do not bump the counter.
+    """
+    logger.info("Running migration to version 14: Users version counter")
+
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute("INSERT OR IGNORE INTO table_versions (name) VALUES ('users')")
+
+            for event in ('INSERT', 'UPDATE OF username', 'DELETE'):
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS trg_users_version_{event.split()[0].lower()}
+                    AFTER {event} ON users
+                    BEGIN
+                        UPDATE table_versions SET version = version + 1 WHERE name = 'users';
+                    END
+                ''')
+
+            conn.commit()
+            logger.info("Created users version triggers")
+            logger.info("Migration to version 14 completed")
+
+    except Exception as e:
+        logger.error(f"Error in migration to v14: {e}")
+        raise
+
 def run_migrations():
     """
     Run all pending migrations.
@@ -930,6 +1250,30 @@ def run_migrations():
         migrate_to_v8()
         set_db_version(8)
 
+    if current_version < 9:
+        migrate_to_v9()
+        set_db_version(9)
+
+    if current_version < 10:
+        migrate_to_v10()
+        set_db_version(10)
+
+    if current_version < 11:
+        migrate_to_v11()
+        set_db_version(11)
+
+    if current_version < 12:
+        migrate_to_v12()
+        set_db_version(12)
+
+    if current_version < 13:
+        migrate_to_v13()
+        set_db_version(13)
+
+    if current_version < 14:
+        migrate_to_v14()
+        set_db_version(14)
+
     logger.info(f"Migrations completed. Database now at version {CURRENT_SCHEMA_VERSION}")
 
 
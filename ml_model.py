@@ -1,15 +1,232 @@
 
 import streamlit as st
 import pandas as pd
-import xgboost as xgb
 import numpy as np
 from config import APP_CONFIG
-from feature_engineering import add_engineered_features
+from feature_engineering import add_engineered_features, ENCODE_COLUMNS, DEFAULT_PAIN_SCORES, PAIN_SCORE_COLUMNS, FeatureEncoder
 import database as db
+from tree_ensemble import TreeEnsemble
+import model_registry
 import joblib
 import os
+import hashlib
+import logging
+import threading
+from typing import Any, List, NamedTuple, Optional, Tuple
 
+logger = logging.getLogger(__name__)
+
+# Aktuell version i model_registry (publiceras av train_model.py)
+REGISTRY_NAME = 'xgboost'
+MODEL_FILE = 'model.joblib'
+# Array-exporterad ensemble (tree_ensemble.TreeEnsemble); kräver inte xgboost vid inläsning
+SERVING_MODEL_FILE = 'model.serving.joblib'
+# Fasta sökvägar från före model_registry; används bara om registret är tomt
 MODEL_PATH = 'xgboost_model.joblib'
+SERVING_MODEL_PATH = 'xgboost_model.serving.joblib'
+DOSE_GRID_MAX = 20.0  # Övre gräns för dosskanning (mg)
+_FROM_CONFIG = object()  # Standardvärde för refine_step: läs APP_CONFIG (None = ingen förfining)
+
+
+class LoadedModel(NamedTuple):
+    """En inläst modell, delad mellan alla sessioner i processen."""
+    model: Any
+    features: List[str]
+    version: str  # Registerversion, eller sha256-prefix för äldre fasta modellfiler
+    encoder: Optional[FeatureEncoder] = None  # Saknas i modeller tränade före FeatureEncoder
+
+
+_model_lock = threading.Lock()
+_loaded_model: Optional[LoadedModel] = None
+_loaded_stat: Optional[Tuple[str, int, int]] = None  # (path, mtime_ns, size)
+
+
+def _file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def _model_path(version: Optional[str] = None) -> Tuple[str, Optional[str]]:
+    """
+    Modellfil att läsa: serving-exporten om den finns, annars den fullständiga xgboost-modellen.
+
+    Args:
+        version: Registerversion (default: aktuell version i model_registry)
+
+    Returns:
+        (sökväg, registerversion); versionen är None för äldre fasta modellfiler
+
+    Raises:
+        FileNotFoundError: Om den begärda versionen saknas
+    """
+    version = version or model_registry.get_current_version(REGISTRY_NAME)
+    if version is not None:
+        path = (model_registry.artifact_path(REGISTRY_NAME, SERVING_MODEL_FILE, version)
+                or model_registry.artifact_path(REGISTRY_NAME, MODEL_FILE, version))
+        if path is None:
+            raise FileNotFoundError(f"Model version {version} not found in registry")
+        return path, version
+    return (SERVING_MODEL_PATH if os.path.exists(SERVING_MODEL_PATH) else MODEL_PATH), None
+
+
+def model_available() -> bool:
+    """True om någon modellfil finns."""
+    return (model_registry.get_current_version(REGISTRY_NAME) is not None
+            or os.path.exists(SERVING_MODEL_PATH) or os.path.exists(MODEL_PATH))
+
+
+def get_model(version: Optional[str] = None) -> LoadedModel:
+    """
+    Hämta den processdelade modellen.
+
+    Läser aktuell version i model_registry (serving-exporten, TreeEnsemble utan
+    xgboost, om den finns). En rollback eller ny träning pekar om registret
+    och plockas upp vid nästa anrop. Utan publicerad version läses de äldre
+    fasta modellfilerna.
+
+    Filen deserialiseras bara när sökväg/mtime/storlek har ändrats och
+    versionen skiljer sig från den inlästa modellen. Den nya modellen byts in
+    först när den är helt inläst, så samtidiga anrop ser antingen den gamla
+    eller den nya modellen.
+
+    Args:
+        version: Specifik registerversion (default: aktuell)
+
+    Returns:
+        LoadedModel med model, features och version
+
+    Raises:
+        FileNotFoundError: Om modellfilen saknas
+    """
+    global _loaded_model, _loaded_stat
+
+    path, registry_version = _model_path(version)
+    stat = os.stat(path)
+    stat_key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    current = _loaded_model
+    if current is not None and _loaded_stat == stat_key:
+        return current
+
+    with _model_lock:
+        if _loaded_model is not None and _loaded_stat == stat_key:
+            return _loaded_model
+
+        # Registerversioner är oföränderliga; äldre fasta filer versioneras med innehållshash
+        version = registry_version or _file_hash(path)
+        if _loaded_model is None or _loaded_model.version != version:
+            model_and_features = joblib.load(path)
+            _loaded_model = LoadedModel(
+                model=model_and_features['model'],
+                features=list(model_and_features['features']),
+                version=version,
+                encoder=model_and_features.get('encoder')
+            )
+            logger.info(f"Loaded ML model {path} (version {version})")
+        _loaded_stat = stat_key
+        return _loaded_model
+
+
+def get_model_version() -> Optional[str]:
+    """Version (innehållshash) för den inlästa modellen, eller None om ingen är inläst."""
+    current = _loaded_model
+    return current.version if current is not None else None
+
+def procedure_pain_scores(procedures_df: pd.DataFrame, procedure_id) -> Tuple[float, float, float]:
+    """Ingreppets (somatic, visceral, neuropathic) smärtprofil, med samma defaults som add_engineered_features."""
+    matches = np.flatnonzero(procedures_df['id'].to_numpy() == procedure_id) if procedure_id is not None else []
+    if len(matches) == 0:
+        return DEFAULT_PAIN_SCORES
+    row = procedures_df.iloc[matches[0]]
+    scores = []
+    for aliases, default in zip(PAIN_SCORE_COLUMNS.values(), DEFAULT_PAIN_SCORES):
+        value = next((row[alias] for alias in aliases if alias in row.index), None)
+        scores.append(default if value is None or pd.isna(value) else value)
+    return tuple(scores)
+
+
+def _legacy_feature_row(current_patient_inputs, procedures_df, trained_features) -> np.ndarray:
+    """get_dummies-baserad featurerad för modellfiler som saknar FeatureEncoder."""
+    predict_df = pd.DataFrame([current_patient_inputs])
+    predict_df['asa'] = predict_df['asa'].astype(str)
+
+    # Use the centralized feature engineering function
+    predict_df = add_engineered_features(predict_df, procedures_df)
+
+    # One-hot encode and align columns
+    predict_encoded = pd.get_dummies(predict_df, columns=ENCODE_COLUMNS, drop_first=True)
+
+    predict_aligned = pd.DataFrame(columns=trained_features)
+    for col in trained_features:
+        if col in predict_encoded.columns:
+            predict_aligned[col] = predict_encoded[col]
+        else:
+            predict_aligned[col] = 0
+    return predict_aligned.astype(float).to_numpy()[0]
+
+
+def predict_dose_response(model, features: List[str], base_row: np.ndarray, doses: np.ndarray) -> np.ndarray:
+    """
+    Predicera VAS för flera kandidatdoser i ett enda model.predict-anrop.
+
+    Args:
+        model: Tränad modell
+        features: Featureordning från träningen
+        base_row: Patientens alignade featurevektor (1-D, i features-ordning)
+        doses: Kandidatdoser (mg)
+
+    Returns:
+        Predicerad VAS per dos
+    """
+    matrix = np.repeat(base_row[np.newaxis, :], len(doses), axis=0)
+    matrix[:, features.index('givenDose')] = doses
+    X = matrix if isinstance(model, TreeEnsemble) else pd.DataFrame(matrix, columns=features)
+    return np.asarray(model.predict(X), dtype=float)
+
+
+def scan_dose_response(model, features: List[str], base_row: np.ndarray, target_vas: float,
+                       grid_step: Optional[float] = None,
+                       refine_step: Optional[float] = _FROM_CONFIG) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Skanna dos→VAS-kurvan på ett grovt rutnät och förfina runt bästa dosen.
+
+    Grovskanningen täcker 0..DOSE_GRID_MAX med grid_step. Är refine_step
+    mindre än grid_step görs ett andra batchanrop med refine_step inom
+    ±grid_step runt den dos vars VAS ligger närmast target_vas.
+
+    Args:
+        model: Tränad modell
+        features: Featureordning från träningen
+        base_row: Patientens alignade featurevektor
+        target_vas: Mål-VAS
+        grid_step: Steg för grovskanning (default APP_CONFIG['ML_DOSE_GRID_STEP'])
+        refine_step: Steg för förfining (default APP_CONFIG['ML_DOSE_REFINE_STEP'];
+                     None = ingen förfining, även om config anger ett steg)
+
+    Returns:
+        (doser, predicerad VAS), sorterade efter dos
+    """
+    grid_step = grid_step or APP_CONFIG.get('ML_DOSE_GRID_STEP', 0.5)
+    if refine_step is _FROM_CONFIG:
+        refine_step = APP_CONFIG.get('ML_DOSE_REFINE_STEP')
+
+    doses = np.arange(0.0, DOSE_GRID_MAX + grid_step / 2, grid_step)
+    vas = predict_dose_response(model, features, base_row, doses)
+
+    if refine_step and refine_step < grid_step:
+        center = doses[np.argmin(np.abs(vas - target_vas))]
+        fine = np.arange(max(0.0, center - grid_step), min(DOSE_GRID_MAX, center + grid_step) + refine_step / 2, refine_step)
+        fine = fine[~np.isclose(fine[:, np.newaxis], doses).any(axis=1)]
+        if len(fine):
+            doses = np.concatenate([doses, fine])
+            vas = np.concatenate([vas, predict_dose_response(model, features, base_row, fine)])
+            order = np.argsort(doses, kind='stable')
+            doses, vas = doses[order], vas[order]
+
+    return doses, vas
+
 
 def predict_with_xgboost(current_patient_inputs, procedures_df):
     """
@@ -19,57 +236,36 @@ def predict_with_xgboost(current_patient_inputs, procedures_df):
     TARGET_VAS = db.get_setting('ML_TARGET_VAS', APP_CONFIG.get('ML_TARGET_VAS', 1.0)) if hasattr(db, 'get_setting') else APP_CONFIG.get('ML_TARGET_VAS', 1.0)
 
     # 1. Load the pre-trained model
-    if not os.path.exists(MODEL_PATH):
-        st.error("ML-modellfilen (xgboost_model.joblib) hittades inte. Kör train_model.py för att skapa den.")
+    if not model_available():
+        st.error("Ingen ML-modell hittades. Kör train_model.py för att skapa den.")
         return {'finalDose': 0.0, 'engine': "ML-Modell ej tränad"}
 
     try:
-        model_and_features = joblib.load(MODEL_PATH)
-        model = model_and_features['model']
-        trained_features = model_and_features['features']
+        loaded = get_model()
+        model = loaded.model
+        trained_features = loaded.features
     except Exception as e:
         st.error(f"Kunde inte ladda ML-modellen: {e}")
         return {'finalDose': 0.0, 'engine': "ML-Laddningsfel"}
 
     try:
-        # 2. Feature Engineering for the new input
-        predict_df = pd.DataFrame([current_patient_inputs])
-        predict_df['asa'] = predict_df['asa'].astype(str)
-        
-        # Use the centralized feature engineering function
-        predict_df = add_engineered_features(predict_df, procedures_df)
-
-        # One-hot encode and align columns
-        encode_cols = ['specialty', 'opioidHistory', 'asa', 'nsaid_choice', 'ketamine_choice',
-                      'lidocaine', 'betapred', 'sex', 'surgery_type']
-        predict_encoded = pd.get_dummies(predict_df, columns=encode_cols, drop_first=True)
-
-        predict_aligned = pd.DataFrame(columns=trained_features)
-        for col in trained_features:
-            if col in predict_encoded.columns:
-                predict_aligned[col] = predict_encoded[col]
-            else:
-                predict_aligned[col] = 0
-        predict_aligned = predict_aligned.astype(float)
-
-        # 3. Make predictions by iterating through test doses
-        predictions = {}
-        # Ensure 'givenDose' is in the aligned dataframe before starting the loop
-        if 'givenDose' not in predict_aligned.columns:
+        # 2. Feature encoding for the new input
+        if loaded.encoder is not None:
+            base_row = loaded.encoder.transform(
+                current_patient_inputs,
+                pain_scores=procedure_pain_scores(procedures_df, current_patient_inputs.get('procedure_id'))
+            )
+        else:
+            base_row = _legacy_feature_row(current_patient_inputs, procedures_df, trained_features)
+
+        # 3. Predict the whole dose-response curve in batched calls
+        # Ensure 'givenDose' is a model feature before scanning
+        if 'givenDose' not in trained_features:
              st.error("'givenDose' saknas i modellens features. Träna om modellen.")
              return {'finalDose': 0.0, 'engine': "ML-Featurefel"}
 
-        for test_dose in np.arange(0, 20.5, 0.5):
-            predict_row = predict_aligned.copy()
-            predict_row['givenDose'] = test_dose
-            
-            # Ensure column order is the same as in training
-            predict_row = predict_row[trained_features]
-
-            predicted_vas = model.predict(predict_row)[0]
-            predictions[test_dose] = predicted_vas
-
-        best_dose = min(predictions, key=lambda k: abs(predictions[k] - TARGET_VAS))
+        curve_doses, curve_vas = scan_dose_response(model, trained_features, base_row, TARGET_VAS)
+        best_dose = float(curve_doses[np.argmin(np.abs(curve_vas - TARGET_VAS))])
 
         # Apply safety limits from config
         min_dose = APP_CONFIG.get('ML_SAFETY_MIN_DOSE', 0.0)
@@ -89,8 +285,10 @@ def predict_with_xgboost(current_patient_inputs, procedures_df):
         return {
             'finalDose': final_dose,
             'engine': f"XGBoost (Pre-trained)",
+            'model_version': loaded.version,
             'feature_importance': feature_importance,
             'raw_ml_dose': best_dose,
+            'dose_response_curve': pd.DataFrame({'dose': curve_doses, 'predicted_vas': curve_vas}),
             'safety_limits_applied': (best_dose != final_dose)
         }
 
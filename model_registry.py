@@ -0,0 +1,228 @@
+"""
+Model Registry - Versionerade modellfiler med atomisk växling och rollback
+=========================================================================
+Varje träning publicerar en ny, oföränderlig version i en egen katalog:
+
+    models/registry/<modellnamn>/<version>/
+        manifest.json      Vattenmärke, metrik, featureschema, träningstid
+        <artefakter>       t.ex. model.joblib, model.serving.joblib, model.txt
+
+Artefakterna skrivs först till en dold staging-katalog som byter namn till
+versionskatalogen när allt är skrivet. Pekaren CURRENT (JSON med version)
+skrivs sist via temporär fil + os.replace. En läsare ser därför alltid en
+komplett version, aldrig en halvskriven fil.
+
+Rollback flyttar bara pekaren till en tidigare version (ingen omträning) och
+låser den (pinned), så att bakgrundsträningen inte direkt ersätter den.
+"""
+
+import json
+import logging
+import os
+import shutil
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+REGISTRY_DIR = os.path.join('models', 'registry')
+MANIFEST_FILE = 'manifest.json'
+CURRENT_FILE = 'CURRENT'
+KEEP_VERSIONS = 10  # Äldre versioner rensas vid publicering (aktuell version behålls alltid)
+
+_publish_lock = threading.Lock()
+
+
+def _model_dir(name: str) -> str:
+    return os.path.join(REGISTRY_DIR, name)
+
+
+def _write_json_atomic(path: str, data: dict):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, default=str)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _read_json(path: str) -> Optional[dict]:
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not read {path}: {e}")
+        return None
+
+
+def _new_version(name: str) -> str:
+    """Tidsbaserat versions-id som sorteras kronologiskt."""
+    version = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    while os.path.exists(os.path.join(_model_dir(name), version)):
+        version = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    return version
+
+
+def get_current(name: str) -> Optional[dict]:
+    """
+    Läs pekaren för en modell.
+
+    Returns:
+        {'version', 'pinned', 'updated_at'} eller None om ingen version är publicerad
+    """
+    return _read_json(os.path.join(_model_dir(name), CURRENT_FILE))
+
+
+def get_current_version(name: str) -> Optional[str]:
+    """Aktuell version för modellen, eller None."""
+    current = get_current(name)
+    return current.get('version') if current else None
+
+
+def set_current(name: str, version: str, pinned: bool = False):
+    """
+    Peka om modellen till en publicerad version (atomiskt).
+
+    Raises:
+        ValueError: Om versionen inte finns
+    """
+    if get_manifest(name, version) is None:
+        raise ValueError(f"Model {name} has no version {version}")
+    _write_json_atomic(os.path.join(_model_dir(name), CURRENT_FILE), {
+        'version': version,
+        'pinned': pinned,
+        'updated_at': datetime.now().isoformat()
+    })
+    logger.info(f"Model {name}: current version is now {version}{' (pinned)' if pinned else ''}")
+
+
+def get_manifest(name: str, version: Optional[str] = None) -> Optional[dict]:
+    """Manifestet för en version (default: aktuell), eller None."""
+    version = version or get_current_version(name)
+    if version is None:
+        return None
+    return _read_json(os.path.join(_model_dir(name), version, MANIFEST_FILE))
+
+
+def artifact_path(name: str, filename: str, version: Optional[str] = None) -> Optional[str]:
+    """
+    Sökväg till en artefakt i en version (default: aktuell).
+
+    Returns:
+        Sökvägen, eller None om versionen eller filen saknas
+    """
+    version = version or get_current_version(name)
+    if version is None:
+        return None
+    path = os.path.join(_model_dir(name), version, filename)
+    return path if os.path.exists(path) else None
+
+
+def list_versions(name: str) -> List[dict]:
+    """
+    Alla publicerade versioner, nyaste först.
+
+    Returns:
+        Lista av manifest, med 'current' satt till True för aktuell version
+    """
+    model_dir = _model_dir(name)
+    if not os.path.isdir(model_dir):
+        return []
+    current_version = get_current_version(name)
+    versions = []
+    for entry in sorted(os.listdir(model_dir), reverse=True):
+        if entry.startswith('.') or entry == CURRENT_FILE:
+            continue
+        manifest = _read_json(os.path.join(model_dir, entry, MANIFEST_FILE))
+        if manifest is not None:
+            versions.append(dict(manifest, current=(entry == current_version)))
+    return versions
+
+
+def publish_model(name: str, artifacts: Dict[str, Callable[[str], None]], manifest: dict,
+                  make_current: bool = True) -> str:
+    """
+    Publicera en ny version av en modell.
+
+    Args:
+        name: Modellnamn (t.ex. 'xgboost', 'meml')
+        artifacts: {filnamn: funktion som skriver filen till given sökväg}
+        manifest: Metadata (watermark, metrics, features, trained_at, ...)
+        make_current: Peka om CURRENT till den nya versionen
+
+    Returns:
+        Den nya versionens id
+    """
+    model_dir = _model_dir(name)
+    os.makedirs(model_dir, exist_ok=True)
+
+    with _publish_lock:
+        version = _new_version(name)
+        staging_dir = os.path.join(model_dir, f".{version}.{os.getpid()}.tmp")
+        os.makedirs(staging_dir)
+        try:
+            for filename, write in artifacts.items():
+                write(os.path.join(staging_dir, filename))
+            _write_json_atomic(os.path.join(staging_dir, MANIFEST_FILE), dict(
+                manifest,
+                model=name,
+                version=version,
+                artifacts=sorted(artifacts),
+                published_at=datetime.now().isoformat()
+            ))
+            os.replace(staging_dir, os.path.join(model_dir, version))
+        except Exception:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+
+        current = get_current(name)
+        if make_current and not (current and current.get('pinned')):
+            set_current(name, version)
+        elif make_current:
+            logger.info(f"Model {name} is pinned to {current['version']}; published {version} without activating it")
+        prune_versions(name)
+    return version
+
+
+def rollback(name: str, version: Optional[str] = None) -> str:
+    """
+    Växla tillbaka till en tidigare version utan omträning.
+
+    Args:
+        name: Modellnamn
+        version: Målversion (default: versionen före den aktuella)
+
+    Returns:
+        Den version som nu är aktuell
+
+    Raises:
+        ValueError: Om det inte finns någon tidigare version
+    """
+    if version is None:
+        versions = [v['version'] for v in list_versions(name)]
+        current_version = get_current_version(name)
+        older = versions[versions.index(current_version) + 1:] if current_version in versions else versions[1:]
+        if not older:
+            raise ValueError(f"Model {name} has no earlier version to roll back to")
+        version = older[0]
+    set_current(name, version, pinned=True)
+    return version
+
+
+def unpin(name: str):
+    """Släpp en rollback-låsning så att nästa träning åter aktiveras automatiskt."""
+    current = get_current(name)
+    if current and current.get('pinned'):
+        set_current(name, current['version'], pinned=False)
+
+
+def prune_versions(name: str, keep: int = KEEP_VERSIONS):
+    """Ta bort de äldsta versionerna utöver keep (aktuell version behålls alltid)."""
+    current_version = get_current_version(name)
+    versions = [v['version'] for v in list_versions(name)]
+    for version in versions[keep:]:
+        if version != current_version:
+            shutil.rmtree(os.path.join(_model_dir(name), version), ignore_errors=True)
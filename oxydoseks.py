@@ -22,6 +22,7 @@ from ui.main_layout import render_main_layout
 from callbacks import get_current_inputs, handle_save_and_learn
 from migrations import run_migrations
 from session_manager import cleanup_expired_sessions
+from retrain_scheduler import start_retrain_scheduler
 
 def load_css(file_name):
     with open(file_name) as f:
@@ -66,6 +67,9 @@ def initialize_session():
             cleanup_expired_sessions()
             logger.info("Expired sessions cleaned up")
 
+            # Background ML retraining (one worker thread per process)
+            start_retrain_scheduler()
+
             st.session_state.db_initialized = True
         except Exception as e:
             logger.error(f"Error during initialization: {e}")
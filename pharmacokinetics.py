@@ -4,7 +4,33 @@ Beräknar farmakokinetiska effekter över tid för temporal dosering
 """
 
 import math
-from typing import Dict, List
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+
+from config import APP_CONFIG, LÄKEMEDELS_DATA
+from fentanyl_pk import FENTANYL_IME_PER_MCG, effective_fentanyl_mcg, simulate_schedule
+
+# Fentanyl bi-exponentiell modell: (andel av dosen, halveringstid i minuter)
+FENTANYL_DECAY_COMPONENTS = ((0.6, 15.0), (0.4, 210.0))
+# Oxikodon: 1 mg PO ≈ 15 µg fentanyl
+OXYCODONE_MCG_FENTANYL_EQUIVALENT = 15.0
+AUC_DEFAULT_START_MINUTES = -180
+ADJUVANT_TYPES = ('nsaid', 'catapressan', 'droperidol', 'ketamine', 'lidocaine', 'betapred')
+
+# Standardnyckel i LÄKEMEDELS_DATA per drug_type när namnet inte matchar
+TEMPORAL_TYPE_DEFAULT_KEYS = {
+    'fentanyl': 'fentanyl',
+    'nsaid': 'ibuprofen_400mg',  # Default NSAID
+    'catapressan': 'clonidine',
+    'droperidol': 'droperidol',
+    'ketamine': 'ketamine_small_bolus',  # Default ketamine
+    'lidocaine': 'lidocaine_bolus',  # Default lidocaine
+    'betapred': 'betamethasone_4mg',  # Default betapred
+    'oxycodone': 'oxycodone'
+}
 
 
 def calculate_fentanyl_remaining_at_opslut(dose_mcg: float, time_before_opslut_min: int) -> float:
@@ -132,77 +158,218 @@ def calculate_adjuvant_effect_at_time(
     return max(0, min(1, effect))
 
 
-def calculate_total_opioid_auc(temporal_doses: List[Dict], duration_minutes: int = 120) -> float:
+def _opioid_doses_as_fentanyl(temporal_doses: List[Dict]) -> tuple:
+    """Opioiddoser som arrays (fentanyl-ekvivalenter i µg, tidpunkt relativt opslut)."""
+    doses, times = [], []
+    for dose_entry in temporal_doses:
+        if dose_entry['drug_type'] == 'fentanyl':
+            doses.append(dose_entry['dose'])
+        elif dose_entry['drug_type'] == 'oxycodone':
+            doses.append(dose_entry['dose'] * OXYCODONE_MCG_FENTANYL_EQUIVALENT)
+        else:
+            continue
+        times.append(dose_entry['time_relative_minutes'])
+    return np.asarray(doses, dtype=float), np.asarray(times, dtype=float)
+
+
+def calculate_opioid_auc_windows(
+    temporal_doses: List[Dict],
+    window_starts: Union[float, Sequence[float], np.ndarray],
+    window_ends: Union[float, Sequence[float], np.ndarray]
+) -> np.ndarray:
+    """
+    Exakt opioid-AUC för godtyckliga integrationsfönster, vektoriserat över doser och fönster.
+
+    Den bi-exponentiella kvarvarande mängden D·Σ wᵢ·e^(-kᵢ·s) (s = tid sedan
+    dos, kᵢ = ln2 / t½ᵢ) integreras analytiskt:
+    ∫ₐᵇ wᵢ·D·e^(-kᵢ·s) ds = wᵢ·D/kᵢ · (e^(-kᵢ·a) - e^(-kᵢ·b)),
+    där fönstret klipps till tiden efter administrering.
+
+    Args:
+        temporal_doses: Lista av temporal doser (fentanyl och oxikodon räknas)
+        window_starts: Fönstrens start (min relativt opslut), skalär eller array
+        window_ends: Fönstrens slut (min relativt opslut), samma form som window_starts
+
+    Returns:
+        AUC i µg·min per fönster (samma form som fönstren)
+    """
+    starts = np.asarray(window_starts, dtype=float)
+    ends = np.asarray(window_ends, dtype=float)
+    doses, times = _opioid_doses_as_fentanyl(temporal_doses)
+    if len(doses) == 0:
+        return np.zeros(np.broadcast(starts, ends).shape)
+
+    # Tid sedan dos vid fönstrets start/slut, per (fönster, dos); negativ = inte given än
+    since_start = np.maximum(starts[..., np.newaxis] - times, 0.0)
+    since_end = np.maximum(ends[..., np.newaxis] - times, 0.0)
+
+    auc = np.zeros(since_start.shape)
+    for fraction, half_life in FENTANYL_DECAY_COMPONENTS:
+        k = math.log(2) / half_life
+        auc += (fraction / k) * (np.exp(-k * since_start) - np.exp(-k * since_end))
+
+    return auc @ doses
+
+
+def calculate_total_opioid_auc(temporal_doses: List[Dict], duration_minutes: int = 120,
+                               start_minutes: int = AUC_DEFAULT_START_MINUTES) -> float:
     """
     Beräkna total opioid Area Under Curve (AUC) för temporal dosering.
 
     AUC = integral av opioid-koncentration över tid
     Används som ML feature för total opioid-exposition
 
+    Integralen beräknas exakt (se calculate_opioid_auc_windows) i stället för
+    som en summa över 5-minuterssteg.
+
     Args:
         temporal_doses: Lista av temporal doser
-        duration_minutes: Total tid att beräkna AUC för (default 2h)
+        duration_minutes: Fönstrets slut, minuter efter opslut (default 2h)
+        start_minutes: Fönstrets start relativt opslut (default -180)
 
     Returns:
         AUC i µg·min (mikrogram × minuter)
     """
-    auc = 0.0
-    time_step = 5  # Beräkna var 5:e minut
-
-    for t in range(-180, duration_minutes, time_step):
-        # Summera alla opioider vid tidpunkt t
-        total_at_time = 0.0
-        for dose_entry in temporal_doses:
-            if dose_entry['drug_type'] in ['fentanyl', 'oxycodone']:
-                # Konvertera till fentanyl-ekvivalenter
-                if dose_entry['drug_type'] == 'fentanyl':
-                    dose_mcg = dose_entry['dose']
-                elif dose_entry['drug_type'] == 'oxycodone':
-                    # Oxikodon: 1 mg PO ≈ 15 µg fentanyl
-                    dose_mcg = dose_entry['dose'] * 15
-
-                remaining = calculate_fentanyl_remaining_at_time(
-                    dose_mcg,
-                    dose_entry['time_relative_minutes'],
-                    t
-                )
-                total_at_time += remaining
+    return float(calculate_opioid_auc_windows(temporal_doses, start_minutes, duration_minutes))
+
 
-        # Trapezoid integration: area = height × width
-        auc += total_at_time * time_step
+def calculate_fentanyl_remaining_curve(temporal_doses: List[Dict], times: np.ndarray) -> np.ndarray:
+    """
+    Summerad kvarvarande opioid (fentanyl-ekvivalenter) över ett tidsrutnät.
 
-    return auc
+    Vektoriserad motsvarighet till calculate_fentanyl_remaining_at_time summerat
+    över alla opioiddoser (oxikodon räknas om som i calculate_total_opioid_auc).
 
+    Args:
+        temporal_doses: Lista av temporal doser
+        times: Tidpunkter (min relativt opslut)
 
-def calculate_temporal_fentanyl_mme_at_opslut(temporal_doses: List[Dict]) -> float:
+    Returns:
+        Kvarvarande µg fentanyl-ekvivalenter per tidpunkt
     """
-    Beräkna total fentanyl MME vid opslut (tid 0:00).
+    times = np.asarray(times, dtype=float)
+    doses, given = _opioid_doses_as_fentanyl(temporal_doses)
+    if len(doses) == 0:
+        return np.zeros(times.shape)
+
+    since = times[..., np.newaxis] - given
+    fraction_remaining = np.zeros(since.shape)
+    for fraction, half_life in FENTANYL_DECAY_COMPONENTS:
+        fraction_remaining += fraction * np.exp2(-np.maximum(since, 0.0) / half_life)
+    fraction_remaining[since < 0] = 0.0  # Dosen inte given än
+
+    return fraction_remaining @ doses
+
+
+def _trapezoid_effect(since: np.ndarray, onset: np.ndarray, peak: np.ndarray, duration: np.ndarray) -> np.ndarray:
+    """Vektoriserad trapetskurva från calculate_adjuvant_effect_at_time (0-1)."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        effect = np.select(
+            [since < 0, since < onset, since < peak, since < duration],
+            [0.0, since / onset, 1.0, 1.0 - (since - peak) / (duration - peak)],
+            0.0
+        )
+    return np.clip(effect, 0.0, 1.0)
+
+
+def calculate_temporal_dose_curves(
+    temporal_doses: List[Dict],
+    times: np.ndarray,
+    drug_database: dict
+) -> Dict:
+    """
+    Opioid- och adjuvantkurvor för ett falls hela temporala doslista i ett broadcastat pass.
 
     Args:
         temporal_doses: Lista av temporal doser
+        times: Tidpunkter (min relativt opslut), t.ex. np.arange(0, 361) för 0-6 h postop
+        drug_database: LÄKEMEDELS_DATA från config.py
 
     Returns:
-        Total MME från fentanyl vid opslut
+        Dictionary med:
+        - 'times': tidsrutnätet
+        - 'fentanyl_equivalent_mcg': summerad kvarvarande opioid per tidpunkt
+          (alltid bi-exponentiell modell, som AUC-funktionerna)
+        - 'fentanyl_effect_site_ng_ml': fentanylkoncentration i effektkompartmentet
+          (trekompartmentmodellen i fentanyl_pk)
+        - 'adjuvant_effects': {läkemedelsnyckel: effekt 0-1 per tidpunkt}; flera doser
+          av samma läkemedel summeras och begränsas till 1
+        - 'adjuvant_reduction_mme': summerad potency_mme × effekt per tidpunkt
+          (samma som calculate_temporal_adjuvant_reduction_at_postop per tidpunkt)
     """
-    total_mme = 0.0
+    times = np.asarray(times, dtype=float)
 
+    drug_keys, given, params = [], [], []
     for dose_entry in temporal_doses:
-        if dose_entry['drug_type'] == 'fentanyl':
-            time_before_opslut = -dose_entry['time_relative_minutes']  # Negativ tid = före
-            if time_before_opslut > 0:
-                remaining_mcg = calculate_fentanyl_remaining_at_opslut(
-                    dose_entry['dose'],
-                    time_before_opslut
-                )
-                # Fentanyl: 100 µg = 10 MME
-                mme = (remaining_mcg / 100) * 10
-                total_mme += mme
-            elif time_before_opslut == 0:
-                # Given exakt vid opslut
-                mme = (dose_entry['dose'] / 100) * 10
-                total_mme += mme
+        if dose_entry['drug_type'] not in ADJUVANT_TYPES:
+            continue
+        drug_key = _find_drug_key_from_temporal_entry(dose_entry, drug_database)
+        if not drug_key:
+            continue
+        drug_data = drug_database[drug_key]
+        drug_keys.append(drug_key)
+        given.append(dose_entry['time_relative_minutes'])
+        params.append((drug_data.get('onset_minutes', 30), drug_data.get('peak_minutes', 60),
+                       drug_data.get('duration_minutes', 240), drug_data.get('potency_mme', 0)))
+
+    fentanyl = [(d['time_relative_minutes'], d['dose']) for d in temporal_doses if d['drug_type'] == 'fentanyl']
+    effect_site = np.zeros(times.shape)
+    if fentanyl:
+        dose_times, doses = zip(*fentanyl)
+        effect_site = simulate_schedule(dose_times, doses, times.ravel())['effect_site_ng_ml'].reshape(times.shape)
+
+    adjuvant_effects = {}
+    adjuvant_reduction = np.zeros(times.shape)
+    if drug_keys:
+        onset, peak, duration, potency = np.asarray(params, dtype=float).T
+        # (tidpunkter, doser): en effektkurva per adjuvantdos
+        effect = _trapezoid_effect(times[..., np.newaxis] - np.asarray(given, dtype=float), onset, peak, duration)
+        adjuvant_reduction = effect @ potency
+
+        unique_keys, key_index = np.unique(drug_keys, return_inverse=True)
+        per_drug = effect @ (key_index[:, np.newaxis] == np.arange(len(unique_keys))).astype(float)
+        adjuvant_effects = {str(key): np.minimum(per_drug[..., i], 1.0) for i, key in enumerate(unique_keys)}
 
-    return total_mme
+    return {
+        'times': times,
+        'fentanyl_equivalent_mcg': calculate_fentanyl_remaining_curve(temporal_doses, times),
+        'fentanyl_effect_site_ng_ml': effect_site,
+        'adjuvant_effects': adjuvant_effects,
+        'adjuvant_reduction_mme': adjuvant_reduction
+    }
+
+
+def calculate_temporal_fentanyl_ime_at_opslut(temporal_doses: List[Dict]) -> float:
+    """
+    Beräkna total fentanyl IME vid opslut (tid 0:00).
+
+    Default är den bi-exponentiella modellen, som inlärda faktorer och
+    ML-modellerna är kalibrerade mot. Med APP_CONFIG['FENTANYL_PK_MODEL'] ==
+    'three_compartment' (opt-in) används effektkompartmentet i fentanyl_pk.
+    I båda fallen räknas en dos given vid opslut fullt.
+
+    Args:
+        temporal_doses: Lista av temporal doser
+
+    Returns:
+        Total IME från fentanyl vid opslut
+    """
+    fentanyl = [(d['time_relative_minutes'], d['dose']) for d in temporal_doses
+                if d['drug_type'] == 'fentanyl' and d['time_relative_minutes'] <= 0]
+    if not fentanyl:
+        return 0.0
+
+    if APP_CONFIG.get('FENTANYL_PK_MODEL') == 'three_compartment':
+        dose_times, doses = zip(*fentanyl)
+        return effective_fentanyl_mcg(dose_times, doses) * FENTANYL_IME_PER_MCG
+
+    total_ime = 0.0
+    for time_relative, dose in fentanyl:
+        remaining_mcg = calculate_fentanyl_remaining_at_opslut(dose, -time_relative)
+        # Fentanyl: 100 µg = 10 IME
+        total_ime += remaining_mcg * FENTANYL_IME_PER_MCG
+
+    return total_ime
 
 
 def calculate_temporal_adjuvant_reduction_at_postop(
@@ -223,11 +390,8 @@ def calculate_temporal_adjuvant_reduction_at_postop(
     """
     total_reduction = 0.0
 
-    adjuvant_types = ['nsaid', 'catapressan', 'droperidol', 'ketamine',
-                     'lidocaine', 'betapred']
-
     for dose_entry in temporal_doses:
-        if dose_entry['drug_type'] in adjuvant_types:
+        if dose_entry['drug_type'] in ADJUVANT_TYPES:
             # Hitta drug_data baserat på drug_name eller drug_type
             drug_key = _find_drug_key_from_temporal_entry(dose_entry, drug_database)
             if drug_key:
@@ -248,10 +412,69 @@ def calculate_temporal_adjuvant_reduction_at_postop(
     return total_reduction
 
 
+def build_drug_name_index(drug_database: dict) -> Dict[str, str]:
+    """
+    Namn/alias-index för läkemedelsuppslag: normaliserat namn -> nyckel.
+
+    Alias är nyckeln själv, hela namnet och namnet utan parentes
+    (t.ex. 'oxycodon' för 'Oxycodon (µ-agonist)').
+
+    Args:
+        drug_database: LÄKEMEDELS_DATA
+
+    Returns:
+        Dict alias (gemener) -> nyckel i drug_database
+    """
+    index = {}
+    for key, data in drug_database.items():
+        name = data['name'].lower().strip()
+        for alias in (key.lower(), name, re.sub(r'\s*\(.*\)', '', name).strip()):
+            index.setdefault(alias, key)
+    return index
+
+
+DRUG_NAME_INDEX = build_drug_name_index(LÄKEMEDELS_DATA)
+_LOWERCASE_NAMES = [(data['name'].lower(), key) for key, data in LÄKEMEDELS_DATA.items()]
+
+
+@lru_cache(maxsize=1024)
+def resolve_drug_key(drug_type: str, drug_name: str) -> Optional[str]:
+    """
+    Lös upp nyckeln i LÄKEMEDELS_DATA för en temporal dos.
+
+    Körs en gång per dos när den läggs till/sparas (resultatet lagras som
+    temporal_doses.drug_key). Ordning: exakt namn/alias i DRUG_NAME_INDEX,
+    sedan delsträngsmatchning mot läkemedelsnamnen, sist standardnyckeln
+    för drug_type.
+
+    Args:
+        drug_type: Dosens drug_type (t.ex. 'nsaid')
+        drug_name: Dosens namn som angivet i UI/databas
+
+    Returns:
+        Nyckel i LÄKEMEDELS_DATA eller None
+    """
+    name = (drug_name or '').lower().strip()
+
+    drug_key = DRUG_NAME_INDEX.get(name)
+    if drug_key:
+        return drug_key
+
+    if name:
+        for data_name, key in _LOWERCASE_NAMES:
+            if data_name in name or name in data_name:
+                return key
+
+    return TEMPORAL_TYPE_DEFAULT_KEYS.get(drug_type)
+
+
 def _find_drug_key_from_temporal_entry(dose_entry: Dict, drug_database: dict) -> str:
     """
     Hitta läkemedelsnyckeln i LÄKEMEDELS_DATA baserat på temporal dose entry.
 
+    Använder drug_key som lösts upp när dosen sparades; äldre doser utan
+    drug_key slås upp via resolve_drug_key (cachad).
+
     Args:
         dose_entry: Temporal dose dictionary
         drug_database: LÄKEMEDELS_DATA
@@ -259,27 +482,12 @@ def _find_drug_key_from_temporal_entry(dose_entry: Dict, drug_database: dict) ->
     Returns:
         Nyckel i LÄKEMEDELS_DATA eller None
     """
-    drug_type = dose_entry['drug_type']
-    drug_name = dose_entry['drug_name'].lower()
-
-    # Försök matcha på drug_name
-    for key, data in drug_database.items():
-        if data['name'].lower() in drug_name or drug_name in data['name'].lower():
-            return key
-
-    # Försök matcha på drug_type
-    type_mapping = {
-        'fentanyl': 'fentanyl',
-        'nsaid': 'ibuprofen_400mg',  # Default NSAID
-        'catapressan': 'clonidine',
-        'droperidol': 'droperidol',
-        'ketamine': 'ketamine_small_bolus',  # Default ketamine
-        'lidocaine': 'lidocaine_bolus',  # Default lidocaine
-        'betapred': 'betamethasone_4mg',  # Default betapred
-        'oxycodone': 'oxycodone'
-    }
+    drug_key = dose_entry.get('drug_key')
+    if drug_key in drug_database:
+        return drug_key
 
-    return type_mapping.get(drug_type, None)
+    drug_key = resolve_drug_key(dose_entry['drug_type'], dose_entry['drug_name'])
+    return drug_key if drug_key in drug_database else None
 
 
 def get_temporal_dose_summary(temporal_doses: List[Dict]) -> Dict:
@@ -13,6 +13,8 @@ References:
 import logging
 from typing import Dict, Optional
 
+import numpy as np
+
 logger = logging.getLogger(__name__)
 
 # PK Constants
@@ -269,6 +271,50 @@ def get_pk_summary(
     }
 
 
+def calculate_pk_batch(
+    age: np.ndarray,
+    lbm_kg: np.ndarray,
+    gfr: Optional[np.ndarray] = None,
+    hepatic_impairment: Optional[np.ndarray] = None
+) -> Dict[str, np.ndarray]:
+    """
+    Vectorized get_pk_summary for many patients at once (e.g. training data).
+
+    Applies the same equations, organ-function adjustments and safety bounds
+    as calculate_clearance / calculate_volume_of_distribution /
+    calculate_half_life, without per-patient logging.
+
+    Args:
+        age: Age in years
+        lbm_kg: Lean body mass in kg
+        gfr: GFR (mL/min) per patient, NaN = unknown (no adjustment)
+        hepatic_impairment: 'None', 'Mild', 'Moderate' or 'Severe' per patient
+
+    Returns:
+        Dictionary of arrays: clearance_L_per_h, vd_L, half_life_h, elimination_constant
+    """
+    clearance = BASE_CLEARANCE_INTERCEPT - np.asarray(age, dtype=np.float64) / AGE_CLEARANCE_SLOPE
+
+    if gfr is not None:
+        gfr = np.asarray(gfr, dtype=np.float64)
+        clearance = clearance * np.select([gfr < 35, gfr < 60, gfr < 90], [0.60, 0.80, 0.90], 1.0)
+
+    if hepatic_impairment is not None:
+        hepatic = np.char.lower(np.char.strip(np.asarray(hepatic_impairment, dtype=str)))
+        clearance = clearance * np.select(
+            [hepatic == 'severe', hepatic == 'moderate', hepatic == 'mild'], [0.33, 0.50, 0.75], 1.0)
+
+    clearance = np.clip(clearance, MIN_CLEARANCE, MAX_CLEARANCE)
+    vd = np.clip(VD_PER_LBM * np.asarray(lbm_kg, dtype=np.float64), MIN_VD, MAX_VD)
+
+    return {
+        'clearance_L_per_h': clearance,
+        'vd_L': vd,
+        'half_life_h': (0.693 * vd) / clearance,
+        'elimination_constant': clearance / vd
+    }
+
+
 def explain_pk_parameters(pk_params: Dict[str, float], age: float) -> Dict[str, str]:
     """
     Generate human-readable explanations of PK parameters.
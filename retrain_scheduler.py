@@ -0,0 +1,220 @@
+"""
+Retrain Scheduler - Bakgrundsträning av ML-modellen
+===================================================
+Bevakar slutförda fall och startar train_model.py när någon tröskel passeras:
+
+- Totalt antal nya slutförda fall sedan senaste träningen >= RETRAIN_MIN_NEW_CASES
+- Ett ingrepp når ML_THRESHOLD_PER_PROCEDURE slutförda fall (blir ML-aktivt);
+  utan modell är detta enda villkoret för första träningen
+- Det finns nya eller redigerade fall och modellen är äldre än RETRAIN_MAX_AGE_HOURS
+  (redigerade, redan tränade fall räknas inte som nya; train_model tränar då om fullt)
+
+Träningen körs i en separat process med låg OS-prioritet, så Streamlit-
+sessioner aldrig väntar på den. train_model.py publicerar en ny version i
+model_registry och ml_model laddar den automatiskt när pekaren flyttats.
+Efter en rollback (låst version) startas ingen träning förrän låsningen släpps.
+
+Körs som daemon-tråd i app-processen (start_retrain_scheduler) eller som
+fristående process: python retrain_scheduler.py
+"""
+
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+import joblib
+
+import database as db
+import model_registry
+from config import APP_CONFIG
+
+logger = logging.getLogger(__name__)
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+REGISTRY_NAME = 'xgboost'
+SERVING_MODEL_PATH = 'xgboost_model.serving.joblib'  # Äldre fast modellfil (före model_registry)
+LOCK_PATH = 'xgboost_model.training.lock'
+TRAINING_TIMEOUT_S = 3600
+
+_scheduler_thread: Optional[threading.Thread] = None
+_stop_event = threading.Event()
+
+
+def read_model_metadata(path: str = SERVING_MODEL_PATH) -> Tuple[Optional[int], Optional[str]]:
+    """
+    Läs vattenmärke och träningstid ur aktuell versions manifest.
+
+    Utan publicerad version läses den äldre serving-modellen (kräver inte xgboost).
+
+    Returns:
+        (watermark, trained_at), (None, None) om ingen modell finns
+    """
+    manifest = model_registry.get_manifest(REGISTRY_NAME)
+    if manifest is not None:
+        return manifest.get('watermark'), manifest.get('trained_at')
+    if not os.path.exists(path):
+        return None, None
+    try:
+        model_and_features = joblib.load(path)
+        return model_and_features.get('watermark'), model_and_features.get('trained_at')
+    except Exception as e:
+        logger.warning(f"Could not read model metadata from {path}: {e}")
+        return None, None
+
+
+def pending_retrain_reason(watermark: Optional[int], trained_at: Optional[str],
+                           now: Optional[datetime] = None) -> Optional[str]:
+    """
+    Avgör om en omträning ska startas.
+
+    Args:
+        watermark: Vattenmärke för senast tränade modell (None = ingen modell)
+        trained_at: ISO-tid för senaste träning
+        now: Aktuell tid (för tester)
+
+    Returns:
+        Orsak (str) eller None om modellen är aktuell
+    """
+    if watermark is not None and not isinstance(watermark, int):
+        return "model has a timestamp watermark"
+
+    new_by_procedure: Dict[str, int] = db.count_finalized_cases_since(watermark)
+    total_new = sum(new_by_procedure.values())
+    num_edited = db.count_edited_finalized_cases_since(watermark)
+    if total_new == 0 and num_edited == 0:
+        return None
+
+    if watermark is None:
+        # Utan vattenmärke är alla slutförda fall nya; tröskeln gäller per ingrepp
+        procedure_id, finalized = max(new_by_procedure.items(), key=lambda item: item[1])
+        if finalized >= APP_CONFIG['ML_THRESHOLD_PER_PROCEDURE']:
+            return f"no model yet, procedure {procedure_id} has {finalized} finalized cases"
+        return None
+
+    if total_new >= APP_CONFIG['RETRAIN_MIN_NEW_CASES']:
+        return f"{total_new} new finalized cases"
+
+    threshold = APP_CONFIG['ML_THRESHOLD_PER_PROCEDURE']
+    stats = db.get_all_procedure_case_stats()
+    for procedure_id, new_count in new_by_procedure.items():
+        finalized = stats.get(procedure_id, {}).get('finalized', 0)
+        if finalized >= threshold > finalized - new_count:
+            return f"procedure {procedure_id} reached {threshold} finalized cases"
+
+    now = now or datetime.now()
+    if trained_at is None or now - datetime.fromisoformat(trained_at) >= timedelta(hours=APP_CONFIG['RETRAIN_MAX_AGE_HOURS']):
+        return (f"model older than {APP_CONFIG['RETRAIN_MAX_AGE_HOURS']} h with {total_new} new "
+                f"and {num_edited} edited cases")
+
+    return None
+
+
+def _acquire_lock() -> bool:
+    """Lås mot parallella träningar (app-tråd och fristående process)."""
+    try:
+        fd = os.open(LOCK_PATH, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        if time.time() - os.path.getmtime(LOCK_PATH) < TRAINING_TIMEOUT_S:
+            return False
+        logger.warning("Removing stale training lock")
+        os.remove(LOCK_PATH)
+        return _acquire_lock()
+    with os.fdopen(fd, 'w') as f:
+        f.write(str(os.getpid()))
+    return True
+
+
+def run_training_subprocess() -> int:
+    """
+    Kör train_model.py i en separat process med låg prioritet.
+
+    Returns:
+        Processens returkod (-1 om en annan träning redan pågår)
+    """
+    if not _acquire_lock():
+        logger.info("Training already running, skipping")
+        return -1
+    try:
+        kwargs = {}
+        if sys.platform == 'win32':
+            kwargs['creationflags'] = subprocess.BELOW_NORMAL_PRIORITY_CLASS
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, os.path.join(PROJECT_DIR, 'train_model.py'), '--low-priority'],
+            cwd=os.getcwd(), capture_output=True, text=True, timeout=TRAINING_TIMEOUT_S, **kwargs
+        )
+        if result.returncode == 0:
+            logger.info(f"Background training finished in {time.perf_counter() - start:.1f} s")
+        else:
+            logger.error(f"Background training failed ({result.returncode}): {result.stderr[-2000:]}")
+        return result.returncode
+    finally:
+        os.remove(LOCK_PATH)
+
+
+def check_and_retrain() -> Optional[str]:
+    """
+    En kontrollrunda: träna om vid behov.
+
+    Returns:
+        Orsaken om träning startades, annars None
+    """
+    current = model_registry.get_current(REGISTRY_NAME)
+    if current and current.get('pinned'):
+        logger.debug(f"Model pinned to version {current['version']} after rollback, not retraining")
+        return None
+    watermark, trained_at = read_model_metadata()
+    reason = pending_retrain_reason(watermark, trained_at)
+    if reason is None:
+        return None
+    logger.info(f"Starting background retraining: {reason}")
+    run_training_subprocess()
+    return reason
+
+
+def _scheduler_loop(stop_event: threading.Event):
+    interval = APP_CONFIG['RETRAIN_CHECK_INTERVAL_S']
+    while not stop_event.wait(interval):
+        try:
+            check_and_retrain()
+        except Exception as e:
+            logger.error(f"Error in retrain scheduler: {e}")
+
+
+def start_retrain_scheduler() -> Optional[threading.Thread]:
+    """Starta bakgrundstråden en gång per process (idempotent)."""
+    global _scheduler_thread
+    if not APP_CONFIG.get('RETRAIN_SCHEDULER_ENABLED', True):
+        return None
+    if _scheduler_thread is not None and _scheduler_thread.is_alive():
+        return _scheduler_thread
+    _stop_event.clear()
+    _scheduler_thread = threading.Thread(target=_scheduler_loop, args=(_stop_event,),
+                                         name='retrain-scheduler', daemon=True)
+    _scheduler_thread.start()
+    logger.info("Retrain scheduler started")
+    return _scheduler_thread
+
+
+def stop_retrain_scheduler():
+    """Stoppa bakgrundstråden (används vid tester och avstängning)."""
+    global _scheduler_thread
+    _stop_event.set()
+    if _scheduler_thread is not None:
+        _scheduler_thread.join(timeout=5)
+    _scheduler_thread = None
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    db.init_database()
+    logger.info("Retrain scheduler running as companion process")
+    try:
+        _scheduler_loop(_stop_event)
+    except KeyboardInterrupt:
+        pass
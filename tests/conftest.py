@@ -0,0 +1,23 @@
+"""
+Gemensamma pytest-fixtures
+==========================
+"""
+
+import pytest
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database as db
+from migrations import run_migrations
+
+
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    """Initiera en tom databas med aktuellt schema i en temporär katalog."""
+    monkeypatch.setattr(db, 'DB_PATH', str(tmp_path / 'test.db'))
+    db.init_database()
+    run_migrations()
+    yield db.DB_PATH
+    db.close_thread_connection()
@@ -7,6 +7,9 @@ Tests for dose calculation, weight adjustments, and age factors.
 import pytest
 import sys
 import os
+import random
+import numpy as np
+import pandas as pd
 
 # Add parent directory to path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -15,8 +18,12 @@ from calculation_engine import (
     calculate_bmi,
     calculate_ideal_body_weight,
     calculate_adjusted_body_weight,
-    calculate_age_factor
+    calculate_age_factor,
+    calculate_rule_based_dose,
+    calculate_rule_based_dose_batch
 )
+import calculation_engine
+from learning_snapshot import LearningSnapshot
 
 
 class TestBMICalculation:
@@ -126,5 +133,79 @@ class TestAgeFactor:
         assert factor_70 > factor_80 > factor_90
 
 
+
+class TestBatchDoseCalculation:
+    """Test vectorized batch dose calculation against the scalar engine."""
+
+    @pytest.fixture
+    def procedures_df(self):
+        return pd.DataFrame([
+            {'id': 'p1', 'baseIME': 10, 'painTypeScore': 7, 'painVisceral': 3, 'painNeuropathic': 2},
+            {'id': 'p2', 'baseIME': 15, 'painTypeScore': 2, 'painVisceral': 8, 'painNeuropathic': 1},
+        ])
+
+    @pytest.fixture
+    def snapshot(self):
+        return LearningSnapshot(
+            age_buckets={70: (0.8, 10), 72: (0.75, 5)},
+            weight_buckets={80: (1.1, 10)},
+            asa_factors={'ASA 3': 0.85},
+            sex_factors={'Kvinna': 0.95},
+            body_composition={('bmi', 27.0): 1.05, ('ibw_ratio', 1.1): 0.97},
+            procedures_3d={'p2': {'base_ime': 12.0, 'pain_somatic': 3, 'pain_visceral': 8,
+                                  'pain_neuropathic': 1, 'num_cases': 4}},
+            synergy_factors={'Droperidol+NSAID': 0.9},
+            adjuvant_potency_percent={'clonidine': 0.12},
+            opioid_tolerance_factor=1.4,
+            renal_factor=0.7,
+        )
+
+    def _random_cases(self, n):
+        rng = random.Random(42)
+        return [{
+            'procedure_id': rng.choice(['p1', 'p2']),
+            'age': rng.randint(18, 95),
+            'sex': rng.choice(['Man', 'Kvinna']),
+            'weight': rng.uniform(45, 140),
+            'height': rng.uniform(150, 200),
+            'asa': rng.choice(['ASA 1', 'ASA 2', 'ASA 3']),
+            'opioidHistory': rng.choice(['Opioidnaiv', 'Opioidtolerant']),
+            'lowPainThreshold': rng.random() < 0.3,
+            'renalImpairment': rng.random() < 0.3,
+            'fentanylDose': rng.choice([0, 100, 200]),
+            'nsaid': True,
+            'nsaid_choice': rng.choice(['Ej given', 'Ibuprofen 400mg', 'Parecoxib 40mg']),
+            'catapressan_dose': rng.choice([0, 75, 150]),
+            'droperidol': rng.random() < 0.5,
+            'ketamine_choice': rng.choice(['Ej given', 'Liten bolus (0.05-0.1 mg/kg)']),
+            'lidocaine': rng.choice(['Nej', 'Bolus', 'Infusion']),
+            'betapred': rng.choice(['Nej', '4 mg', '8 mg']),
+            'sevoflurane': rng.random() < 0.5,
+            'infiltration': rng.random() < 0.5,
+        } for _ in range(n)]
+
+    def test_batch_matches_scalar(self, procedures_df, snapshot, monkeypatch):
+        """Batch results should be identical to row-by-row calculation."""
+        monkeypatch.setattr(calculation_engine.auth, 'get_current_user_id', lambda: 1)
+        cases = self._random_cases(300)
+
+        batch = calculate_rule_based_dose_batch(pd.DataFrame(cases), procedures_df, snapshot)
+
+        for case, (_, row) in zip(cases, batch.iterrows()):
+            expected = calculate_rule_based_dose(case, procedures_df, snapshot=snapshot)
+            assert row['finalDose'] == pytest.approx(expected['finalDose'])
+            assert row['compositeKey'] == expected['compositeKey']
+
+    def test_unknown_procedure_gives_nan(self, procedures_df, snapshot):
+        """Rows with an unknown procedure should get NaN instead of failing the batch."""
+        cases = pd.DataFrame(self._random_cases(3))
+        cases.loc[1, 'procedure_id'] = 'missing'
+
+        batch = calculate_rule_based_dose_batch(cases, procedures_df, snapshot)
+
+        assert np.isnan(batch.loc[1, 'finalDose'])
+        assert not np.isnan(batch.loc[0, 'finalDose'])
+
+
 if __name__ == '__main__':
     pytest.main([__file__, '-v'])
@@ -0,0 +1,104 @@
+"""
+Case Export Tests
+=================
+Tests för on-demand Excel-export med cache per dataversion.
+"""
+
+import pytest
+import sys
+import os
+import zipfile
+from io import BytesIO
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database as db
+import case_export
+
+
+@pytest.fixture
+def procedures_df():
+    return pd.DataFrame([{'id': 'proc_a', 'name': 'Procedur A'}])
+
+
+def _sheet_xml(data):
+    with zipfile.ZipFile(BytesIO(data)) as archive:
+        shared = archive.read('xl/sharedStrings.xml').decode() if 'xl/sharedStrings.xml' in archive.namelist() else ''
+        return archive.read('xl/worksheets/sheet1.xml').decode() + shared
+
+
+class TestCaseExport:
+    """Test att exporten byggs på begäran och återanvänds tills data ändras."""
+
+    def test_export_contains_cases(self, temp_db, procedures_df):
+        """Exporten ska innehålla ingreppsnamn och skapare från JOIN."""
+        user_id = db.create_user('alice', None)
+        db.save_case({'procedure_id': 'proc_a', 'age': 50}, user_id)
+        db.save_case({'procedure_id': 'okand', 'age': 60}, user_id)
+
+        content = _sheet_xml(case_export.build_cases_excel(procedures_df))
+
+        assert 'Procedur A' in content
+        assert 'Okänt' in content
+        assert 'alice' in content
+
+    def test_cached_until_data_changes(self, temp_db, procedures_df, monkeypatch):
+        """Samma dataversion ska ge cachad fil; nytt fall ska ge ny export."""
+        user_id = db.create_user('alice', None)
+        db.save_case({'procedure_id': 'proc_a', 'age': 50}, user_id)
+        builds = []
+        original = case_export.build_cases_excel
+
+        def counting_build(df):
+            builds.append(1)
+            return original(df)
+
+        monkeypatch.setattr(case_export, 'build_cases_excel', counting_build)
+        monkeypatch.setattr(case_export, '_cached_key', None)
+
+        assert case_export.get_cases_excel(procedures_df, build=False) is None
+        first = case_export.get_cases_excel(procedures_df)
+        assert case_export.get_cases_excel(procedures_df, build=False) is first
+        assert len(builds) == 1
+
+        db.save_case({'procedure_id': 'proc_a', 'age': 70}, user_id)
+
+        assert case_export.get_cases_excel(procedures_df, build=False) is None
+        case_export.get_cases_excel(procedures_df)
+        assert len(builds) == 2
+
+    def test_user_rename_and_delete_invalidate_cache(self, temp_db, procedures_df, monkeypatch):
+        """Skaparens namn kommer från users, så namnbyte och radering ska ge ny export."""
+        user_id = db.create_user('alice', None)
+        db.save_case({'procedure_id': 'proc_a', 'age': 50}, user_id)
+        monkeypatch.setattr(case_export, '_cached_key', None)
+        assert 'alice' in _sheet_xml(case_export.get_cases_excel(procedures_df))
+
+        with db.get_connection() as conn:
+            conn.execute("UPDATE users SET username = 'alicia' WHERE id = ?", (user_id,))
+            conn.commit()
+        assert case_export.get_cases_excel(procedures_df, build=False) is None
+        assert 'alicia' in _sheet_xml(case_export.get_cases_excel(procedures_df))
+
+        version = db.get_users_data_version()
+        with db.get_connection() as conn:
+            conn.execute("UPDATE users SET password_hash = 'x' WHERE id = ?", (user_id,))
+            conn.commit()
+        assert db.get_users_data_version() == version
+
+        db.delete_user(user_id)
+        assert case_export.get_cases_excel(procedures_df, build=False) is None
+
+    def test_data_version_bumped_by_case_writes(self, temp_db):
+        """Triggerräknaren ska ändras vid insert, redigering och radering."""
+        user_id = db.create_user('alice', None)
+        versions = [db.get_cases_data_version()]
+        case_id = db.save_case({'procedure_id': 'proc_a', 'age': 50}, user_id)
+        versions.append(db.get_cases_data_version())
+        db.update_case(case_id, {'procedure_id': 'proc_a', 'age': 55}, user_id)
+        versions.append(db.get_cases_data_version())
+        db.delete_case(case_id)
+        versions.append(db.get_cases_data_version())
+
+        assert len(set(versions)) == 4
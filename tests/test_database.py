@@ -0,0 +1,230 @@
+"""
+Database Tests
+==============
+Tests för anslutningshantering och databas-API:t i database.py.
+"""
+
+import pytest
+import sys
+import os
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database as db
+
+
+class TestConnectionPool:
+    """Test poolade per-tråd-anslutningar."""
+
+    def test_connection_reused_within_thread(self, temp_db):
+        """Samma tråd ska få samma anslutning mellan anrop."""
+        with db.get_connection() as first:
+            pass
+        with db.get_connection() as second:
+            pass
+        assert first is second
+
+    def test_separate_connection_per_thread(self, temp_db):
+        """Olika trådar ska få olika anslutningar."""
+        with db.get_connection() as main_conn:
+            pass
+        other = []
+
+        def worker():
+            with db.get_connection() as conn:
+                other.append(conn)
+            db.close_thread_connection()
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+        assert other[0] is not main_conn
+
+    def test_wal_and_pragmas(self, temp_db):
+        """Anslutningen ska använda WAL och konfigurerad busy_timeout."""
+        with db.get_connection() as conn:
+            assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+            assert conn.execute('PRAGMA busy_timeout').fetchone()[0] == db.BUSY_TIMEOUT_MS
+            assert conn.execute('PRAGMA synchronous').fetchone()[0] == 1  # NORMAL
+
+    def test_uncommitted_changes_rolled_back(self, temp_db):
+        """Okommitterade ändringar ska inte läcka till nästa användning av anslutningen."""
+        with db.get_connection() as conn:
+            conn.execute("INSERT INTO learning_asa_factors (asa_class, asa_factor) VALUES ('ASA 5', 0.5)")
+        assert db.get_asa_factor('ASA 5', 0.7) == 0.7
+
+    def test_reconnects_after_failed_health_check(self, temp_db, monkeypatch):
+        """En stängd poolad anslutning ska ersättas vid nästa hälsokontroll."""
+        with db.get_connection() as conn:
+            pass
+        conn.close()
+        monkeypatch.setattr(db, 'HEALTH_CHECK_INTERVAL_S', 0.0)
+
+        with db.get_connection() as new_conn:
+            assert new_conn is not conn
+            assert new_conn.execute('SELECT 1').fetchone()[0] == 1
+
+    def test_reader_not_blocked_by_open_write(self, temp_db):
+        """Läsare ska inte blockeras av en pågående skrivtransaktion (WAL)."""
+        db.update_asa_factor('ASA 3', 0.9, 0.1)
+        writer_ready = threading.Event()
+        release_writer = threading.Event()
+
+        def writer():
+            with db.get_connection() as conn:
+                conn.execute("UPDATE learning_asa_factors SET asa_factor = 0.1 WHERE asa_class = 'ASA 3'")
+                writer_ready.set()
+                release_writer.wait(5)
+                conn.commit()
+            db.close_thread_connection()
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        writer_ready.wait(5)
+        try:
+            # Läser senaste committade värdet utan att vänta på skrivaren
+            assert db.get_asa_factor('ASA 3', 0.9) == pytest.approx(1.0)
+        finally:
+            release_writer.set()
+            thread.join()
+        assert db.get_asa_factor('ASA 3', 0.9) == pytest.approx(0.1)
+
+
+class TestQueryCases:
+    """Test filtrerad, keyset-paginerad hämtning av fall."""
+
+    @pytest.fixture
+    def cases(self, temp_db):
+        alice = db.create_user('alice', None)
+        bob = db.create_user('bob', None)
+        ids = []
+        case_data = []
+        for i in range(25):
+            case_data.append({
+                'procedure_id': 'proc_a' if i % 2 == 0 else 'proc_b',
+                'age': 50,
+                'vas': i % 10,
+                'uvaDose': 0,
+                'postop_minutes': 0,
+            })
+            ids.append(db.save_case(case_data[-1], alice if i < 15 else bob))
+        db.finalize_case(ids[0], case_data[0], alice)
+        return {'alice': alice, 'bob': bob, 'ids': ids}
+
+    def test_pages_cover_all_cases_once(self, cases):
+        """Sidorna ska tillsammans ge varje fall exakt en gång, nyaste först."""
+        seen = []
+        cursor = None
+        while True:
+            page = db.query_cases(after_cursor=cursor, limit=10)
+            seen.extend(case['id'] for case in page['cases'])
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        assert seen == sorted(cases['ids'], reverse=True)
+
+    def test_filters_match_python_filtering(self, cases):
+        """SQL-filtren ska ge samma fall som motsvarande filtrering i Python."""
+        filters = {'username_contains': 'ALI', 'procedure_ids': ['proc_a'], 'min_vas': 4}
+        result = db.query_cases(filters, limit=100)['cases']
+
+        expected = [case['id'] for case in db.get_all_cases()
+                    if case['user_id'] == cases['alice'] and case['procedure_id'] == 'proc_a' and case['vas'] >= 4]
+        assert [case['id'] for case in result] == expected
+        assert db.count_cases(filters) == len(expected)
+
+    def test_status_and_incomplete_filters(self, cases):
+        """Status- och ofullständig-filter ska översättas till SQL."""
+        finalized = db.query_cases({'status': 'FINALIZED'})['cases']
+        assert [case['id'] for case in finalized] == [cases['ids'][0]]
+
+        incomplete = db.query_cases({'incomplete': True}, limit=100)['cases']
+        assert all(case['vas'] == 3 for case in incomplete)
+        assert len(incomplete) == 3
+
+    def test_oldest_order(self, cases):
+        """order='oldest' ska ge äldsta fall först."""
+        page = db.query_cases(order='oldest', limit=3)
+        assert [case['id'] for case in page['cases']] == cases['ids'][:3]
+
+    def test_usernames_joined_into_page(self, cases):
+        """Skapare och senaste redigerare ska komma med i samma fråga."""
+        page = db.query_cases(order='oldest', limit=1)['cases']
+        assert page[0]['created_by_name'] == 'alice'
+        assert page[0]['last_modified_by_name'] == 'alice'
+
+    def test_get_users_by_ids(self, cases):
+        """Bulk-uppslag ska ge en map för existerande användare."""
+        users = db.get_users_by_ids([cases['alice'], cases['bob'], cases['alice'], None, 9999])
+        assert {uid: user['username'] for uid, user in users.items()} == {
+            cases['alice']: 'alice', cases['bob']: 'bob'}
+
+
+class TestProcedureCaseStats:
+    """Test att procedure_case_stats hålls i synk via triggers."""
+
+    def test_counts_follow_save_finalize_delete(self, temp_db):
+        """Räknarna ska följa spara, slutföra, byte av ingrepp och radera."""
+        user_id = db.create_user('alice', None)
+        case_data = {'procedure_id': 'proc_a', 'age': 50}
+        first = db.save_case(case_data, user_id)
+        second = db.save_case(case_data, user_id)
+        db.finalize_case(first, case_data, user_id)
+
+        assert db.get_procedure_case_stats('proc_a') == {'total': 2, 'finalized': 1, 'in_progress': 1}
+        assert db.get_total_case_count() == db.count_cases() == 2
+
+        with db.get_connection() as conn:
+            conn.execute("UPDATE cases SET procedure_id = 'proc_b' WHERE id = ?", (second,))
+            conn.commit()
+        db.delete_case(first)
+
+        assert db.get_procedure_case_stats('proc_a') == {'total': 0, 'finalized': 0, 'in_progress': 0}
+        assert db.get_all_procedure_case_stats() == {'proc_b': {'total': 1, 'finalized': 0, 'in_progress': 1}}
+
+    def test_rebuild_matches_triggers(self, temp_db):
+        """Omräkning från cases ska ge samma tal som triggers."""
+        user_id = db.create_user('alice', None)
+        for i in range(6):
+            case_id = db.save_case({'procedure_id': f'proc_{i % 2}', 'age': 50}, user_id)
+            if i % 3 == 0:
+                db.finalize_case(case_id, {'procedure_id': f'proc_{i % 2}'}, user_id)
+        maintained = db.get_all_procedure_case_stats()
+
+        db.rebuild_procedure_case_stats()
+
+        assert db.get_all_procedure_case_stats() == maintained
+
+
+class TestTemporalDoseDrugKeys:
+    """Test att drug_key löses upp vid sparande och fylls i av migrationen."""
+
+    def test_saved_doses_get_drug_key(self, temp_db):
+        """save_temporal_doses ska lagra upplöst drug_key."""
+        case_id = db.save_case({'procedure_id': 'proc_a', 'age': 50}, db.create_user('alice', None))
+        db.save_temporal_doses(case_id, [
+            {'drug_type': 'fentanyl', 'drug_name': 'Fentanyl', 'dose': 100, 'unit': 'µg', 'time_relative_minutes': -30},
+            {'drug_type': 'nsaid', 'drug_name': 'Ketorolac 30mg', 'dose': 30, 'unit': 'mg', 'time_relative_minutes': -10},
+            {'drug_type': 'morfin', 'drug_name': 'Morfin', 'dose': 5, 'unit': 'mg', 'time_relative_minutes': 0},
+        ])
+
+        keys = [d['drug_key'] for d in db.get_temporal_doses(case_id)]
+        assert keys == ['fentanyl', 'ketorolac_30mg', None]
+
+    def test_migration_backfills_existing_rows(self, temp_db):
+        """Rader utan drug_key ska fyllas i av migrate_to_v11."""
+        from migrations import migrate_to_v11
+
+        case_id = db.save_case({'procedure_id': 'proc_a', 'age': 50}, db.create_user('alice', None))
+        with db.get_connection() as conn:
+            conn.executemany('''
+                INSERT INTO temporal_doses (case_id, drug_type, drug_name, dose, unit, time_relative_minutes)
+                VALUES (?, ?, ?, 1, 'mg', 0)
+            ''', [(case_id, 'ketamine', 'Ketamin'), (case_id, 'betapred', 'Betapred 8mg'), (case_id, 'ketamine', 'Ketamin')])
+            conn.commit()
+
+        migrate_to_v11()
+
+        keys = [d['drug_key'] for d in db.get_temporal_doses(case_id)]
+        assert keys == ['ketamine_small_bolus', 'betamethasone_8mg', 'ketamine_small_bolus']
@@ -0,0 +1,129 @@
+"""
+Feature Engineering Tests
+=========================
+Tests för FeatureEncoder mot den pandas-baserade featurepipelinen.
+"""
+
+import pytest
+import sys
+import os
+import pickle
+import random
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from feature_engineering import (
+    add_engineered_features,
+    add_engineered_features_rowwise,
+    fit_feature_encoder,
+    ENCODE_COLUMNS
+)
+
+
+@pytest.fixture
+def procedures_df():
+    return pd.DataFrame([
+        {'id': 'proc_a', 'somatic_score': 8, 'visceral_score': 2, 'neuropathic_score': 1},
+        {'id': 'proc_b', 'somatic_score': 3, 'visceral_score': 7, 'neuropathic_score': 4},
+    ])
+
+
+def _random_cases(n, seed=3):
+    rng = random.Random(seed)
+    cases = []
+    for _ in range(n):
+        cases.append({
+            'procedure_id': rng.choice(['proc_a', 'proc_b']),
+            'specialty': rng.choice(['Ortopedi', 'Kirurgi', 'Urologi']),
+            'surgery_type': rng.choice(['Elektivt', 'Akut']),
+            'age': rng.randint(18, 90),
+            'sex': rng.choice(['Man', 'Kvinna']),
+            'weight': rng.uniform(50, 120),
+            'asa': rng.choice(['ASA 1', 'ASA 2', 'ASA 3']),
+            'opioidHistory': rng.choice(['Opioidnaiv', 'Opioidtolerant']),
+            'fentanylDose': rng.choice([0, 50, 100]),
+            'nsaid': True,
+            'nsaid_choice': rng.choice(['Ej given', 'Ibuprofen 400mg', 'Paracetamol 1g']),
+            'catapressan': rng.random() < 0.3,
+            'droperidol': rng.random() < 0.3,
+            'ketamine': 'Nej',
+            'ketamine_choice': 'Ej given',
+            'lidocaine': 'Nej',
+            'betapred': rng.choice(['Nej', '4 mg', '8 mg']),
+            'givenDose': rng.uniform(0, 15),
+        })
+    return cases
+
+
+class TestFeatureEncoder:
+    """Test att encodern ger samma vektor som get_dummies-pipelinen."""
+
+    def test_matches_get_dummies(self, procedures_df):
+        """Varje träningsrad ska kodas identiskt med get_dummies(drop_first=True)."""
+        cases = _random_cases(60)
+        cases_df = add_engineered_features(pd.DataFrame(cases), procedures_df)
+        encoded = pd.get_dummies(cases_df, columns=ENCODE_COLUMNS, drop_first=True)
+        features = [col for col in encoded.columns if col not in ('procedure_id', 'ketamine')]
+
+        encoder = fit_feature_encoder(cases_df, features)
+        proc_scores = procedures_df.set_index('id')[['somatic_score', 'visceral_score', 'neuropathic_score']]
+
+        expected = encoded[features].astype(float).to_numpy()
+        for i, case in enumerate(cases):
+            vector = encoder.transform(case, pain_scores=tuple(proc_scores.loc[case['procedure_id']]))
+            assert vector.dtype == np.float32
+            np.testing.assert_allclose(vector, expected[i], rtol=1e-5)
+
+    def test_unknown_category_and_missing_value(self, procedures_df):
+        """Okänd kategori ger nollor; saknad numerisk input ger träningsmedianen."""
+        cases_df = add_engineered_features(pd.DataFrame(_random_cases(20)), procedures_df)
+        encoded = pd.get_dummies(cases_df, columns=ENCODE_COLUMNS, drop_first=True)
+        features = ['age', 'weight'] + [col for col in encoded.columns if col.startswith('specialty_')]
+        encoder = fit_feature_encoder(cases_df, features)
+
+        vector = encoder.transform({'specialty': 'Okänd', 'age': 40})
+
+        assert vector[0] == 40
+        assert vector[1] == pytest.approx(cases_df['weight'].median(), rel=1e-5)
+        assert not vector[2:].any()
+
+    def test_encoder_survives_pickle(self, procedures_df):
+        """Encodern sparas med joblib/pickle och ska fungera efter inläsning."""
+        cases = _random_cases(10)
+        cases_df = add_engineered_features(pd.DataFrame(cases), procedures_df)
+        encoder = fit_feature_encoder(cases_df, ['age', 'asa_ASA 2'])
+
+        restored = pickle.loads(pickle.dumps(encoder))
+
+        np.testing.assert_array_equal(restored.transform(cases[0]), encoder.transform(cases[0]))
+
+
+class TestVectorizedFeatures:
+    """Test att kolumnversionen ger samma resultat som radversionen."""
+
+    def test_matches_rowwise(self, procedures_df):
+        """Alla engineered features ska vara identiska med df.apply-versionen."""
+        cases = _random_cases(200, seed=11)
+        cases[0].update({'procedure_id': 'okand', 'nsaid': False})
+        cases[1].update({'ketamine': 'Ja', 'ketamine_choice': 'Liten bolus (0.05-0.1 mg/kg)', 'lidocaine': 'Bolus'})
+        cases[2].update({'betapred': 'Okänt val', 'catapressan': False, 'catapressan_dose': 75})
+        cases[3].update({'nsaid_choice': None, 'lidocaine': None})
+        cases_df = pd.DataFrame(cases)
+
+        expected = add_engineered_features_rowwise(cases_df, procedures_df)
+        result = add_engineered_features(cases_df, procedures_df)
+
+        assert list(result.columns) == list(expected.columns)
+        pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+    def test_missing_optional_columns(self, procedures_df):
+        """Kolumner som saknas ska tolkas som radversionens row.get-defaults."""
+        cases_df = pd.DataFrame([{'procedure_id': 'proc_a', 'droperidol': True}, {'procedure_id': 'proc_b'}])
+
+        pd.testing.assert_frame_equal(
+            add_engineered_features(cases_df, procedures_df),
+            add_engineered_features_rowwise(cases_df, procedures_df),
+            check_dtype=False
+        )
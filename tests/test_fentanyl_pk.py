@@ -0,0 +1,103 @@
+"""
+Fentanyl PK Tests
+=================
+Tests för trekompartmentmodellen med cachade övergångsmatriser.
+"""
+
+import pytest
+import sys
+import os
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import fentanyl_pk as fpk
+import pharmacokinetics as pk
+from config import APP_CONFIG
+
+PARAMS = fpk.DEFAULT_FENTANYL_PARAMS
+
+
+def _taylor_expm(matrix, minutes, terms=60, squarings=10):
+    scaled = matrix * minutes / 2 ** squarings
+    result, term = np.eye(4), np.eye(4)
+    for n in range(1, terms):
+        term = term @ scaled / n
+        result = result + term
+    for _ in range(squarings):
+        result = result @ result
+    return result
+
+
+class TestTransitionMatrices:
+    """Cachade matriser och impulssvar"""
+
+    def test_transition_matrix_matches_series_expansion(self):
+        for minutes in (1.0, 17.5, 240.0):
+            assert fpk.transition_matrix(PARAMS, minutes) == pytest.approx(
+                _taylor_expm(fpk._system_matrix(PARAMS), minutes), abs=1e-10)
+
+    def test_matrices_cached_per_parameter_set(self):
+        assert fpk.transition_matrix(PARAMS, 5.0) is fpk.transition_matrix(fpk.FentanylPKParams(), 5.0)
+        assert fpk.transition_matrix(PARAMS, 5.0) is not fpk.transition_matrix(
+            fpk.FentanylPKParams(ke0=0.1), 5.0)
+
+    def test_impulse_table_matches_direct_propagation(self):
+        table = fpk.impulse_response(PARAMS)
+        for minute in (0, 4, 90, fpk.TABLE_HORIZON_MINUTES):
+            expected = fpk.transition_matrix(PARAMS, float(minute)) @ np.array([1.0, 0.0, 0.0, 0.0])
+            assert table[minute] == pytest.approx(expected, rel=1e-9, abs=1e-15)
+        # Fraktionerade tider via egenvärden ligger mellan tabellvärdena
+        assert fpk._states_after(PARAMS, np.array([90.5]))[0] == pytest.approx(
+            fpk.transition_matrix(PARAMS, 90.5)[:, 0])
+
+    def test_mass_only_leaves_through_elimination(self):
+        amounts = fpk.impulse_response(PARAMS)[:, :3].sum(axis=1)
+        assert amounts[0] == 1.0
+        assert np.all(np.diff(amounts) < 0)
+
+
+class TestScheduleSimulation:
+    """Doseringsschema och batch"""
+
+    def test_schedule_equals_superposition_of_boluses(self):
+        dose_times, doses = [-150, -62.5, -20], [100, 50, 50]
+        times = np.array([-150, -100, -20, 0, 0.5, 60])
+        result = fpk.simulate_schedule(dose_times, doses, times)
+        expected = sum(d * fpk._states_after(PARAMS, times - t) for t, d in zip(dose_times, doses))
+        assert result['effect_site_ng_ml'] == pytest.approx(expected[:, 3])
+        assert result['amounts_mcg'] == pytest.approx(expected[:, :3])
+        assert result['plasma_ng_ml'] == pytest.approx(expected[:, 0] / PARAMS.v1)
+
+    def test_effect_site_fraction(self):
+        peak_minute, _ = fpk.effect_site_peak(PARAMS)
+        fractions = fpk.effect_site_fraction([-5, 0, peak_minute, 30, 120, 600])
+        assert list(fractions[:3]) == [0.0, 1.0, 1.0]
+        assert 1.0 > fractions[3] > fractions[4] > fractions[5] > 0.0
+
+    def test_batch_matches_per_case(self):
+        cases = [([-150, -20], [100, 50]), ([], []), ([-45.5, 0], [200, 25])]
+        case_index = np.repeat(np.arange(len(cases)), [len(t) for t, _ in cases])
+        dose_times = np.concatenate([t for t, _ in cases])
+        doses = np.concatenate([d for _, d in cases])
+        batch = fpk.effective_fentanyl_mcg_batch(case_index, dose_times, doses, len(cases))
+        assert batch == pytest.approx([fpk.effective_fentanyl_mcg(t, d) for t, d in cases])
+
+
+class TestTemporalFentanylIme:
+    """Integration i pharmacokinetics"""
+
+    def test_dose_at_opslut_counts_fully(self):
+        doses = [{'drug_type': 'fentanyl', 'dose': 100, 'time_relative_minutes': 0}]
+        assert pk.calculate_temporal_fentanyl_ime_at_opslut(doses) == pytest.approx(10.0)
+
+    def test_biexponential_by_default_compartment_model_opt_in(self, monkeypatch):
+        doses = [{'drug_type': 'fentanyl', 'dose': 200, 'time_relative_minutes': -90},
+                 {'drug_type': 'fentanyl', 'dose': 50, 'time_relative_minutes': 30}]
+        assert APP_CONFIG['FENTANYL_PK_MODEL'] == 'biexponential'
+        assert pk.calculate_temporal_fentanyl_ime_at_opslut(doses) == pytest.approx(
+            pk.calculate_fentanyl_remaining_at_opslut(200, 90) / 10)
+
+        monkeypatch.setitem(APP_CONFIG, 'FENTANYL_PK_MODEL', 'three_compartment')
+        assert pk.calculate_temporal_fentanyl_ime_at_opslut(doses) == pytest.approx(
+            200 * fpk.effect_site_fraction(90) / 10)
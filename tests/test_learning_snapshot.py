@@ -0,0 +1,263 @@
+"""
+Learning Snapshot Tests
+=======================
+Tests för oföränderlig inlärningssnapshot och att regelmotorn kan räkna
+helt i minnet utan databasanrop.
+"""
+
+import pytest
+import sys
+import os
+import dataclasses
+import sqlite3
+import random
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database as db
+import calculation_engine
+from learning_snapshot import (
+    LearningSnapshot,
+    load_learning_snapshot,
+    get_cached_learning_snapshot,
+    invalidate_learning_cache
+)
+from interpolation_engine import interpolate_age_factor, interpolate_weight_factor
+
+
+@pytest.fixture
+def procedures_df():
+    return pd.DataFrame([{
+        'id': 'test_proc',
+        'specialty': 'Ortopedi',
+        'name': 'Test Procedure',
+        'baseIME': 10,
+        'painTypeScore': 5,
+        'painVisceral': 5,
+        'painNeuropathic': 2
+    }])
+
+
+def _inputs(**overrides):
+    inputs = {
+        'procedure_id': 'test_proc',
+        'age': 50,
+        'sex': 'Man',
+        'weight': 75,
+        'height': 175,
+        'asa': 'ASA 2',
+        'opioidHistory': 'Opioidnaiv',
+        'lowPainThreshold': False,
+        'renalImpairment': False,
+        'fentanylDose': 0,
+        'nsaid_choice': 'Ej given',
+        'catapressan_dose': 0,
+        'droperidol': False,
+        'ketamine_choice': 'Ej given',
+        'lidocaine': 'Nej',
+        'betapred': 'Nej',
+        'sevoflurane': False,
+        'infiltration': False
+    }
+    inputs.update(overrides)
+    return inputs
+
+
+class TestLearningSnapshot:
+    """Test att snapshot speglar databasens getters."""
+
+    def test_empty_snapshot_uses_db_defaults(self):
+        """En tom snapshot ska ge samma fallback-värden som database.py."""
+        snapshot = LearningSnapshot()
+        assert snapshot.get_asa_factor('ASA 3', 0.8) == 0.8
+        assert snapshot.get_opioid_tolerance_factor() == 1.5
+        assert snapshot.get_pain_threshold_factor() == 1.2
+        assert snapshot.get_renal_factor() == 0.75
+        assert snapshot.get_calibration_factor(1, 'key') == 1.0
+        assert snapshot.get_age_bucket_learning(70) is None
+
+    def test_snapshot_is_immutable(self):
+        """Snapshot och dess uppslagstabeller får inte kunna ändras."""
+        snapshot = LearningSnapshot()
+        with pytest.raises(dataclasses.FrozenInstanceError):
+            snapshot.renal_factor = 0.5
+        with pytest.raises(TypeError):
+            snapshot.asa_factors['ASA 1'] = 2.0
+
+    def test_load_matches_database(self, temp_db):
+        """Värden i snapshot ska matcha de vanliga DB-getters."""
+        db.update_asa_factor('ASA 3', 0.8, 0.1)
+        db.update_age_bucket_learning(70, 0.8, 0.1)
+        db.update_calibration_factor(1, 'test_proc-ASA2', 0.2)
+
+        snapshot = load_learning_snapshot()
+
+        assert snapshot.get_asa_factor('ASA 3', 0.8) == pytest.approx(db.get_asa_factor('ASA 3', 0.8))
+        assert snapshot.get_age_bucket_learning(70) == db.get_age_bucket_learning(70)
+        assert snapshot.get_calibration_factor(1, 'test_proc-ASA2') == pytest.approx(
+            db.get_calibration_factor(1, 'test_proc-ASA2'))
+
+
+    def test_fentanyl_fraction_per_user(self, temp_db):
+        """Per-användartabellen ska ge varje användares egen fraktion, inte en godtycklig rad."""
+        with db.get_connection() as conn:
+            conn.execute('DROP TABLE learning_fentanyl')
+            conn.execute('CREATE TABLE learning_fentanyl (user_id INTEGER PRIMARY KEY, remaining_fraction REAL DEFAULT 0.25)')
+            conn.executemany('INSERT INTO learning_fentanyl VALUES (?, ?)', [(1, 0.2), (2, 0.4)])
+            conn.commit()
+
+        snapshot = load_learning_snapshot()
+
+        for user_id in (1, 2, 3, None):
+            assert snapshot.get_fentanyl_remaining_fraction(user_id) == pytest.approx(
+                db.get_fentanyl_remaining_fraction(user_id))
+
+    def test_fentanyl_fraction_global_table(self, temp_db):
+        """Den globala tabellen (id = 1) gäller alla inloggade användare."""
+        with db.get_connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO learning_fentanyl (id, remaining_fraction) VALUES (1, 0.3)')
+            conn.commit()
+
+        snapshot = load_learning_snapshot()
+
+        assert snapshot.get_fentanyl_remaining_fraction(7) == pytest.approx(0.3)
+        assert snapshot.get_fentanyl_remaining_fraction(None) == 0.25
+
+
+class TestEngineWithSnapshot:
+    """Test att regelmotorn inte går mot databasen när en snapshot skickas in."""
+
+    def test_no_db_connections_with_snapshot(self, procedures_df, monkeypatch):
+        """Dosberäkning med snapshot ska göra noll databasanrop."""
+        def fail_connection():
+            raise AssertionError("get_connection should not be called")
+
+        monkeypatch.setattr(db, 'get_connection', fail_connection)
+        monkeypatch.setattr(calculation_engine.auth, 'get_current_user_id', lambda: 1)
+
+        result = calculation_engine.calculate_rule_based_dose(
+            _inputs(age=75, asa='ASA 3'), procedures_df, snapshot=LearningSnapshot()
+        )
+        assert result['finalDose'] > 0
+
+    def test_snapshot_factors_are_applied(self, procedures_df, monkeypatch):
+        """Inlärd kalibreringsfaktor i snapshot ska påverka dosen."""
+        monkeypatch.setattr(calculation_engine.auth, 'get_current_user_id', lambda: 1)
+        inputs = _inputs()
+
+        baseline = calculation_engine.calculate_rule_based_dose(
+            inputs, procedures_df, snapshot=LearningSnapshot()
+        )
+        calibrated = calculation_engine.calculate_rule_based_dose(
+            inputs, procedures_df,
+            snapshot=LearningSnapshot(calibration_factors={(1, baseline['compositeKey']): 2.0})
+        )
+        assert calibrated['finalDose'] > baseline['finalDose']
+
+
+class TestLearningCache:
+    """Test processdelad cache och invalidering vid skrivning."""
+
+    def test_cache_reused_without_writes(self, temp_db):
+        """Utan skrivningar ska samma snapshot-objekt återanvändas."""
+        invalidate_learning_cache()
+        first = get_cached_learning_snapshot()
+        assert get_cached_learning_snapshot() is first
+
+    def test_update_invalidates_cache(self, temp_db):
+        """update_* i database.py ska ge en ny snapshot med nya värden."""
+        invalidate_learning_cache()
+        first = get_cached_learning_snapshot()
+        version = db.get_learning_version()
+
+        db.update_asa_factor('ASA 3', 0.8, 0.1)
+
+        assert db.get_learning_version() == version + 1
+        second = get_cached_learning_snapshot()
+        assert second is not first
+        assert second.get_asa_factor('ASA 3', 0.8) == pytest.approx(db.get_asa_factor('ASA 3', 0.8))
+
+    def test_external_write_detected_via_data_version(self, temp_db):
+        """Skrivning från annan anslutning (annan process) ska upptäckas."""
+        invalidate_learning_cache()
+        first = get_cached_learning_snapshot()
+
+        conn = sqlite3.connect(temp_db)
+        conn.execute("INSERT INTO learning_asa_factors (asa_class, asa_factor) VALUES ('ASA 4', 0.5)")
+        conn.commit()
+        conn.close()
+
+        second = get_cached_learning_snapshot()
+        assert second is not first
+        assert second.get_asa_factor('ASA 4', 1.0) == 0.5
+
+
+class TestBucketRangeQueries:
+    """Test intervallfrågor för ålders-/viktbuckets och interpolation."""
+
+    def test_age_range_query(self, temp_db):
+        """Intervallfrågan ska returnera exakt de buckets som ligger i intervallet."""
+        for age in (40, 45, 50, 56):
+            db.update_age_bucket_learning(age, 1.0, 0.05)
+
+        buckets = db.get_age_buckets_in_range(45, 55)
+
+        assert set(buckets) == {45, 50}
+        assert buckets[45] == db.get_age_bucket_learning(45)
+
+    def test_interpolation_uses_single_round_trip(self, temp_db, monkeypatch):
+        """En interpolation mot databasen ska kosta en anslutning och ge samma svar som snapshot."""
+        for weight in (70, 72, 75):
+            for _ in range(5):
+                db.update_weight_bucket_learning(weight, 1.0, 0.02)
+
+        snapshot = load_learning_snapshot()
+        calls = []
+        original = db.get_connection
+
+        def counting_connection():
+            calls.append(1)
+            return original()
+
+        monkeypatch.setattr(db, 'get_connection', counting_connection)
+        result = interpolate_weight_factor(73, 1.0)
+
+        assert len(calls) == 1
+        assert result['method'] == 'interpolated'
+        assert result['weight_factor'] == pytest.approx(
+            interpolate_weight_factor(73, 1.0, snapshot=snapshot)['weight_factor'])
+
+
+class TestFactorCurves:
+    """Test materialiserade, utjämnade ålders-/viktkurvor."""
+
+    def test_curve_matches_interpolation(self):
+        """Kurvuppslag ska ge samma faktor som interpolationen för varje ålder och vikt."""
+        rng = random.Random(7)
+        snapshot = LearningSnapshot(
+            age_buckets={a: (rng.uniform(0.1, 2.0), rng.randint(0, 12)) for a in range(0, 121, 3)},
+            weight_buckets={w: (rng.uniform(0.4, 2.0), rng.randint(0, 12)) for w in range(1, 301, 4)},
+        )
+
+        for age in range(0, 121):
+            default = 0.9
+            expected = interpolate_age_factor(age, default, snapshot=snapshot)['age_factor']
+            assert snapshot.get_smoothed_age_factor(age, default) == pytest.approx(expected)
+        for weight in range(1, 301):
+            expected = interpolate_weight_factor(weight, 1.0, snapshot=snapshot)['weight_factor']
+            assert snapshot.get_smoothed_weight_factor(weight, 1.0) == pytest.approx(expected)
+
+    def test_update_refreshes_materialized_window(self, temp_db):
+        """update_age_bucket_learning ska hålla learning_age_curve i synk med buckets."""
+        for _ in range(4):
+            db.update_age_bucket_learning(60, 1.0, -0.05)
+            db.update_age_bucket_learning(63, 1.0, 0.05)
+
+        loaded = load_learning_snapshot()
+        recomputed = LearningSnapshot(age_buckets=loaded.age_buckets)
+
+        np.testing.assert_allclose(loaded.age_curve, recomputed.age_curve, equal_nan=True)
+        assert not np.isnan(loaded.age_curve[58])
+        assert np.isnan(loaded.age_curve[80])
@@ -0,0 +1,170 @@
+"""
+MEML Model Tests
+================
+Tests för strömmande extraktion av träningsdata (kräver inte gpboost).
+"""
+
+import pytest
+import sys
+import os
+import pickle
+import random
+import types
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database as db
+import meml_model
+import pk_model
+from calculation_engine import calculate_lean_body_mass, calculate_lean_body_mass_batch
+from learning_snapshot import load_learning_snapshot
+
+
+@pytest.fixture
+def temp_db(temp_db):
+    """Temporär databas (conftest); ger en användares id."""
+    return db.create_user('alice', None)
+
+
+def _add_cases(user_id, n, seed=3):
+    rng = random.Random(seed)
+    procedure_ids = [p['id'] for p in db.get_all_procedures()[:3]] or ['proc_a', 'proc_b']
+    cases = []
+    for _ in range(n):
+        case = {
+            'procedure_id': rng.choice(procedure_ids),
+            'age': rng.randint(18, 95),
+            'sex': rng.choice(['Man', 'Kvinna']),
+            'weight': rng.uniform(45, 140),
+            'height': rng.uniform(150, 200),
+            'renalImpairment': rng.random() < 0.2,
+            'opioidHistory': rng.choice(['Opioidnaiv', 'Opioidtolerant']),
+            'nsaid': rng.random() < 0.5,
+            'ketamine_choice': rng.choice(['Ej given', 'Liten bolus (0.05-0.1 mg/kg)']),
+            'lidocaine': rng.choice(['Nej', 'Bolus']),
+            'betapred': rng.choice(['Nej', '4 mg']),
+            'givenDose': round(rng.uniform(2, 15), 2),
+            'vas': rng.randint(0, 8),
+        }
+        case_id = db.save_case(case, user_id)
+        db.finalize_case(case_id, case, user_id)
+        cases.append(case)
+    # Ett pågående fall ska inte tas med
+    db.save_case(dict(cases[0]), user_id)
+    return cases
+
+
+class TestPrepareTrainingData:
+    """Test chunkad extraktion till förallokerade arrays."""
+
+    def test_matches_engineer_features(self, temp_db):
+        """Varje rad ska motsvara engineer_features för samma fall, oavsett chunkstorlek."""
+        cases = _add_cases(temp_db, 23)
+        # Ett ingrepp med inlärd 3D-profil, övriga faller tillbaka på painTypeScore
+        db.update_procedure_learning_3d(cases[0]['procedure_id'], 10, 5, 5, 2, 0, 1.5, -2, 3)
+        snapshot = load_learning_snapshot()
+        X, y, group = meml_model.prepare_training_data(chunk_size=5)
+
+        assert len(X) == len(y) == len(group) == 23
+        assert X['sex_binary'].dtype == np.int8 and X['lbm_kg'].dtype == np.float32
+        assert list(group.astype(str)) == [c['procedure_id'] for c in cases]
+        np.testing.assert_allclose(y, [c['givenDose'] for c in cases], rtol=1e-6)
+
+        procedures = {p['id']: p for p in db.get_all_procedures()}
+        for i, case in enumerate(cases):
+            procedure = procedures.get(case['procedure_id'], {})
+            pain_profile = meml_model.procedure_pain_profile(case['procedure_id'], procedure, snapshot)
+            expected = meml_model.engineer_features(case, procedure, pain_profile)
+            for name in X.columns:
+                assert X[name].iloc[i] == pytest.approx(expected[name], rel=1e-5), name
+
+    def test_empty_database(self, temp_db):
+        """Utan slutförda fall ska tomma frames med rätt kolumner returneras."""
+        X, y, group = meml_model.prepare_training_data(include_pk_features=False)
+        assert len(X) == 0 and len(y) == 0 and len(group) == 0
+        assert list(X.columns) == list(meml_model.FEATURE_DTYPES)
+
+
+class TestVectorizedPK:
+    """Test att batch-versionerna ger samma värden som skalärfunktionerna."""
+
+    def test_lbm_and_pk_batch(self):
+        rng = np.random.RandomState(1)
+        age, weight, height = rng.uniform(18, 95, 200), rng.uniform(40, 160, 200), rng.uniform(140, 205, 200)
+        female = rng.rand(200) < 0.5
+        gfr = rng.choice([20.0, 45.0, 75.0, 100.0, np.nan], 200)
+        hepatic = rng.choice(['None', 'Mild', 'Moderate', 'Severe'], 200)
+
+        lbm = calculate_lean_body_mass_batch(weight, height, female)
+        pk = pk_model.calculate_pk_batch(age, lbm, gfr=gfr, hepatic_impairment=hepatic)
+
+        for i in range(200):
+            sex = 'Kvinna' if female[i] else 'Man'
+            assert lbm[i] == pytest.approx(calculate_lean_body_mass(weight[i], height[i], sex))
+            expected = pk_model.get_pk_summary(age[i], weight[i], height[i], sex,
+                                               None if np.isnan(gfr[i]) else gfr[i], hepatic[i])
+            for key in ('clearance_L_per_h', 'vd_L', 'half_life_h', 'elimination_constant'):
+                assert pk[key][i] == pytest.approx(expected[key]), key
+
+
+class _FakeBooster:
+    """Booster med GPBoost:s predict-gränssnitt: medel från age, varians per grupp."""
+
+    def __init__(self, model_file=None):
+        self.calls = []
+
+    def predict(self, data, group_data_pred=None, predict_var=False):
+        self.calls.append((len(data), list(group_data_pred)))
+        group_var = np.array([1.0 if g == 'known' else 4.0 for g in group_data_pred])
+        return {'response_mean': data['age'].to_numpy() / 10.0, 'response_var': group_var}
+
+
+@pytest.fixture
+def fake_gpboost(tmp_path, monkeypatch):
+    monkeypatch.setattr(meml_model, 'gpb', types.SimpleNamespace(Booster=_FakeBooster), raising=False)
+    monkeypatch.setattr(meml_model.model_registry, 'REGISTRY_DIR', str(tmp_path / 'registry'))
+    monkeypatch.setattr(meml_model, '_loaded_model', None)
+    monkeypatch.setattr(meml_model, '_loaded_stat', None)
+
+    def publish(text):
+        def write_model(path):
+            with open(path, 'w') as f:
+                f.write(text)
+
+        def write_names(path):
+            with open(path, 'wb') as f:
+                pickle.dump(['age', 'weight', 'lbm_kg'], f)
+        return meml_model.model_registry.publish_model('meml', {
+            meml_model.MODEL_FILE: write_model,
+            meml_model.FEATURE_NAMES_FILE: write_names,
+        }, {})
+    return publish
+
+
+class TestMemlPrediction:
+    """Test processdelad booster och batchad dos-responskurva."""
+
+    def test_booster_cached_until_new_version(self, fake_gpboost):
+        first_version = fake_gpboost('v1')
+        first = meml_model.get_meml_model()
+        assert meml_model.get_meml_model() is first
+        assert first.version == first_version
+
+        fake_gpboost('v2')
+        assert meml_model.get_meml_model() is not first
+
+    def test_curve_for_groups_in_one_call(self, fake_gpboost):
+        fake_gpboost('v1')
+        loaded = meml_model.get_meml_model()
+        response = meml_model.predict_dose_response_meml(
+            loaded, {'age': 80, 'weight': 70}, {}, ['known', 'unseen'], doses=np.array([4.0, 8.0, 12.0]))
+
+        assert loaded.booster.calls == [(2, ['known', 'unseen'])]
+        np.testing.assert_allclose(response['mean'], [8.0, 8.0])
+        np.testing.assert_allclose(response['var'], [1.0, 4.0])
+        assert response['p_success'].shape == (2, 3)
+        np.testing.assert_allclose(response['p_success'][:, 1], 0.5)
+        assert np.all(np.diff(response['p_success'], axis=1) > 0)
+        # Högre varians ger flackare kurva
+        assert response['p_success'][0, 0] < response['p_success'][1, 0]
@@ -0,0 +1,123 @@
+"""
+ML Model Tests
+==============
+Tests för processdelad, hash-versionerad inläsning av XGBoost-modellen.
+"""
+
+import pytest
+import sys
+import os
+import joblib
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import ml_model
+
+
+def _write_model(path, n_estimators):
+    X = np.random.RandomState(0).rand(20, 2)
+    y = X[:, 0] * 5
+    model = xgb.XGBRegressor(n_estimators=n_estimators, max_depth=2)
+    model.fit(X, y)
+    tmp_path = str(path) + '.tmp'
+    joblib.dump({'model': model, 'features': ['givenDose', 'age']}, tmp_path)
+    os.replace(tmp_path, path)
+
+
+@pytest.fixture
+def model_path(tmp_path, monkeypatch):
+    path = tmp_path / 'model.joblib'
+    _write_model(path, 3)
+    monkeypatch.setattr(ml_model, 'MODEL_PATH', str(path))
+    monkeypatch.setattr(ml_model, 'SERVING_MODEL_PATH', str(tmp_path / 'missing.serving.joblib'))
+    monkeypatch.setattr(ml_model.model_registry, 'REGISTRY_DIR', str(tmp_path / 'registry'))
+    monkeypatch.setattr(ml_model, '_loaded_model', None)
+    monkeypatch.setattr(ml_model, '_loaded_stat', None)
+    return path
+
+
+class TestModelCache:
+    """Test att modellen laddas en gång och laddas om vid ny fil."""
+
+    def test_loaded_once(self, model_path, monkeypatch):
+        """Upprepade anrop utan ändrad fil ska inte deserialisera igen."""
+        loads = []
+        original = ml_model.joblib.load
+
+        def counting_load(path):
+            loads.append(path)
+            return original(path)
+
+        monkeypatch.setattr(ml_model.joblib, 'load', counting_load)
+        first = ml_model.get_model()
+        assert ml_model.get_model() is first
+        assert len(loads) == 1
+        assert ml_model.get_model_version() == first.version
+
+    def test_reload_on_new_model(self, model_path):
+        """En ny modellfil ska ge ny version; samma innehåll ska inte laddas om."""
+        first = ml_model.get_model()
+
+        os.utime(model_path, ns=(0, 0))
+        assert ml_model.get_model() is first
+
+        _write_model(model_path, 5)
+        second = ml_model.get_model()
+        assert second is not first
+        assert second.version != first.version
+
+    def test_registry_version_and_rollback(self, model_path):
+        """Registrets aktuella version ska serveras; rollback ska växla utan omträning."""
+        publish = lambda n: ml_model.model_registry.publish_model(
+            'xgboost', {ml_model.MODEL_FILE: lambda path: _write_model(path, n)}, {})
+        first, second = publish(3), publish(5)
+
+        assert ml_model.get_model().version == second
+        ml_model.model_registry.rollback('xgboost')
+        assert ml_model.get_model().version == first
+        assert ml_model.get_model(second).version == second
+
+
+class TestDoseResponseScan:
+    """Test batchad dos→VAS-skanning."""
+
+    def test_batch_matches_row_by_row(self, model_path):
+        """Batchprediktion ska ge samma VAS som en prediktion per dos."""
+        loaded = ml_model.get_model()
+        base_row = np.array([0.0, 0.4])
+        doses = np.arange(0, 20.5, 0.5)
+
+        batch = ml_model.predict_dose_response(loaded.model, loaded.features, base_row, doses)
+
+        for dose, vas in zip(doses, batch):
+            row = pd.DataFrame([[dose, 0.4]], columns=loaded.features)
+            assert vas == pytest.approx(float(loaded.model.predict(row)[0]))
+
+    def test_refined_curve_is_sorted_and_unique(self, model_path):
+        """Förfinad kurva ska vara sorterad, utan dubbletter och inkludera finare steg."""
+        loaded = ml_model.get_model()
+        doses, vas = ml_model.scan_dose_response(
+            loaded.model, loaded.features, np.array([0.0, 0.4]), 1.0, grid_step=0.5, refine_step=0.25)
+
+        assert np.all(np.diff(doses) > 0)
+        assert len(doses) == len(vas)
+        assert np.any(np.isclose(doses % 0.5, 0.25))
+
+    def test_refinement_opt_in(self, model_path, monkeypatch):
+        """Förfining är avstängd som standard och explicit None stänger av config-steget."""
+        loaded = ml_model.get_model()
+        base_row = np.array([0.0, 0.4])
+        coarse = np.arange(0.0, ml_model.DOSE_GRID_MAX + 0.25, 0.5)
+
+        doses, _ = ml_model.scan_dose_response(loaded.model, loaded.features, base_row, 1.0, grid_step=0.5)
+        np.testing.assert_allclose(doses, coarse)
+
+        monkeypatch.setitem(ml_model.APP_CONFIG, 'ML_DOSE_REFINE_STEP', 0.25)
+        doses, _ = ml_model.scan_dose_response(loaded.model, loaded.features, base_row, 1.0, grid_step=0.5)
+        assert len(doses) > len(coarse)
+        doses, _ = ml_model.scan_dose_response(
+            loaded.model, loaded.features, base_row, 1.0, grid_step=0.5, refine_step=None)
+        np.testing.assert_allclose(doses, coarse)
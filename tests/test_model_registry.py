@@ -0,0 +1,98 @@
+"""
+Model Registry Tests
+====================
+Tests för versionerad publicering, atomisk växling och rollback av modeller.
+"""
+
+import pytest
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import model_registry
+
+
+def _write_text(text):
+    def write(path):
+        with open(path, 'w') as f:
+            f.write(text)
+    return write
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    monkeypatch.setattr(model_registry, 'REGISTRY_DIR', str(tmp_path / 'registry'))
+    return tmp_path / 'registry'
+
+
+class TestPublish:
+    """Test publicering och manifest."""
+
+    def test_publish_sets_current_and_manifest(self, registry):
+        """En publicerad version ska bli aktuell och ha manifest med metadata."""
+        version = model_registry.publish_model('m', {'model.txt': _write_text('v1')},
+                                               {'watermark': 'w1', 'metrics': {'rmse': 1.5}})
+
+        assert model_registry.get_current_version('m') == version
+        manifest = model_registry.get_manifest('m')
+        assert manifest['watermark'] == 'w1'
+        assert manifest['metrics'] == {'rmse': 1.5}
+        assert manifest['artifacts'] == ['model.txt']
+        with open(model_registry.artifact_path('m', 'model.txt')) as f:
+            assert f.read() == 'v1'
+
+    def test_failed_publish_leaves_current(self, registry):
+        """Ett fel under skrivningen ska inte påverka aktuell version eller lämna kataloger kvar."""
+        version = model_registry.publish_model('m', {'model.txt': _write_text('v1')}, {})
+
+        def broken(path):
+            raise IOError("disk full")
+
+        with pytest.raises(IOError):
+            model_registry.publish_model('m', {'model.txt': broken}, {})
+
+        assert model_registry.get_current_version('m') == version
+        assert len(model_registry.list_versions('m')) == 1
+        assert not [p for p in os.listdir(registry / 'm') if p.startswith('.')]
+
+    def test_prune_keeps_current(self, registry, monkeypatch):
+        """Rensning ska behålla de senaste versionerna och alltid den aktuella."""
+        monkeypatch.setattr(model_registry, 'KEEP_VERSIONS', 2)
+        first = model_registry.publish_model('m', {}, {})
+        model_registry.rollback('m', first)
+        for _ in range(3):
+            model_registry.publish_model('m', {}, {})
+
+        versions = [v['version'] for v in model_registry.list_versions('m')]
+        assert first in versions
+        assert model_registry.get_current_version('m') == first
+
+
+class TestRollback:
+    """Test rollback och låsning."""
+
+    def test_rollback_to_previous_and_pin(self, registry):
+        """Rollback ska peka på föregående version och låsa den mot nya publiceringar."""
+        first = model_registry.publish_model('m', {'model.txt': _write_text('v1')}, {})
+        second = model_registry.publish_model('m', {'model.txt': _write_text('v2')}, {})
+        assert model_registry.get_current_version('m') == second
+
+        assert model_registry.rollback('m') == first
+        assert model_registry.get_current('m')['pinned']
+
+        third = model_registry.publish_model('m', {'model.txt': _write_text('v3')}, {})
+        assert model_registry.get_current_version('m') == first
+
+        model_registry.unpin('m')
+        model_registry.set_current('m', third)
+        with open(model_registry.artifact_path('m', 'model.txt')) as f:
+            assert f.read() == 'v3'
+
+    def test_rollback_without_history_fails(self, registry):
+        """Utan tidigare version ska rollback ge ValueError."""
+        model_registry.publish_model('m', {}, {})
+        with pytest.raises(ValueError):
+            model_registry.rollback('m')
+        with pytest.raises(ValueError):
+            model_registry.set_current('m', 'does-not-exist')
@@ -0,0 +1,103 @@
+"""
+Pharmacokinetics Tests
+======================
+Tests för exakt, vektoriserad opioid-AUC och tidsseriekurvor.
+"""
+
+import pytest
+import sys
+import os
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pharmacokinetics as pk
+from config import LÄKEMEDELS_DATA
+
+DOSES = [
+    {'drug_type': 'fentanyl', 'drug_name': 'Fentanyl', 'dose': 100, 'time_relative_minutes': -150},
+    {'drug_type': 'fentanyl', 'drug_name': 'Fentanyl', 'dose': 50, 'time_relative_minutes': -20},
+    {'drug_type': 'oxycodone', 'drug_name': 'Oxikodon', 'dose': 5, 'time_relative_minutes': 30},
+    {'drug_type': 'nsaid', 'drug_name': 'Ibuprofen', 'dose': 400, 'time_relative_minutes': -60},
+    {'drug_type': 'ketamine', 'drug_name': 'Ketamin', 'dose': 20, 'time_relative_minutes': -30},
+    {'drug_type': 'ketamine', 'drug_name': 'Ketamin', 'dose': 20, 'time_relative_minutes': 90},
+]
+
+
+def _numeric_auc(temporal_doses, start, end, step=0.01):
+    """Mittpunktssumma med kvarvarande mängd från skalärfunktionen."""
+    total = 0.0
+    for t in np.arange(start, end, step) + step / 2:
+        for d in temporal_doses:
+            if d['drug_type'] in ('fentanyl', 'oxycodone'):
+                dose = d['dose'] * (15 if d['drug_type'] == 'oxycodone' else 1)
+                total += pk.calculate_fentanyl_remaining_at_time(dose, d['time_relative_minutes'], t) * step
+    return total
+
+
+class TestOpioidAUC:
+    """Test analytisk AUC mot numerisk integration."""
+
+    def test_matches_fine_numeric_integral(self):
+        """Exakt AUC ska stämma med en fin numerisk integral."""
+        assert pk.calculate_total_opioid_auc(DOSES, 120) == pytest.approx(_numeric_auc(DOSES, -180, 120), rel=1e-4)
+
+    def test_windows_are_additive_and_vectorized(self):
+        """Fönster ska kunna delas upp; arrays av fönster ska ge samma värden som enskilda anrop."""
+        starts, ends = np.array([-180, -60, 0]), np.array([-60, 0, 240])
+        aucs = pk.calculate_opioid_auc_windows(DOSES, starts, ends)
+
+        assert aucs.shape == (3,)
+        assert aucs.sum() == pytest.approx(pk.calculate_total_opioid_auc(DOSES, 240))
+        for start, end, auc in zip(starts, ends, aucs):
+            assert auc == pytest.approx(pk.calculate_total_opioid_auc(DOSES, end, start_minutes=start))
+
+    def test_no_opioids_or_window_before_doses(self):
+        assert pk.calculate_total_opioid_auc(DOSES[3:]) == 0.0
+        assert pk.calculate_total_opioid_auc(DOSES, -160, start_minutes=-300) == 0.0
+
+
+class TestTemporalDoseCurves:
+    """Test att kurvorna motsvarar skalärfunktionerna punkt för punkt."""
+
+    def test_curves_match_scalar_functions(self):
+        times = np.arange(-200, 361)
+        curves = pk.calculate_temporal_dose_curves(DOSES, times, LÄKEMEDELS_DATA)
+
+        for i, t in enumerate(times):
+            opioid = sum(
+                pk.calculate_fentanyl_remaining_at_time(d['dose'] * (15 if d['drug_type'] == 'oxycodone' else 1),
+                                                        d['time_relative_minutes'], t)
+                for d in DOSES if d['drug_type'] in ('fentanyl', 'oxycodone'))
+            assert curves['fentanyl_equivalent_mcg'][i] == pytest.approx(opioid)
+            assert curves['adjuvant_reduction_mme'][i] == pytest.approx(
+                pk.calculate_temporal_adjuvant_reduction_at_postop(DOSES, LÄKEMEDELS_DATA, postop_time=t))
+
+        assert set(curves['adjuvant_effects']) == {
+            pk._find_drug_key_from_temporal_entry(d, LÄKEMEDELS_DATA) for d in DOSES[3:]}
+        for key, effect in curves['adjuvant_effects'].items():
+            entries = [d for d in DOSES[3:] if pk._find_drug_key_from_temporal_entry(d, LÄKEMEDELS_DATA) == key]
+            expected = [min(1.0, sum(pk.calculate_adjuvant_effect_at_time(
+                LÄKEMEDELS_DATA[key], d['dose'], d['time_relative_minutes'], t) for d in entries)) for t in times]
+            np.testing.assert_allclose(effect, expected)
+
+    def test_no_doses(self):
+        curves = pk.calculate_temporal_dose_curves([], np.arange(0, 10), LÄKEMEDELS_DATA)
+        assert not curves['fentanyl_equivalent_mcg'].any()
+        assert curves['adjuvant_effects'] == {}
+
+
+class TestDrugKeyResolution:
+    """Test namn/alias-index och upplösning av läkemedelsnycklar."""
+
+    def test_resolve_drug_key(self):
+        assert pk.resolve_drug_key('oxycodone', 'Oxycodon') == 'oxycodone'
+        assert pk.resolve_drug_key('nsaid', 'parecoxib 40mg') == 'parecoxib_40mg'
+        assert pk.resolve_drug_key('ketamine', 'Ketamin') == 'ketamine_small_bolus'
+        assert pk.resolve_drug_key('lidocaine', 'Xylocain') == 'lidocaine_bolus'
+        assert pk.resolve_drug_key('morfin', 'Morfin') is None
+
+    def test_stored_drug_key_is_used(self):
+        """En lagrad drug_key ska användas direkt, utan namnuppslag."""
+        entry = {'drug_type': 'nsaid', 'drug_name': 'Ibuprofen', 'drug_key': 'ketorolac_30mg'}
+        assert pk._find_drug_key_from_temporal_entry(entry, LÄKEMEDELS_DATA) == 'ketorolac_30mg'
@@ -0,0 +1,101 @@
+"""
+Retrain Scheduler Tests
+=======================
+Tests för trösklarna som startar bakgrundsträning.
+"""
+
+import pytest
+import sys
+import os
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database as db
+import retrain_scheduler
+from config import APP_CONFIG
+
+
+@pytest.fixture
+def temp_db(temp_db, tmp_path, monkeypatch):
+    """Temporär databas (conftest) och låsfil; ger en användares id."""
+    monkeypatch.setattr(retrain_scheduler, 'LOCK_PATH', str(tmp_path / 'training.lock'))
+    monkeypatch.setattr(retrain_scheduler, 'SERVING_MODEL_PATH', str(tmp_path / 'missing.serving.joblib'))
+    monkeypatch.setattr(retrain_scheduler.model_registry, 'REGISTRY_DIR', str(tmp_path / 'registry'))
+    monkeypatch.setitem(APP_CONFIG, 'ML_THRESHOLD_PER_PROCEDURE', 5)
+    monkeypatch.setitem(APP_CONFIG, 'RETRAIN_MIN_NEW_CASES', 10)
+    monkeypatch.setitem(APP_CONFIG, 'RETRAIN_MAX_AGE_HOURS', 24)
+    return db.create_user('alice', None)
+
+
+def _finalize(user_id, procedure_id, n):
+    for _ in range(n):
+        case = {'procedure_id': procedure_id, 'age': 50, 'vas': 2}
+        db.finalize_case(db.save_case(case, user_id), case, user_id)
+
+
+class TestRetrainTriggers:
+    """Test globala, per-ingrepp- och åldersbaserade trösklar."""
+
+    def test_no_model_waits_for_threshold(self, temp_db):
+        """Utan modell ska träning starta först vid ML-tröskeln."""
+        _finalize(temp_db, 'proc_a', 4)
+        _finalize(temp_db, 'proc_b', 4)
+        assert retrain_scheduler.pending_retrain_reason(None, None) is None
+        _finalize(temp_db, 'proc_a', 1)
+        assert retrain_scheduler.pending_retrain_reason(None, None) is not None
+
+    def test_thresholds_after_watermark(self, temp_db):
+        """Efter vattenmärket: per-ingrepp-tröskel, global tröskel och max ålder."""
+        _finalize(temp_db, 'proc_a', 3)
+        watermark = db.get_finalized_watermark()
+        trained_at = datetime.now().isoformat()
+
+        _finalize(temp_db, 'proc_b', 1)
+        assert retrain_scheduler.pending_retrain_reason(watermark, trained_at) is None
+        assert 'older than' in retrain_scheduler.pending_retrain_reason(
+            watermark, trained_at, now=datetime.now() + timedelta(hours=25))
+
+        _finalize(temp_db, 'proc_a', 2)
+        assert 'proc_a' in retrain_scheduler.pending_retrain_reason(watermark, trained_at)
+
+        _finalize(temp_db, 'proc_c', 7)
+        assert 'new finalized cases' in retrain_scheduler.pending_retrain_reason(watermark, trained_at)
+
+    def test_edited_cases_are_not_new(self, temp_db):
+        """Ett redan tränat fall som redigeras ska inte räknas som nytt."""
+        case = {'procedure_id': 'proc_a', 'age': 50, 'vas': 2}
+        case_id = db.save_case(case, temp_db)
+        db.finalize_case(case_id, case, temp_db)
+        watermark = db.get_finalized_watermark()
+
+        db.finalize_case(case_id, dict(case, vas=6), temp_db)
+
+        assert db.count_finalized_cases_since(watermark) == {}
+        assert db.count_edited_finalized_cases_since(watermark) == 1
+        new_cases, num_edited, new_watermark = db.get_finalized_cases_since(watermark)
+        assert (new_cases, num_edited) == ([], 1)
+        assert new_watermark > watermark
+
+    def test_lock_prevents_concurrent_training(self, temp_db, monkeypatch):
+        """En pågående träning (låsfil) ska göra att en ny inte startas."""
+        def fail_run(*args, **kwargs):
+            raise AssertionError("training should not start")
+
+        monkeypatch.setattr(retrain_scheduler.subprocess, 'run', fail_run)
+        open(retrain_scheduler.LOCK_PATH, 'w').close()
+
+        assert retrain_scheduler.run_training_subprocess() == -1
+
+    def test_pinned_rollback_skips_training(self, temp_db, monkeypatch):
+        """En låst version efter rollback ska inte ersättas av bakgrundsträning."""
+        def fail_run(*args, **kwargs):
+            raise AssertionError("training should not start")
+
+        monkeypatch.setattr(retrain_scheduler.subprocess, 'run', fail_run)
+        _finalize(temp_db, 'proc_a', 12)
+        version = retrain_scheduler.model_registry.publish_model(
+            'xgboost', {}, {'watermark': None, 'trained_at': datetime.now().isoformat()})
+        retrain_scheduler.model_registry.set_current('xgboost', version, pinned=True)
+
+        assert retrain_scheduler.check_and_retrain() is None
@@ -0,0 +1,154 @@
+"""
+Train Model Tests
+=================
+Tests för full och inkrementell (warm start) träning av XGBoost-modellen.
+"""
+
+import pytest
+import sys
+import os
+import random
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database as db
+import model_registry
+import train_model
+
+
+@pytest.fixture
+def training_env(temp_db, tmp_path, monkeypatch):
+    """Temporär databas (temp_db) och modellfiler."""
+    monkeypatch.setattr(train_model, 'MODEL_PATH', str(tmp_path / 'model.joblib'))
+    monkeypatch.setattr(train_model, 'SERVING_MODEL_PATH', str(tmp_path / 'model.serving.joblib'))
+    monkeypatch.setattr(model_registry, 'REGISTRY_DIR', str(tmp_path / 'registry'))
+    return {'user_id': db.create_user('alice', None), 'rng': random.Random(5)}
+
+
+def _add_finalized_cases(env, n, finalize=True):
+    rng = env['rng']
+    procedure_id = db.get_all_procedures()[0]['id']
+    for _ in range(n):
+        case = {
+            'procedure_id': procedure_id,
+            'specialty': 'Ortopedi',
+            'age': rng.randint(20, 85),
+            'sex': rng.choice(['Man', 'Kvinna']),
+            'weight': rng.uniform(50, 110),
+            'height': 175,
+            'asa': rng.choice(['ASA 1', 'ASA 2', 'ASA 3']),
+            'opioidHistory': 'Opioidnaiv',
+            'nsaid': True,
+            'nsaid_choice': 'Ibuprofen 400mg',
+            'givenDose': rng.uniform(2, 12),
+        }
+        case['vas'] = max(0, min(10, round(8 - case['givenDose'] * 0.6 + rng.gauss(0, 1))))
+        case_id = db.save_case(case, env['user_id'])
+        if finalize:
+            db.finalize_case(case_id, case, env['user_id'])
+
+
+def _encoded(model_and_features, n):
+    cases, _, _ = db.get_finalized_cases_since(None)
+    cases_df = train_model._prepare_cases(cases[:n], train_model._load_procedures_df())
+    X = pd.DataFrame(model_and_features['encoder'].transform_frame(cases_df), columns=model_and_features['features'])
+    return X, cases_df['vas']
+
+
+class TestIncrementalTraining:
+    """Test vattenmärke, warm start och val mellan full/inkrementell träning."""
+
+    def test_full_then_incremental_then_skip(self, training_env):
+        """Nya fall efter vattenmärket ska ge warm start; inga nya fall ska hoppa över träning."""
+        _add_finalized_cases(training_env, 40)
+        full = train_model.train_and_save_model()
+        assert full['mode'] == 'full'
+        first = train_model.load_previous_model()
+
+        _add_finalized_cases(training_env, 5)
+        incremental = train_model.train_and_save_model()
+        second = train_model.load_previous_model()
+
+        assert incremental['mode'] == 'incremental'
+        assert incremental['num_cases'] == 5
+        assert incremental['num_trees'] == full['num_trees'] + train_model.INCREMENTAL_ROUNDS
+        assert second['watermark'] > first['watermark']
+        assert second['last_full_train_at'] == first['last_full_train_at']
+        assert model_registry.get_current_version('xgboost') == incremental['version']
+        assert model_registry.artifact_path('xgboost', train_model.SERVING_MODEL_FILE) is not None
+        assert model_registry.get_manifest('xgboost')['watermark'] == second['watermark']
+        assert not os.path.exists(train_model.MODEL_PATH)
+
+        assert train_model.train_and_save_model()['mode'] == 'skipped'
+
+    def test_edited_trained_case_forces_full_retrain(self, training_env):
+        """Ett redigerat, redan tränat fall ska ge full omträning, inte nya träd på samma fall."""
+        _add_finalized_cases(training_env, 40)
+        train_model.train_and_save_model('full')
+        cases, _, _ = db.get_finalized_cases_since(None)
+        edited = dict(cases[0], vas=10)
+        db.finalize_case(edited['id'], edited, training_env['user_id'])
+        _add_finalized_cases(training_env, 3)
+
+        summary = train_model.train_and_save_model()
+
+        assert summary['mode'] == 'full'
+        assert summary['num_cases'] == 43
+        assert train_model.load_previous_model()['watermark'] == db.get_finalized_watermark()
+
+    def test_full_uses_finalized_cases_and_refreshes_holdout_rmse(self, training_env):
+        """Pågående fall ska inte tränas; baslinjen ska vara utanför träningsdata och följa med."""
+        _add_finalized_cases(training_env, 40)
+        _add_finalized_cases(training_env, 10, finalize=False)
+        full = train_model.train_and_save_model('full')
+        first = train_model.load_previous_model()
+
+        assert full['num_cases'] == 40
+        assert first['holdout_cases'] == 8
+        assert first['holdout_rmse'] > train_model._rmse(first['model'], *_encoded(first, 40))
+
+        _add_finalized_cases(training_env, 5)
+        train_model.train_and_save_model('incremental')
+        second = train_model.load_previous_model()
+
+        assert second['holdout_cases'] == 13
+        assert second['holdout_rmse'] != first['holdout_rmse']
+
+    def test_full_retrain_reasons(self, training_env):
+        """Schemalagd tidpunkt och många nya fall ska kräva full omträning."""
+        _add_finalized_cases(training_env, 40)
+        train_model.train_and_save_model('full')
+        previous = train_model.load_previous_model()
+        new_cases, _, _ = db.get_finalized_cases_since(None)
+        procedures_df = train_model._load_procedures_df()
+        few = train_model._prepare_cases(new_cases[:5], procedures_df)
+
+        assert train_model.full_retrain_reason(previous, few) is None
+        assert 'many new cases' in train_model.full_retrain_reason(
+            previous, train_model._prepare_cases(new_cases, procedures_df))
+        assert 'scheduled' in train_model.full_retrain_reason(
+            dict(previous, last_full_train_at='2000-01-01T00:00:00'), few)
+
+
+class TestHyperparameterSearch:
+    """Test parallell gridsökning med early stopping."""
+
+    def test_parallel_matches_serial(self, monkeypatch, capsys):
+        """Processpool och seriell körning ska välja samma konfiguration."""
+        monkeypatch.setattr(train_model, 'SEARCH_GRID', {'max_depth': [2, 4], 'learning_rate': [0.1], 'subsample': [1.0]})
+        monkeypatch.setattr(train_model, 'SEARCH_MAX_ESTIMATORS', 60)
+        rng = np.random.RandomState(0)
+        X = pd.DataFrame(rng.rand(60, 3), columns=['givenDose', 'age', 'weight'])
+        y = 8 - X['givenDose'] * 6 + rng.normal(0, 0.2, 60)
+        weights = np.ones(60)
+
+        serial = train_model.search_hyperparameters(X, y, weights, n_jobs=1)
+        parallel = train_model.search_hyperparameters(X, y, weights, n_jobs=2)
+
+        assert serial == parallel
+        output = capsys.readouterr().out
+        assert output.count(' s wall, ') == 2 and 'x parallel on 2 processes' in output
+        assert 1 <= serial['n_estimators'] <= 60
+        assert serial['max_depth'] in (2, 4)
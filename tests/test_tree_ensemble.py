@@ -0,0 +1,72 @@
+"""
+Tree Ensemble Tests
+===================
+Tests för array-exporterad XGBoost-ensemble och att serving inte kräver xgboost.
+"""
+
+import pytest
+import sys
+import os
+import subprocess
+import joblib
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from tree_ensemble import export_xgboost_model
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def _train(max_depth=4, n_estimators=40, seed=0):
+    rng = np.random.RandomState(seed)
+    X = pd.DataFrame(rng.rand(300, 5), columns=['givenDose', 'age', 'weight', 'asa_ASA 3', 'pain_mismatch_3d'])
+    X.loc[rng.rand(300) < 0.1, 'weight'] = np.nan
+    y = 8 - X['givenDose'] * 6 + X['age'] * 2 + rng.normal(0, 0.3, 300)
+    model = xgb.XGBRegressor(n_estimators=n_estimators, max_depth=max_depth, learning_rate=0.1,
+                             subsample=0.8, colsample_bytree=0.8, random_state=42)
+    model.fit(X, y)
+    return model, X
+
+
+class TestTreeEnsemble:
+    """Test att exporten ger samma prediktioner som xgboost."""
+
+    @pytest.mark.parametrize('max_depth', [1, 3, 6])
+    def test_matches_xgboost_predict(self, max_depth):
+        """Batchprediktion ska matcha model.predict, även med saknade värden."""
+        model, X = _train(max_depth=max_depth)
+        ensemble = export_xgboost_model(model, list(X.columns))
+
+        X_test = X.copy()
+        X_test.iloc[:20, 2] = np.nan
+        np.testing.assert_allclose(ensemble.predict(X_test.to_numpy()), model.predict(X_test), rtol=1e-5, atol=1e-5)
+
+    def test_single_row_and_importances(self):
+        """En enskild rad ska fungera och feature importance följa med exporten."""
+        model, X = _train(n_estimators=5)
+        ensemble = export_xgboost_model(model, list(X.columns))
+
+        assert ensemble.predict(X.to_numpy()[0]).shape == (1,)
+        np.testing.assert_allclose(ensemble.feature_importances_, model.feature_importances_)
+
+    def test_serving_does_not_import_xgboost(self, tmp_path):
+        """ml_model ska kunna ladda serving-exporten och predicera utan xgboost."""
+        model, X = _train(n_estimators=5)
+        ensemble = export_xgboost_model(model, list(X.columns))
+        serving_path = tmp_path / 'serving.joblib'
+        joblib.dump({'model': ensemble, 'features': list(X.columns)}, serving_path)
+
+        script = (
+            "import sys, numpy as np\n"
+            "import ml_model\n"
+            f"ml_model.SERVING_MODEL_PATH = {str(serving_path)!r}\n"
+            "loaded = ml_model.get_model()\n"
+            "vas = ml_model.predict_dose_response(loaded.model, loaded.features, np.zeros(5), np.arange(0, 20.5, 0.5))\n"
+            "assert len(vas) == 41\n"
+            "assert 'xgboost' not in sys.modules, 'xgboost was imported'\n"
+        )
+        result = subprocess.run([sys.executable, '-c', script], cwd=PROJECT_ROOT, capture_output=True, text=True)
+        assert result.returncode == 0, result.stderr
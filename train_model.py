@@ -3,119 +3,466 @@ import pandas as pd
 import xgboost as xgb
 import numpy as np
 import database as db
-from feature_engineering import add_engineered_features
+from feature_engineering import add_engineered_features, ENCODE_COLUMNS, fit_feature_encoder
+from tree_ensemble import export_xgboost_model
+import model_registry
 import joblib
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Optional
 
-def train_and_save_model():
+# Modeller publiceras i model_registry; de fasta sökvägarna läses bara från äldre installationer
+REGISTRY_NAME = 'xgboost'
+MODEL_FILE = 'model.joblib'
+SERVING_MODEL_FILE = 'model.serving.joblib'
+MODEL_PATH = 'xgboost_model.joblib'
+SERVING_MODEL_PATH = 'xgboost_model.serving.joblib'
+
+# Inkrementell träning: fortsätt boosta från föregående modell med nya slutförda fall
+INCREMENTAL_ROUNDS = 20          # Nya träd per inkrementell körning
+MAX_TOTAL_TREES = 400            # Fler träd än så -> full omträning
+FULL_RETRAIN_INTERVAL_DAYS = 7   # Schemalagd full omträning
+DRIFT_RMSE_RATIO = 2.0           # Föregående modells RMSE på nya fall / hållen-ute-RMSE
+HOLDOUT_FRACTION = 0.2           # Andel fall som hålls utanför för RMSE-baslinjen vid full träning
+HOLDOUT_MIN_CASES = 30           # Färre fall -> ingen baslinje (driftkontrollen hoppas över)
+DRIFT_NEW_CASE_FRACTION = 0.5    # Många nya fall relativt träningsmängden -> full omträning
+
+# Hyperparametersökning (från 30 fall)
+SEARCH_GRID = {
+    'max_depth': [2, 3, 4, 5],
+    'learning_rate': [0.05, 0.1],
+    'subsample': [0.8, 1.0],
+}
+SEARCH_MAX_ESTIMATORS = 300         # Tak; early stopping väljer faktiskt antal träd
+SEARCH_EARLY_STOPPING_ROUNDS = 20
+SEARCH_EARLY_STOPPING_FRACTION = 0.2  # Andel av träningsfolden för early stopping (valideringsfolden poängsätts separat)
+SEARCH_N_JOBS = None                # None = alla kärnor
+
+EXCLUDE_COLS = [
+    # Target and outcome variables
+    'vas', 'uvaDose', 'postop_reason', 'respiratory_status', 'severe_fatigue',
+    'rescue_early', 'rescue_late',
+    # Identifiers and metadata
+    'id', 'user_id', 'procedure_id', 'timestamp', 'last_modified', 'last_modified_by',
+    'finalized_seq', 'change_seq',
+    'compositeKey', 'engine', 'calculation', 'procedure_name', 'created_by',
+    # Redundant or raw data
+    'outcome', 'raw_input', 'edit_history'
+]
+
+# _row_to_case_dict döper om några kolumner; inferens använder get_current_inputs-namnen
+CASE_COLUMN_RENAMES = {'surgeryType': 'surgery_type', 'optimeMinutes': 'optime_minutes', 'kvaCode': 'kva_code'}
+
+
+def _load_procedures_df() -> pd.DataFrame:
+    return pd.DataFrame(db.get_all_procedures() + db.get_all_custom_procedures())
+
+
+def _prepare_cases(cases, procedures_df: pd.DataFrame) -> pd.DataFrame:
+    """Fall (dicts) -> DataFrame med inferensens kolumnnamn och engineered features."""
+    cases_df = pd.DataFrame(cases).rename(columns=CASE_COLUMN_RENAMES)
+    cases_df['asa'] = cases_df['asa'].astype(str)
+    return add_engineered_features(cases_df, procedures_df)
+
+
+def _sample_weights(cases_df: pd.DataFrame) -> np.ndarray:
+    # Handle outliers
+    outlier_mask = (cases_df['vas'] > 8) | (cases_df['uvaDose'] > 15)
+    return np.where(outlier_mask, 0.5, 1.0)
+
+
+def _rmse(model, X: pd.DataFrame, y) -> float:
+    return float(np.sqrt(np.mean((model.predict(X) - np.asarray(y, dtype=float)) ** 2)))
+
+
+def _holdout_rmse(params: dict, X: pd.DataFrame, y, sample_weights) -> Optional[float]:
     """
-    This script loads all data, trains the XGBoost model, and saves it to a file.
+    RMSE på fall som modellen inte tränats på (baslinje för driftkontrollen).
+
+    En separat modell med samma parametrar tränas på (1 - HOLDOUT_FRACTION)
+    av fallen och utvärderas på resten.
+
+    Returns:
+        RMSE, eller None under HOLDOUT_MIN_CASES fall
     """
-    print("Starting model training...")
+    if len(X) < HOLDOUT_MIN_CASES:
+        return None
+    order = np.random.RandomState(42).permutation(len(X))
+    num_holdout = max(1, int(len(X) * HOLDOUT_FRACTION))
+    holdout_idx, fit_idx = order[:num_holdout], order[num_holdout:]
+    y = np.asarray(y, dtype=float)
+    model = xgb.XGBRegressor(**params)
+    model.fit(X.iloc[fit_idx], y[fit_idx], sample_weight=np.asarray(sample_weights)[fit_idx])
+    return _rmse(model, X.iloc[holdout_idx], y[holdout_idx])
 
-    # 1. Load data
-    print("Loading data from database...")
-    all_cases = db.get_all_cases(user_id=None)
-    if not all_cases:
-        print("No cases found in the database. Aborting training.")
-        return
 
-    cases_df = pd.DataFrame(all_cases)
-    all_procedures = db.get_all_procedures() + db.get_all_custom_procedures()
-    procedures_df = pd.DataFrame(all_procedures)
-    print(f"Loaded {len(cases_df)} cases and {len(procedures_df)} procedures.")
+def _pooled_rmse(rmse_a: Optional[float], n_a: int, rmse_b: float, n_b: int) -> float:
+    """Sammanslagen RMSE för två fallmängder (viktad på antal fall)."""
+    if rmse_a is None or n_a <= 0:
+        return rmse_b
+    return float(np.sqrt((n_a * rmse_a ** 2 + n_b * rmse_b ** 2) / (n_a + n_b)))
 
-    # 2. Feature Engineering using the centralized function
-    print("Performing feature engineering...")
-    cases_df['asa'] = cases_df['asa'].astype(str)
-    cases_df = add_engineered_features(cases_df, procedures_df)
-
-    # One-hot encode categorical variables
-    encode_cols = ['specialty', 'opioidHistory', 'asa', 'nsaid_choice', 'ketamine_choice',
-                    'lidocaine', 'betapred', 'sex', 'surgery_type']
-    cases_encoded = pd.get_dummies(cases_df, columns=encode_cols, drop_first=True)
-
-    # Define target and features. CRITICAL: 'givenDose' is now a feature.
-    y_train = cases_encoded['vas']
-    
-    exclude_cols = [
-        # Target and outcome variables
-        'vas', 'uvaDose', 'postop_reason', 'respiratory_status', 'severe_fatigue', 
-        'rescue_early', 'rescue_late',
-        # Identifiers and metadata
-        'id', 'user_id', 'procedure_id', 'timestamp', 'last_modified', 'last_modified_by',
-        'compositeKey', 'engine', 'calculation', 'procedure_name', 'created_by',
-        # Redundant or raw data
-        'outcome', 'raw_input', 'edit_history'
+
+_search_data = None  # (X, y, weights, feature_names) i varje sökprocess
+
+
+def _fold_worker_init(X: np.ndarray, y: np.ndarray, weights: np.ndarray, feature_names):
+    global _search_data
+    _search_data = (X, y, weights, feature_names)
+
+
+def _evaluate_fold(task):
+    """
+    Träna en konfiguration på en fold med early stopping (körs i poolens processer).
+
+    Early stopping väljer antal träd på en inre del av träningsfolden, och
+    MSE mäts på valideringsfolden som varken tränat eller valt antal träd.
+
+    Returns:
+        (config_index, mse, best_iteration, start, slut, cpu-sekunder) där
+        start/slut är time.time()-stämplar, jämförbara mellan poolens processer
+    """
+    config_index, params, fit_idx, stop_idx, val_idx = task
+    X, y, weights, feature_names = _search_data
+    start, cpu_start = time.time(), time.process_time()
+    model = xgb.XGBRegressor(**params, n_estimators=SEARCH_MAX_ESTIMATORS,
+                             early_stopping_rounds=SEARCH_EARLY_STOPPING_ROUNDS, eval_metric='rmse', n_jobs=1)
+    X_fit = pd.DataFrame(X[fit_idx], columns=feature_names)
+    X_stop = pd.DataFrame(X[stop_idx], columns=feature_names)
+    X_val = pd.DataFrame(X[val_idx], columns=feature_names)
+    model.fit(X_fit, y[fit_idx], sample_weight=weights[fit_idx], eval_set=[(X_stop, y[stop_idx])], verbose=False)
+    mse = float(np.mean((model.predict(X_val) - y[val_idx]) ** 2))
+    return config_index, mse, int(model.best_iteration), start, time.time(), time.process_time() - cpu_start
+
+
+def search_hyperparameters(X_train: pd.DataFrame, y_train, sample_weights, n_jobs: int = None) -> dict:
+    """
+    Parallell gridsökning över max_depth, learning_rate och subsample.
+
+    Varje (konfiguration, fold) tränas som ett eget jobb i en processpool med
+    early stopping på en inre del av träningsfolden och poängsätts på
+    valideringsfolden; antal träd väljs som medelvärdet av foldernas bästa
+    iteration. Per konfiguration skrivs väggklocktid (första start till sista
+    slut bland dess folder) och summerad CPU-tid ut; kvoten mellan all CPU-tid
+    och sökningens väggklocktid visar den uppnådda parallelliteten.
+
+    Args:
+        X_train, y_train, sample_weights: Träningsdata
+        n_jobs: Antal processer (default SEARCH_N_JOBS eller antal kärnor)
+
+    Returns:
+        Parametrar för XGBRegressor, inklusive n_estimators
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from itertools import product
+    from sklearn.model_selection import KFold
+
+    num_cases = len(X_train)
+    n_splits = min(5, num_cases // 6 if num_cases // 6 > 1 else 2)
+    folds = list(KFold(n_splits=n_splits, shuffle=True, random_state=42).split(X_train))
+    configs = [
+        {'objective': 'reg:squarederror', 'max_depth': depth, 'learning_rate': rate,
+         'subsample': subsample, 'colsample_bytree': 0.8, 'random_state': 42}
+        for depth, rate, subsample in product(*SEARCH_GRID.values())
     ]
-    
-    features = [col for col in cases_encoded.columns if col not in exclude_cols]
-    X_train = cases_encoded[features]
+    # Samma inre early stopping-del för alla konfigurationer i en fold
+    rng = np.random.RandomState(42)
+    splits = []
+    for train_idx, val_idx in folds:
+        shuffled = rng.permutation(train_idx)
+        num_stop = max(1, int(len(shuffled) * SEARCH_EARLY_STOPPING_FRACTION))
+        splits.append((shuffled[num_stop:], shuffled[:num_stop], val_idx))
+    tasks = [(i, config, fit_idx, stop_idx, val_idx)
+             for i, config in enumerate(configs) for fit_idx, stop_idx, val_idx in splits]
+    init_args = (X_train.to_numpy(dtype=float), np.asarray(y_train, dtype=float),
+                 np.asarray(sample_weights, dtype=float), list(X_train.columns))
 
-    # Handle outliers
-    outlier_mask = (cases_encoded['vas'] > 8) | (cases_encoded['uvaDose'] > 15)
-    sample_weights = np.where(outlier_mask, 0.5, 1.0)
+    n_jobs = n_jobs or SEARCH_N_JOBS or os.cpu_count() or 1
+    print(f"Optimizing hyperparameters: {len(configs)} configs x {n_splits} folds on {n_jobs} processes...")
+    search_start = time.time()
+    if n_jobs == 1:
+        _fold_worker_init(*init_args)
+        results = [_evaluate_fold(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_fold_worker_init, initargs=init_args) as pool:
+            results = list(pool.map(_evaluate_fold, tasks))
+
+    scores = {}
+    for config_index, mse, best_iteration, start, end, cpu_seconds in results:
+        entry = scores.setdefault(config_index, {'mse': [], 'iterations': [], 'starts': [], 'ends': [], 'cpu': 0.0})
+        entry['mse'].append(mse)
+        entry['iterations'].append(best_iteration)
+        entry['starts'].append(start)
+        entry['ends'].append(end)
+        entry['cpu'] += cpu_seconds
+
+    for i, config in enumerate(configs):
+        entry = scores[i]
+        print(f"  depth={config['max_depth']} lr={config['learning_rate']} subsample={config['subsample']}: "
+              f"MSE {np.mean(entry['mse']):.3f}, trees {int(np.mean(entry['iterations'])) + 1}, "
+              f"wall {max(entry['ends']) - min(entry['starts']):.2f} s, "
+              f"cpu {entry['cpu']:.2f} s")
+
+    best_index = min(scores, key=lambda i: np.mean(scores[i]['mse']))
+    best = dict(configs[best_index], n_estimators=int(np.mean(scores[best_index]['iterations'])) + 1)
+    search_seconds = time.time() - search_start
+    cpu_seconds = sum(result[5] for result in results)
+    print(f"Best config: {best} (search took {search_seconds:.1f} s wall, {cpu_seconds:.1f} s cpu, "
+          f"{cpu_seconds / max(search_seconds, 1e-9):.1f}x parallel on {n_jobs} processes)")
+    return best
+
+
+def _choose_hyperparameters(X_train: pd.DataFrame, y_train, num_cases: int, sample_weights=None) -> dict:
+    """Fasta parametrar efter datamängd under 30 fall, annars parallell gridsökning."""
+    if num_cases >= 30:
+        weights = sample_weights if sample_weights is not None else np.ones(num_cases)
+        return search_hyperparameters(X_train, y_train, weights)
 
-    # 3. Train the XGBoost model
-    print("Training XGBoost model...")
-    num_cases = len(cases_df)
     if num_cases < 10:
         xgb_learning_rate = 0.15
         xgb_n_estimators = 50
-    elif num_cases < 30:
+    else:
         xgb_learning_rate = 0.10
         xgb_n_estimators = 75
-    else:
-        xgb_learning_rate = 0.05
-        xgb_n_estimators = 100
 
-    best_max_depth = 3 # Default value
-    if num_cases >= 30:
-        from sklearn.model_selection import cross_val_score
-        best_score = -np.inf
-
-        print("Optimizing hyperparameters...")
-        for max_depth in [2, 3, 4, 5]:
-            temp_model = xgb.XGBRegressor(
-                objective='reg:squarederror',
-                n_estimators=xgb_n_estimators,
-                learning_rate=xgb_learning_rate,
-                max_depth=max_depth,
-                random_state=42,
-                subsample=0.8,
-                colsample_bytree=0.8
-            )
-            # Ensure there are enough samples for CV
-            n_splits = min(5, num_cases // 6 if num_cases // 6 > 1 else 2)
-            if n_splits > 1:
-                cv_scores = cross_val_score(temp_model, X_train, y_train, cv=n_splits,
-                                            scoring='neg_mean_squared_error')
-                mean_score = cv_scores.mean()
-                if mean_score > best_score:
-                    best_score = mean_score
-                    best_max_depth = max_depth
-        print(f"Best max_depth found: {best_max_depth}")
-
-    model = xgb.XGBRegressor(
-        objective='reg:squarederror',
-        n_estimators=xgb_n_estimators,
-        learning_rate=xgb_learning_rate,
-        max_depth=best_max_depth,
-        random_state=42,
-        subsample=0.8,
-        colsample_bytree=0.8
-    )
+    return {
+        'objective': 'reg:squarederror',
+        'n_estimators': xgb_n_estimators,
+        'learning_rate': xgb_learning_rate,
+        'max_depth': 3,
+        'random_state': 42,
+        'subsample': 0.8,
+        'colsample_bytree': 0.8
+    }
+
+
+def _save_model(model_and_features: dict) -> str:
+    """
+    Publicera fullständig modell och serving-export som en ny version i model_registry.
+
+    Returns:
+        Den nya versionens id
+    """
+    # Array-baserad export för serving: ml_model kan då predicera utan att importera xgboost
+    serving_model = dict(model_and_features,
+                         model=export_xgboost_model(model_and_features['model'], model_and_features['features']))
+    manifest = {
+        'watermark': model_and_features.get('watermark'),
+        'trained_at': model_and_features.get('trained_at'),
+        'last_full_train_at': model_and_features.get('last_full_train_at'),
+        'metrics': {'holdout_rmse': model_and_features.get('holdout_rmse'),
+                    'num_cases': model_and_features.get('num_cases'),
+                    'num_trees': model_and_features['model'].get_booster().num_boosted_rounds()},
+        'features': list(model_and_features['features']),
+        'params': model_and_features.get('params'),
+    }
+    version = model_registry.publish_model(REGISTRY_NAME, {
+        MODEL_FILE: lambda path: joblib.dump(model_and_features, path),
+        SERVING_MODEL_FILE: lambda path: joblib.dump(serving_model, path),
+    }, manifest)
+    print(f"Model saved successfully as {REGISTRY_NAME} version {version}")
+    return version
+
+
+def load_previous_model():
+    """Aktuell sparad modell (dict) eller None om den saknas/inte kan läsas."""
+    path = model_registry.artifact_path(REGISTRY_NAME, MODEL_FILE)
+    if path is None:
+        path = MODEL_PATH if os.path.exists(MODEL_PATH) else None
+    if path is None:
+        return None
+    try:
+        return joblib.load(path)
+    except Exception as e:
+        print(f"Could not load previous model: {e}")
+        return None
+
+
+def full_retrain_reason(previous, new_cases_df: pd.DataFrame, X_new: pd.DataFrame = None):
+    """
+    Avgör om en full omträning krävs i stället för inkrementell.
+
+    Returns:
+        Orsak (str) eller None om inkrementell träning räcker
+    """
+    if previous is None:
+        return "no previous model"
+    if previous.get('encoder') is None or previous.get('watermark') is None:
+        return "previous model lacks encoder/watermark"
+    if not isinstance(previous['watermark'], int):
+        return "previous model has a timestamp watermark"
+
+    last_full = previous.get('last_full_train_at')
+    if last_full is None or datetime.now() - datetime.fromisoformat(last_full) >= timedelta(days=FULL_RETRAIN_INTERVAL_DAYS):
+        return f"scheduled ({FULL_RETRAIN_INTERVAL_DAYS} days since last full retrain)"
+
+    num_trees = previous['model'].get_booster().num_boosted_rounds()
+    if num_trees + INCREMENTAL_ROUNDS > MAX_TOTAL_TREES:
+        return f"tree limit ({num_trees} trees)"
+
+    if len(new_cases_df) > DRIFT_NEW_CASE_FRACTION * previous.get('num_cases', 0):
+        return f"many new cases ({len(new_cases_df)} vs {previous.get('num_cases', 0)} trained)"
+
+    unseen = previous['encoder'].unseen_categories(new_cases_df)
+    if unseen:
+        return f"new categories {unseen}"
+
+    if X_new is not None and previous.get('holdout_rmse'):
+        new_rmse = _rmse(previous['model'], X_new, new_cases_df['vas'])
+        if new_rmse > DRIFT_RMSE_RATIO * previous['holdout_rmse']:
+            return f"drift (RMSE {new_rmse:.2f} vs {previous['holdout_rmse']:.2f} held out)"
+
+    return None
+
+
+def train_full(procedures_df: pd.DataFrame = None) -> dict:
+    """
+    Träna om från början på alla slutförda fall och spara modellen.
+
+    Returns:
+        Sammanfattning (mode, num_cases, ...) eller {'mode': 'skipped'} utan fall
+    """
+    # 1. Load data: samma urval som vattenmärket (FINALIZED), så inget fall boostas två gånger
+    print("Loading data from database...")
+    all_cases, _, watermark = db.get_finalized_cases_since(None)
+    if not all_cases:
+        print("No finalized cases found in the database. Aborting training.")
+        return {'mode': 'skipped', 'reason': 'no cases'}
+
+    if procedures_df is None:
+        procedures_df = _load_procedures_df()
+    print(f"Loaded {len(all_cases)} cases and {len(procedures_df)} procedures.")
+
+    # 2. Feature Engineering using the centralized function
+    print("Performing feature engineering...")
+    cases_df = _prepare_cases(all_cases, procedures_df)
+
+    # One-hot encode categorical variables; only numeric columns can be model features
+    cases_encoded = pd.get_dummies(cases_df, columns=[col for col in ENCODE_COLUMNS if col in cases_df.columns],
+                                   drop_first=True)
+    features = [col for col in cases_encoded.select_dtypes(include=['number', 'bool']).columns
+                if col not in EXCLUDE_COLS]
+
+    # Kategorivokabulär, kolumnordning och defaults för snabb kodning vid inferens
+    encoder = fit_feature_encoder(cases_df, features)
+    X_train = pd.DataFrame(encoder.transform_frame(cases_df), columns=features)
+    y_train = cases_df['vas']
+    sample_weights = _sample_weights(cases_df)
+
+    # 3. Train the XGBoost model
+    print("Training XGBoost model...")
+    params = _choose_hyperparameters(X_train, y_train, len(cases_df), sample_weights)
+    holdout_rmse = _holdout_rmse(params, X_train, y_train, sample_weights)
+    model = xgb.XGBRegressor(**params)
     model.fit(X_train, y_train, sample_weight=sample_weights)
     print("Model training complete.")
 
     # 4. Save the model and features
-    print("Saving model and features to file...")
-    model_and_features = {
+    now = datetime.now().isoformat()
+    version = _save_model({
         'model': model,
-        'features': X_train.columns.tolist()
-    }
-    joblib.dump(model_and_features, 'xgboost_model.joblib')
-    print("Model saved successfully to xgboost_model.joblib")
+        'features': features,
+        'encoder': encoder,
+        'params': params,
+        'watermark': watermark,
+        'num_cases': len(cases_df),
+        'holdout_rmse': holdout_rmse,
+        'holdout_cases': int(len(cases_df) * HOLDOUT_FRACTION) if holdout_rmse is not None else 0,
+        'trained_at': now,
+        'last_full_train_at': now
+    })
+    return {'mode': 'full', 'num_cases': len(cases_df), 'num_trees': model.get_booster().num_boosted_rounds(),
+            'version': version}
+
+
+def train_incremental(previous: dict, new_cases_df: pd.DataFrame, X_new: pd.DataFrame, new_watermark: str) -> dict:
+    """
+    Fortsätt boosta föregående modell (xgb_model warm start) med enbart nya fall.
+
+    Encoder, features och hyperparametrar återanvänds från föregående modell.
+    De nya fallen är osedda för föregående modell; dess fel på dem slås ihop
+    med baslinjen, så holdout_rmse förblir ett mått utanför träningsdata.
+
+    Args:
+        previous: Föregående sparade modell (från load_previous_model)
+        new_cases_df: Nya slutförda fall efter _prepare_cases
+        X_new: new_cases_df kodad med föregående modells encoder
+        new_watermark: Vattenmärke efter de nya fallen (change_seq)
+    """
+    new_rmse = _rmse(previous['model'], X_new, new_cases_df['vas'])
+    params = dict(previous.get('params') or previous['model'].get_params(), n_estimators=INCREMENTAL_ROUNDS)
+    model = xgb.XGBRegressor(**params)
+    model.fit(X_new, new_cases_df['vas'], sample_weight=_sample_weights(new_cases_df),
+              xgb_model=previous['model'].get_booster())
+
+    version = _save_model(dict(
+        previous,
+        model=model,
+        watermark=new_watermark,
+        num_cases=previous.get('num_cases', 0) + len(new_cases_df),
+        holdout_rmse=_pooled_rmse(previous.get('holdout_rmse'), previous.get('holdout_cases', 0),
+                                  new_rmse, len(new_cases_df)),
+        holdout_cases=previous.get('holdout_cases', 0) + len(new_cases_df),
+        trained_at=datetime.now().isoformat()
+    ))
+    return {'mode': 'incremental', 'num_cases': len(new_cases_df), 'num_trees': model.get_booster().num_boosted_rounds(),
+            'version': version}
+
+
+def train_and_save_model(mode: str = 'auto') -> dict:
+    """
+    Träna XGBoost-modellen och spara den till fil.
+
+    Args:
+        mode: 'full' (alltid omträning), 'incremental' (warm start om möjligt)
+              eller 'auto' (inkrementell om ingen drift/schemaläggning kräver full)
+
+    Returns:
+        Sammanfattning med 'mode' ('full', 'incremental' eller 'skipped') och 'duration_s'
+    """
+    print("Starting model training...")
+    start = time.perf_counter()
+
+    if mode == 'full':
+        summary = train_full()
+    else:
+        previous = load_previous_model()
+        summary = None
+        if previous is not None and isinstance(previous.get('watermark'), int):
+            new_cases, num_edited, new_watermark = db.get_finalized_cases_since(previous['watermark'])
+            if num_edited:
+                # Redan tränade fall har ändrats: de gamla träden passar deras gamla utfall
+                print(f"Full retrain: {num_edited} trained cases edited since last training")
+                summary = train_full()
+            elif not new_cases:
+                print("No newly finalized cases since last training. Model is up to date.")
+                summary = {'mode': 'skipped', 'reason': 'no new cases'}
+            else:
+                procedures_df = _load_procedures_df()
+                new_cases_df = _prepare_cases(new_cases, procedures_df)
+                X_new = None
+                if previous.get('encoder') is not None:
+                    X_new = pd.DataFrame(previous['encoder'].transform_frame(new_cases_df), columns=previous['features'])
+                reason = None if mode == 'incremental' else full_retrain_reason(previous, new_cases_df, X_new)
+                if reason is None and X_new is not None:
+                    print(f"Incremental training on {len(new_cases)} new cases...")
+                    summary = train_incremental(previous, new_cases_df, X_new, new_watermark)
+                else:
+                    print(f"Full retrain: {reason or 'previous model lacks encoder'}")
+                    summary = train_full(procedures_df)
+        if summary is None:
+            summary = train_full()
+
+    summary['duration_s'] = time.perf_counter() - start
+    print(f"Training finished ({summary['mode']}) in {summary['duration_s']:.1f} s")
+    return summary
 
 if __name__ == "__main__":
     db.init_database()
-    train_and_save_model()
+    if '--low-priority' in sys.argv and hasattr(os, 'nice'):
+        os.nice(19)  # Bakgrundsträning (retrain_scheduler) ska inte konkurrera med appen
+    if '--jobs' in sys.argv:
+        SEARCH_N_JOBS = int(sys.argv[sys.argv.index('--jobs') + 1])
+    train_and_save_model('full' if '--full' in sys.argv else 'incremental' if '--incremental' in sys.argv else 'auto')
@@ -0,0 +1,145 @@
+"""
+Tree Ensemble - Array-baserad utvärdering av tränade XGBoost-modeller
+====================================================================
+train_model.py exporterar boostern till platta NumPy-arrayer (feature,
+tröskel, barnnoder, default-riktning vid saknat värde och lövvärden per nod).
+Serving-sidan utvärderar dem vektoriserat för en hel batch rader och behöver
+därför varken importera eller avserialisera xgboost.
+
+Alla träd paddas till samma antal noder: arrays har formen (n_trees, max_nodes).
+"""
+
+import json
+from dataclasses import dataclass
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+LEAF = -1  # feature-index för lövnoder
+
+
+@dataclass(frozen=True)
+class TreeEnsemble:
+    """
+    Exporterad trädensemble för regression (reg:squarederror).
+
+    Prediktion = base_score + summan av ett lövvärde per träd. Splittar följer
+    xgboost: vänster (yes) om x < threshold, missing-grenen om x är NaN.
+    """
+    feature: np.ndarray      # int32, LEAF för löv
+    threshold: np.ndarray    # float32
+    yes: np.ndarray          # int32, barnnod om x < threshold
+    no: np.ndarray           # int32, barnnod annars
+    missing: np.ndarray      # int32, barnnod om x saknas
+    value: np.ndarray        # float32, lövvärde (0 för interna noder)
+    base_score: float
+    max_depth: int
+    features: List[str]
+    feature_importances_: Optional[np.ndarray] = None
+
+    def predict(self, X) -> np.ndarray:
+        """
+        Predicera en batch rader.
+
+        Args:
+            X: Matris (n_rows, n_features) i features-ordning (ndarray eller DataFrame)
+
+        Returns:
+            Prediktioner (n_rows,)
+        """
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X[np.newaxis, :]
+        n_rows, n_trees = X.shape[0], self.feature.shape[0]
+
+        trees = np.arange(n_trees)[np.newaxis, :]
+        rows = np.arange(n_rows)[:, np.newaxis]
+        node = np.zeros((n_rows, n_trees), dtype=np.int32)
+
+        for _ in range(self.max_depth):
+            feature = self.feature[trees, node]
+            internal = feature != LEAF
+            if not internal.any():
+                break
+            x = X[rows, np.where(internal, feature, 0)]
+            child = np.where(x < self.threshold[trees, node], self.yes[trees, node], self.no[trees, node])
+            child = np.where(np.isnan(x), self.missing[trees, node], child)
+            node = np.where(internal, child, node)
+
+        return self.value[trees, node].sum(axis=1, dtype=np.float64) + self.base_score
+
+
+def _base_score(booster) -> float:
+    """Läs base_score ur boosterns konfiguration (formatet skiljer mellan xgboost-versioner)."""
+    params = json.loads(booster.save_config())['learner']['learner_model_param']
+    return float(params['base_score'].strip('[]').split(',')[0])
+
+
+def _feature_index(name: str, features: Sequence[str]) -> int:
+    if name in features:
+        return features.index(name)
+    # Modeller tränade utan kolumnnamn använder f0, f1, ...
+    return int(name[1:])
+
+
+def export_xgboost_model(model, features: Sequence[str]) -> TreeEnsemble:
+    """
+    Exportera en tränad XGBRegressor till en TreeEnsemble.
+
+    Körs vid träning (kräver xgboost och pandas); resultatet kan pickle:as utan
+    referenser till xgboost.
+
+    Args:
+        model: Tränad xgboost.XGBRegressor
+        features: Kolumnordning som modellen tränades med
+
+    Returns:
+        TreeEnsemble som ger samma prediktioner som model.predict
+    """
+    features = list(features)
+    booster = model.get_booster()
+    trees_df = booster.trees_to_dataframe()
+
+    best_iteration = getattr(model, 'best_iteration', None)
+    if best_iteration is not None:
+        trees_df = trees_df[trees_df['Tree'] <= best_iteration]
+
+    n_trees = int(trees_df['Tree'].max()) + 1
+    max_nodes = int(trees_df['Node'].max()) + 1
+
+    feature = np.full((n_trees, max_nodes), LEAF, dtype=np.int32)
+    threshold = np.zeros((n_trees, max_nodes), dtype=np.float32)
+    yes = np.zeros((n_trees, max_nodes), dtype=np.int32)
+    no = np.zeros((n_trees, max_nodes), dtype=np.int32)
+    missing = np.zeros((n_trees, max_nodes), dtype=np.int32)
+    value = np.zeros((n_trees, max_nodes), dtype=np.float32)
+    depth = np.zeros((n_trees, max_nodes), dtype=np.int32)
+
+    def node_index(node_id: str) -> int:
+        return int(node_id.split('-')[1])
+
+    # Noder listas i bredden-först-ordning per träd: föräldrar före barn
+    for row in trees_df.itertuples(index=False):
+        t, n = int(row.Tree), int(row.Node)
+        if row.Feature == 'Leaf':
+            value[t, n] = row.Gain
+            continue
+        feature[t, n] = _feature_index(row.Feature, features)
+        threshold[t, n] = row.Split
+        yes[t, n], no[t, n], missing[t, n] = node_index(row.Yes), node_index(row.No), node_index(row.Missing)
+        depth[t, yes[t, n]] = depth[t, no[t, n]] = depth[t, n] + 1
+
+    importances = getattr(model, 'feature_importances_', None)
+
+    return TreeEnsemble(
+        feature=feature,
+        threshold=threshold,
+        yes=yes,
+        no=no,
+        missing=missing,
+        value=value,
+        base_score=_base_score(booster),
+        max_depth=int(depth.max()),
+        features=features,
+        feature_importances_=np.asarray(importances, dtype=np.float32) if importances is not None else None
+    )
@@ -2,6 +2,7 @@ import streamlit as st
 import database as db
 import auth
 import database_backup
+import model_registry
 import json
 from datetime import datetime
 from config import APP_CONFIG
@@ -230,6 +231,45 @@ def render_admin_tab():
         else:
             st.info("get_all_settings() inte implementerad ännu i database.py")
 
+        st.divider()
+
+        st.markdown("#### 🗂️ Modellversioner")
+        st.caption("Varje träning sparas som en egen version. Rollback byter aktiv version direkt, utan omträning, "
+                   "och låser den tills låsningen släpps.")
+
+        for registry_name, label in [('xgboost', 'XGBoost'), ('meml', 'MEML')]:
+            versions = model_registry.list_versions(registry_name)
+            if not versions:
+                st.info(f"Ingen {label}-modell publicerad ännu.")
+                continue
+
+            current = model_registry.get_current(registry_name) or {}
+            st.markdown(f"**{label}** – aktiv version: `{current.get('version')}`"
+                        f"{' 🔒 (låst efter rollback)' if current.get('pinned') else ''}")
+            st.dataframe([{
+                'Version': v['version'],
+                'Aktiv': '✅' if v['current'] else '',
+                'Tränad': v.get('trained_at'),
+                'Vattenmärke': v.get('watermark'),
+                **(v.get('metrics') or {}),
+            } for v in versions], use_container_width=True)
+
+            col_v1, col_v2, col_v3 = st.columns([2, 1, 1])
+            with col_v1:
+                target_version = st.selectbox(
+                    "Version", [v['version'] for v in versions],
+                    key=f'registry_version_{registry_name}'
+                )
+            with col_v2:
+                if st.button("↩️ Aktivera version", key=f'registry_rollback_{registry_name}'):
+                    model_registry.rollback(registry_name, target_version)
+                    st.success(f"✅ {label} version {target_version} är nu aktiv.")
+                    st.rerun()
+            with col_v3:
+                if current.get('pinned') and st.button("🔓 Släpp låsning", key=f'registry_unpin_{registry_name}'):
+                    model_registry.unpin(registry_name)
+                    st.rerun()
+
     # ========== TAB 3: SYSTEMSTATUS ==========
     with admin_tabs[2]:
         st.subheader("📊 Systemstatus")
@@ -1,12 +1,14 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
 import database as db
 import auth
 from calculation_engine import calculate_rule_based_dose
 from ml_model import predict_with_xgboost
 from callbacks import get_current_inputs, handle_save_and_learn
-from config import APP_CONFIG
+from config import APP_CONFIG, LÄKEMEDELS_DATA
 from validation import validate_recommended_dose
+from pharmacokinetics import resolve_drug_key, calculate_temporal_dose_curves
 
 def render_dosing_tab(specialties, procedures_df):
     # Load case if editing
@@ -124,7 +126,8 @@ def render_dosing_tab(specialties, procedures_df):
                 'unit': opioid_unit,
                 'time_relative_minutes': time_relative_minutes,
                 'administration_route': 'IV',
-                'notes': ''
+                'notes': '',
+                'drug_key': resolve_drug_key(opioid_drug.lower(), opioid_drug)
             })
             st.rerun()
 
@@ -158,6 +161,31 @@ def render_dosing_tab(specialties, procedures_df):
                                 st.session_state.temporal_doses.pop(i)
                                 st.rerun()
                                 break
+
+            with st.expander("📈 Kvarvarande opioid och adjuvanttäckning (0–6 h postop)"):
+                curves = calculate_temporal_dose_curves(
+                    st.session_state.temporal_doses, np.arange(0, 361), LÄKEMEDELS_DATA
+                )
+                three_compartment = APP_CONFIG.get('FENTANYL_PK_MODEL') == 'three_compartment'
+                st.caption("Fentanyl-ekvivalenter (µg) per minut efter opslut, bi-exponentiell modell"
+                           + (" (dosjusteringen använder trekompartmentmodellen)" if three_compartment else ""))
+                st.line_chart(pd.DataFrame(
+                    {'Kvarvarande opioid (µg)': curves['fentanyl_equivalent_mcg']},
+                    index=pd.Index(curves['times'], name='min postop')
+                ))
+                if curves['fentanyl_effect_site_ng_ml'].any():
+                    st.caption("Fentanyl i effektkompartmentet (ng/ml, trekompartmentmodell"
+                               + (")" if three_compartment else ", endast information – påverkar inte dosen)"))
+                    st.line_chart(pd.DataFrame(
+                        {'Fentanyl Ce (ng/ml)': curves['fentanyl_effect_site_ng_ml']},
+                        index=pd.Index(curves['times'], name='min postop')
+                    ))
+                if curves['adjuvant_effects']:
+                    st.caption("Adjuvanteffekt (0–1)")
+                    st.line_chart(pd.DataFrame(
+                        {LÄKEMEDELS_DATA[key]['name']: effect for key, effect in curves['adjuvant_effects'].items()},
+                        index=pd.Index(curves['times'], name='min postop')
+                    ))
     st.divider()
 
     # Adjuvanter - Full-width layout
@@ -225,11 +253,9 @@ def render_dosing_tab(specialties, procedures_df):
         regel_calc = calculate_rule_based_dose(current_inputs, procedures_df, temporal_doses)
         regel_dose = regel_calc.get('finalDose', 0.0)
 
-        all_cases = db.get_all_cases()
-        cases_df_ml = pd.DataFrame(all_cases) if all_cases else pd.DataFrame()
         num_proc_cases = 0
-        if not cases_df_ml.empty and 'procedure_id' in cases_df_ml.columns and current_inputs.get('procedure_id'):
-            num_proc_cases = len(cases_df_ml[cases_df_ml['procedure_id'] == current_inputs['procedure_id']])
+        if current_inputs.get('procedure_id'):
+            num_proc_cases = db.get_procedure_case_stats(current_inputs['procedure_id'])['total']
 
         if num_proc_cases >= APP_CONFIG['ML_THRESHOLD_PER_PROCEDURE']:
             # Add temporal doses to current_inputs for ML
@@ -253,14 +279,8 @@ def render_dosing_tab(specialties, procedures_df):
         engine = calc.get('engine', "Väntar på beräkning...")
 
         current_inputs = get_current_inputs(procedures_df)
-        all_cases = db.get_all_cases()
-        cases_df_confidence = pd.DataFrame(all_cases) if all_cases else pd.DataFrame()
-
-        num_total_cases = len(cases_df_confidence) if not cases_df_confidence.empty else 0
-        num_proc_cases = 0
-        if not cases_df_confidence.empty and 'procedure_id' in cases_df_confidence.columns:
-            proc_cases_df = cases_df_confidence[cases_df_confidence['procedure_id'] == current_inputs['procedure_id']]
-            num_proc_cases = len(proc_cases_df)
+        num_total_cases = db.get_total_case_count()
+        num_proc_cases = db.get_procedure_case_stats(current_inputs['procedure_id'])['total'] if current_inputs.get('procedure_id') else 0
 
         user_id = auth.get_current_user_id()
         composite_key = calc.get('compositeKey', '')
@@ -335,6 +355,11 @@ def render_dosing_tab(specialties, procedures_df):
                 for warning in bmi_warnings:
                     st.warning(warning)
 
+        if calc.get('dose_response_curve') is not None:
+            with st.expander("📉 Dos-responskurva (ML)"):
+                st.line_chart(calc['dose_response_curve'].set_index('dose')['predicted_vas'])
+                st.caption("Predicerad VAS per dos för denna patient")
+
         if 'feature_importance' in calc and calc['feature_importance'] is not None:
             with st.expander("🔬 Feature Importance - Vilka faktorer påverkar mest?"):
                 feat_imp = calc['feature_importance'].head(10)
@@ -348,14 +373,8 @@ def render_dosing_tab(specialties, procedures_df):
     if st.session_state.current_calculation:
         calc = st.session_state.current_calculation
         current_inputs = get_current_inputs(procedures_df)
-        all_cases = db.get_all_cases()
-        cases_df_log = pd.DataFrame(all_cases) if all_cases else pd.DataFrame()
-
-        num_total_cases = len(cases_df_log) if not cases_df_log.empty else 0
-        num_proc_cases = 0
-        if not cases_df_log.empty and 'procedure_id' in cases_df_log.columns:
-            proc_cases = cases_df_log[cases_df_log['procedure_id'] == current_inputs['procedure_id']]
-            num_proc_cases = len(proc_cases)
+        num_total_cases = db.get_total_case_count()
+        num_proc_cases = db.get_procedure_case_stats(current_inputs['procedure_id'])['total'] if current_inputs.get('procedure_id') else 0
 
         user_id = auth.get_current_user_id()
         composite_key = calc.get('compositeKey', '')
@@ -1,56 +1,34 @@
 import streamlit as st
-import pandas as pd
 import database as db
 import auth
+import case_export
 from datetime import datetime
-from io import BytesIO
 
 def render_history_tab(procedures_df):
     st.header("📊 Historik & Statistik")
 
+    has_cases = bool(db.query_cases(limit=1)['cases'])
+
     col_header1, col_header2 = st.columns([3, 1])
     with col_header1:
         st.subheader("Sparade Fall i Databasen")
     with col_header2:
-        all_cases = db.get_all_cases()
-        if all_cases:
-            export_df = pd.DataFrame(all_cases)
-            if 'timestamp' in export_df.columns:
-                export_df['timestamp'] = export_df['timestamp'].apply(lambda x: x.strftime('%Y-%m-%d %H:%M:%S') if isinstance(x, datetime) else x)
-            if 'last_modified' in export_df.columns:
-                export_df['last_modified'] = export_df['last_modified'].apply(lambda x: x.strftime('%Y-%m-%d %H:%M:%S') if isinstance(x, datetime) else x)
-
-            export_df['procedure_name'] = export_df['procedure_id'].apply(
-                lambda x: procedures_df.loc[procedures_df['id'] == x, 'name'].iloc[0] if x and x in procedures_df['id'].values else 'Okänt'
-            )
-
-            export_df['created_by_name'] = export_df['user_id'].apply(
-                lambda x: db.get_user_by_id(x)['username'] if db.get_user_by_id(x) else 'Okänd'
-            )
-
-            export_cols = ['timestamp', 'procedure_name', 'age', 'sex', 'weight', 'height', 'bmi', 'ibw', 'abw',
-                          'asa', 'opioidHistory', 'lowPainThreshold', 'optime_minutes', 'fentanylDose',
-                          'nsaid', 'catapressan', 'droperidol', 'ketamine', 'lidocaine', 'betapred',
-                          'givenDose', 'vas', 'uvaDose', 'postop_minutes', 'postop_reason', 'respiratory_status', 'severe_fatigue',
-                          'created_by_name', 'last_modified']
-            export_df_filtered = export_df[[col for col in export_cols if col in export_df.columns]]
-
-            buffer = BytesIO()
-            with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
-                export_df_filtered.to_excel(writer, sheet_name='Fall', index=False)
-            buffer.seek(0)
-
-            st.download_button(
-                label="📥 Exportera till Excel",
-                data=buffer,
-                file_name=f"anestesi_fall_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                use_container_width=True
-            )
-
-    all_cases = db.get_all_cases()
-    num_cases = len(all_cases)
-    if num_cases > 0:
+        # Exporten byggs först på begäran och cachas per dataversion (case_export)
+        if has_cases:
+            export_data = case_export.get_cases_excel(procedures_df, build=False)
+            if export_data is None and st.button("📥 Exportera till Excel", key="build_export", use_container_width=True):
+                with st.spinner("Skapar Excel-fil..."):
+                    export_data = case_export.get_cases_excel(procedures_df)
+            if export_data is not None:
+                st.download_button(
+                    label="💾 Ladda ner Excel",
+                    data=export_data,
+                    file_name=f"anestesi_fall_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    use_container_width=True
+                )
+
+    if has_cases:
         st.markdown("**Klicka på ett fall för att redigera det**")
 
         filter_cols = st.columns(6)
@@ -67,58 +45,52 @@ def render_history_tab(procedures_df):
         with filter_cols[5]:
             max_results = st.number_input("Visa antal", 5, 100, 10, 5, key="max_results")
 
-        filtered_cases = []
-        for case in all_cases:
-            case_user = db.get_user_by_id(case['user_id'])
-            case_username = case_user['username'] if case_user else 'Okänd'
-
-            if search_user and search_user.lower() not in case_username.lower():
-                continue
-            if search_procedure != "Alla":
-                proc_name = procedures_df.loc[procedures_df['id'] == case.get('procedure_id'), 'name'].iloc[0] if case.get('procedure_id') and case.get('procedure_id') in procedures_df['id'].values else 'Okänt'
-                if proc_name != search_procedure:
-                    continue
-
-            # Filter by status
-            case_status = case.get('status', 'IN_PROGRESS')
-            if status_filter == "Pågående" and case_status != 'IN_PROGRESS':
-                continue
-            elif status_filter == "Slutförda" and case_status != 'FINALIZED':
-                continue
-
-            if case.get('vas', 0) < min_vas:
-                continue
-
-            if show_incomplete:
-                is_incomplete = (case.get('vas', 3) == 3 and
-                               case.get('uvaDose', 0) == 0 and
-                               case.get('postop_minutes', 0) == 0)
-                if not is_incomplete:
-                    continue
-
-            filtered_cases.append(case)
-
-        st.caption(f"Visar {min(len(filtered_cases), max_results)} av {len(filtered_cases)} matchande fall (totalt {num_cases} fall)")
-
-        if auth.is_admin() and show_incomplete and len(filtered_cases) > 0:
-            st.warning(f"⚠️ Admin: {len(filtered_cases)} ofullständiga fall hittades")
-            if st.button(f"🗑️ Radera alla {len(filtered_cases)} ofullständiga fall", type="secondary"):
-                for case in filtered_cases:
-                    db.delete_case(case['id'])
-                st.success(f"Raderade {len(filtered_cases)} ofullständiga fall!")
+        # Filtren körs i SQL (db.query_cases), endast en sida hämtas åt gången
+        filters = {
+            'username_contains': search_user or None,
+            'procedure_ids': procedures_df.loc[procedures_df['name'] == search_procedure, 'id'].tolist() if search_procedure != "Alla" else None,
+            'status': {'Pågående': 'IN_PROGRESS', 'Slutförda': 'FINALIZED'}.get(status_filter),
+            'min_vas': min_vas,
+            'incomplete': show_incomplete,
+        }
+
+        # Keyset-paginering: stack av cursors, nollställs när filtren ändras
+        filter_key = (search_user, search_procedure, status_filter, min_vas, show_incomplete, max_results)
+        if st.session_state.get('history_filter_key') != filter_key:
+            st.session_state.history_filter_key = filter_key
+            st.session_state.history_cursors = [None]
+
+        page = db.query_cases(filters, after_cursor=st.session_state.history_cursors[-1], limit=max_results)
+        page_cases = page['cases']
+        page_number = len(st.session_state.history_cursors)
+
+        st.caption(f"Visar {len(page_cases)} matchande fall (sida {page_number})")
+
+        if auth.is_admin() and show_incomplete and page_cases:
+            num_incomplete = db.count_cases(filters)
+            st.warning(f"⚠️ Admin: {num_incomplete} ofullständiga fall hittades")
+            if st.button(f"🗑️ Radera alla {num_incomplete} ofullständiga fall", type="secondary"):
+                cursor = None
+                while True:
+                    batch = db.query_cases(filters, after_cursor=cursor, limit=500)
+                    for case in batch['cases']:
+                        db.delete_case(case['id'])
+                    cursor = batch['next_cursor']
+                    if cursor is None:
+                        break
+                st.session_state.history_cursors = [None]
+                st.success(f"Raderade {num_incomplete} ofullständiga fall!")
                 st.rerun()
 
-        for case in filtered_cases[:max_results]:
+        for case in page_cases:
             proc_name = procedures_df.loc[procedures_df['id'] == case.get('procedure_id'), 'name'].iloc[0] if case.get('procedure_id') and case.get('procedure_id') in procedures_df['id'].values else 'Okänt'
             timestamp_str = case['timestamp'].strftime('%Y-%m-%d %H:%M')
 
-            case_user = db.get_user_by_id(case['user_id'])
-            created_by = case_user['username'] if case_user else 'Okänd'
+            created_by = case.get('created_by_name') or 'Okänd'
 
             edited_info = ""
             if case.get('last_modified'):
-                last_mod_user = db.get_user_by_id(case.get('last_modified_by'))
-                last_mod_name = last_mod_user['username'] if last_mod_user else 'Okänd'
+                last_mod_name = case.get('last_modified_by_name') or 'Okänd'
                 edited_info = f" (Senast redigerat: {case['last_modified'].strftime('%Y-%m-%d %H:%M')} av {last_mod_name})"
 
             col1, col2, col3, col4, col5, col6, col7 = st.columns([2, 3, 1, 1, 1, 1, 1])
@@ -240,6 +212,18 @@ def render_history_tab(procedures_df):
 
             st.divider()
 
+        nav_prev, nav_info, nav_next = st.columns([1, 2, 1])
+        with nav_prev:
+            if page_number > 1 and st.button("← Föregående", key="history_prev_page", use_container_width=True):
+                st.session_state.history_cursors.pop()
+                st.rerun()
+        with nav_info:
+            st.caption(f"Sida {page_number}")
+        with nav_next:
+            if page['next_cursor'] is not None and st.button("Nästa →", key="history_next_page", use_container_width=True):
+                st.session_state.history_cursors.append(page['next_cursor'])
+                st.rerun()
+
         if st.session_state.editing_case_id is not None:
             st.info(f"🔄 Du redigerar nu fall. När du sparar kommer fallet att uppdateras, inte dupliceras.")
             if st.button("❌ Avbryt redigering"):
@@ -17,12 +17,13 @@ def render_learning_tab(procedures_df):
         st.subheader("ML-Modellens Aktiveringsstatus")
         st.markdown(f"XGBoost-modellen aktiveras för ett specifikt ingrepp när **{APP_CONFIG['ML_THRESHOLD_PER_PROCEDURE']}** fall har loggats för det.")
 
-        all_cases = db.get_all_cases()
-        cases_df_stat = pd.DataFrame(all_cases) if all_cases else pd.DataFrame()
+        procedure_stats = db.get_all_procedure_case_stats()
 
-        if not cases_df_stat.empty and 'procedure_id' in cases_df_stat.columns:
-            case_counts = cases_df_stat['procedure_id'].value_counts().reset_index()
-            case_counts.columns = ['id', 'Antal Fall']
+        if procedure_stats:
+            case_counts = pd.DataFrame(
+                [(proc_id, stats['total']) for proc_id, stats in procedure_stats.items()],
+                columns=['id', 'Antal Fall']
+            )
 
             status_df = procedures_df.merge(case_counts, on='id', how='left').fillna(0)
             status_df['Antal Fall'] = status_df['Antal Fall'].astype(int)
@@ -204,9 +205,8 @@ def render_learning_tab(procedures_df):
 
             st.markdown("### Aktivitet per användare")
             if 'user_id' in cases_df_analysis.columns:
-                cases_df_analysis['created_by_name'] = cases_df_analysis['user_id'].apply(
-                    lambda x: db.get_user_by_id(x)['username'] if db.get_user_by_id(x) else 'Okänd'
-                )
+                usernames = {uid: user['username'] for uid, user in db.get_users_by_ids(cases_df_analysis['user_id']).items()}
+                cases_df_analysis['created_by_name'] = cases_df_analysis['user_id'].map(usernames).fillna('Okänd')
                 user_stats = cases_df_analysis.groupby('created_by_name').agg({
                     'procedure_id': 'count',
                     'vas': 'mean',